@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from ticket_inventory import TicketInventory
+
+# Inventory sizes to measure, from the experiment's 25 seats up to a large on-sale
+sizes = [25, 1000, 100000, 1000000]
+samples = 20000  # BUY calls timed per size
+
+
+def make_tickets(count):
+    """ Builds a ticket database shaped like the one in server-0-10.py. """
+    return {f"{10000 + i}": {"price": random.randint(200, 400), "sold": False} for i in range(count)}
+
+
+def legacy_buy(tickets, user_balance):
+    """ The original linear scan from handle_client, kept for comparison. """
+    response = "SOLDOUT"
+    for ticket, details in tickets.items():
+        if not details['sold']:
+            if user_balance >= details['price']:
+                details['sold'] = True
+                response = f"{ticket} {details['price']}"
+                break
+            else:
+                response = "NOFUNDS"
+        else:
+            response = "SOLDOUT"
+    return response
+
+
+def time_buys(buy, sell, rounds):
+    """ Times BUY calls; every bought ticket is sold back so the inventory size stays constant. """
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        response = buy(4000)
+        latencies.append(time.perf_counter_ns() - start)
+        sell(response.split()[0])
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def sell_half(tickets):
+    """ Sells the first half of the tickets, the state that makes the linear scan slow. """
+    for ticket in list(tickets)[:len(tickets) // 2]:
+        tickets[ticket]['sold'] = True
+
+
+def make_inventory(tickets):
+    """ Loads the same prices into a TicketInventory and sells half of its tickets. """
+    inventory = TicketInventory([details['price'] for details in tickets.values()])
+    for _ in range(len(tickets) // 2):
+        inventory.buy(4000)
+    return inventory
+
+
+def main():
+    print(f"{'tickets':>10} {'index mean':>12} {'index p99':>12} {'scan mean':>12} {'scan p99':>12}  (ns per BUY, half sold)")
+    for count in sizes:
+        tickets = make_tickets(count)
+        sell_half(tickets)
+        inventory = make_inventory(tickets)
+        index_mean, index_p99 = time_buys(inventory.buy, inventory.sell, samples)
+
+        def legacy_sell(ticket):
+            tickets[ticket]['sold'] = False
+
+        # The scan is O(n), so only a handful of calls are timed at the large sizes
+        scan_mean, scan_p99 = time_buys(lambda balance: legacy_buy(tickets, balance), legacy_sell,
+                                        max(10, min(samples, 10000000 // count)))
+        print(f"{count:>10} {index_mean:>12.0f} {index_p99:>12.0f} {scan_mean:>12.0f} {scan_p99:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ticket_metrics import LatencyHistogram
+from ticket_protocol import RequestPipeline, negotiate_client
+
+server_port = 12345  # Port hard-coded in server-0-10.py
+modes = ["threaded", "asyncio"]
+polite_clients = 8
+greedy_window = 64  # Requests the greedy client keeps in flight
+duration = 5.0
+
+
+def greedy(connection, stop, served):
+    """ Pipelines BUYs as fast as the server answers them, like a client looping on the socket. """
+    pipeline = RequestPipeline(connection, greedy_window)
+    while not stop.is_set():
+        # A zero balance always gets NOFUNDS, so the inventory never runs out during the run
+        pipeline.submit("BUY 0", lambda reply: served.append(1))
+    pipeline.drain()
+
+
+def polite(connection, stop, histogram):
+    """ One BUY round trip at a time, timing each. """
+    while not stop.is_set():
+        start = time.perf_counter_ns()
+        connection.send("BUY 0")
+        connection.recv()
+        histogram.record(time.perf_counter_ns() - start)
+
+
+def run(mode):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server-0-10.py")
+    with tempfile.TemporaryDirectory() as log_dir:
+        server = subprocess.Popen([sys.executable, script], cwd=log_dir, stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server.stdin.write(f"bench\nfairness\n{mode}\n".encode())
+        server.stdin.close()
+        time.sleep(1.0)
+
+        connections = [negotiate_client(socket.create_connection(('localhost', server_port)))
+                       for _ in range(polite_clients + 1)]
+        stop = threading.Event()
+        served = []
+        histograms = [LatencyHistogram() for _ in range(polite_clients)]
+        threads = [threading.Thread(target=greedy, args=(connections[0], stop, served))]
+        threads += [threading.Thread(target=polite, args=(connection, stop, histogram))
+                    for connection, histogram in zip(connections[1:], histograms)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for connection in connections:
+            connection.close()
+        server.wait(timeout=30)
+
+    merged = LatencyHistogram()
+    for histogram in histograms:
+        merged.merge(histogram)
+    rates = [len(served) / duration] + [histogram.total / duration for histogram in histograms]
+    jain = sum(rates) ** 2 / (len(rates) * sum(rate * rate for rate in rates))
+    print(f"{mode:>9} {rates[0]:>12.0f} {sum(rates[1:]) / polite_clients:>12.0f} {merged.percentile(0.5) / 1e6:>8.2f}"
+          f" {merged.percentile(0.99) / 1e6:>8.2f} {jain:>6.2f}")
+
+
+def main():
+    print(f"1 greedy client with {greedy_window} BUYs in flight, {polite_clients} polite clients with 1, {duration:.0f} s")
+    print(f"{'server':>9} {'greedy req/s':>12} {'polite req/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'Jain':>6}")
+    for mode in modes:
+        run(mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import random
+import time
+
+from inventory_feed import InventoryFeed
+from ticket_inventory import ShardedTicketInventory
+
+sizes = [1000, 100000, 1000000]
+changes_per_interval = [0, 10, 1000]
+runs = 20
+
+
+def churn(inventory, changes):
+    """ BUY/SELL traffic between two feed runs; returns how many messages a push per change would have sent. """
+    held = []
+    for _ in range(changes):
+        if held and random.random() < 0.5:
+            inventory.sell(held.pop(random.randrange(len(held))))
+        else:
+            response = inventory.buy(10 ** 9)
+            if response != "SOLDOUT":
+                held.append(response.split()[0])
+    return changes
+
+
+def time_feed(size, changes):
+    """ Microseconds per publish() and deltas per run, against the changes a per-event push would send. """
+    inventory = ShardedTicketInventory([random.randint(200, 400) for _ in range(size)])
+    for _ in range(size // 2):
+        inventory.buy(10 ** 9)  # Half sold, so the bitsets are not trivially uniform
+    frames = []
+    feed = InventoryFeed(inventory)
+    feed.attach("subscriber", frames.append)
+    feed.subscribe("subscriber")
+    elapsed = deltas = pushed = 0
+    for _ in range(runs):
+        pushed += churn(inventory, changes)
+        start = time.perf_counter_ns()
+        deltas += feed.publish()
+        elapsed += time.perf_counter_ns() - start
+    return elapsed / runs / 1000, deltas / runs, pushed / runs, len(frames) / runs
+
+
+def main():
+    print(f"{'tickets':>8} {'changes':>8} {'publish us':>11} {'deltas':>7} {'frames':>7}")
+    for size in sizes:
+        for changes in changes_per_interval:
+            micros, deltas, pushed, frames = time_feed(size, changes)
+            print(f"{size:>8} {pushed:>8.0f} {micros:>11.1f} {deltas:>7.0f} {frames:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import random
+import tracemalloc
+
+from ticket_inventory import TicketInventory
+
+count = 1000000  # Tickets per report, the footprint is quoted per million seats
+
+
+def measure(build):
+    """ Returns the bytes still allocated by build() once it has returned its result. """
+    tracemalloc.start()
+    result = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def main():
+    prices = [random.randint(200, 400) for _ in range(count)]
+
+    tickets, dict_bytes, dict_peak = measure(
+        lambda: {f"{10000 + i}": {"price": price, "sold": False} for i, price in enumerate(prices)})
+    del tickets
+    inventory, array_bytes, array_peak = measure(lambda: TicketInventory(prices))
+
+    print(f"Memory footprint per {count:,} tickets:")
+    print(f"  dict of dicts:   {dict_bytes / 2 ** 20:8.1f} MiB ({dict_bytes / count:6.1f} bytes/ticket), peak {dict_peak / 2 ** 20:.1f} MiB")
+    print(f"  TicketInventory: {array_bytes / 2 ** 20:8.1f} MiB ({array_bytes / count:6.1f} bytes/ticket), peak {array_peak / 2 ** 20:.1f} MiB")
+    print(f"  prices {inventory.prices.itemsize} B/ticket, sold bitset 1/8 B/ticket, price index {inventory._order.itemsize} B/ticket")
+
+
+if __name__ == "__main__":
+    main()
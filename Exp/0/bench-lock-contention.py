@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+from ticket_inventory import ShardedTicketInventory, TicketInventory
+
+ticket_count = 100000
+client_counts = [2, 16, 128]
+operations = 200000  # BUY + SELL operations per run, split across the clients
+held_per_client = 4  # Tickets a client holds before it sells the oldest one back
+
+
+class SingleLockInventory:
+    """ The previous server setup: one TicketInventory behind one global lock. """
+
+    def __init__(self, prices):
+        self.inventory = TicketInventory(prices)
+        self.lock = threading.Lock()
+
+    def buy(self, user_balance):
+        with self.lock:
+            return self.inventory.buy(user_balance)
+
+    def sell(self, ticket_number):
+        with self.lock:
+            return self.inventory.sell(ticket_number)
+
+    def items(self):
+        return self.inventory.items()
+
+
+def client(inventory, rounds, held, start_barrier):
+    """ Buys tickets and sells back the oldest one it holds, like a busy trading client. """
+    start_barrier.wait()
+    for _ in range(rounds):
+        response = inventory.buy(4000)
+        if response not in ("SOLDOUT", "NOFUNDS"):
+            held.append(response.split()[0])
+        if len(held) > held_per_client:
+            inventory.sell(held.pop(0))
+
+
+def run(inventory, clients):
+    """ Runs the clients against one inventory; returns operations/sec after checking for double sales. """
+    holdings = [[] for _ in range(clients)]
+    start_barrier = threading.Barrier(clients + 1)
+    rounds = operations // clients // 2
+    threads = [threading.Thread(target=client, args=(inventory, rounds, holdings[i], start_barrier))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    held = [ticket for holding in holdings for ticket in holding]
+    sold = [ticket for ticket, price, is_sold in inventory.items() if is_sold]
+    assert len(held) == len(set(held)), "a ticket was sold to two clients"
+    assert sorted(held) == sorted(sold), "sold flags disagree with what the clients hold"
+    return rounds * clients * 2 / elapsed
+
+
+def main():
+    prices = [random.randint(200, 400) for _ in range(ticket_count)]
+    print(f"{'clients':>8} {'single lock ops/s':>18} {'1 shard ops/s':>14} {'64 shards ops/s':>16} {'speedup':>8}")
+    for clients in client_counts:
+        single = run(SingleLockInventory(prices), clients)
+        one_shard = run(ShardedTicketInventory(prices, shards=1), clients)  # The server's default
+        sharded = run(ShardedTicketInventory(prices, shards=64), clients)
+        print(f"{clients:>8} {single:>18.0f} {one_shard:>14.0f} {sharded:>16.0f} {sharded / single:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
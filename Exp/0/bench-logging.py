@@ -0,0 +1,66 @@
+import logging
+import os
+import random
+import tempfile
+import time
+
+from ticket_inventory import TicketInventory
+from ticket_logging import setup_queued_logging
+
+requests = 100000
+
+
+def serve(inventory):
+    """ The per-request work of handle_client: one BUY plus its received/sent DEBUG lines. """
+    address = ('127.0.0.1', 50000)
+    data = "BUY 4000"
+    logging.debug("Received from %s: %s", address, data)
+    response = inventory.buy(4000)
+    logging.debug("Sent to %s: %s", address, response)
+    if response != "SOLDOUT":
+        inventory.sell(response.split()[0])
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def run(log_path, console, queued, level=logging.DEBUG):
+    """ Returns (requests/sec on the request path, requests/sec until the log is on disk, records dropped). """
+    handlers = [logging.FileHandler(log_path), logging.StreamHandler(console)]
+    listener = None
+    if queued:
+        listener = setup_queued_logging(handlers=handlers, level=level)
+    else:
+        logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s',
+                            datefmt='%Y-%m-%d %H:%M:%S', handlers=handlers, force=True)
+
+    inventory = TicketInventory([random.randint(200, 400) for _ in range(25)])
+    start = time.perf_counter()
+    for _ in range(requests):
+        serve(inventory)
+    served = time.perf_counter() - start
+    if listener is not None:
+        listener.stop()
+    written = time.perf_counter() - start
+    dropped = listener.queue_handler.dropped if listener is not None else 0
+    reset_logging()
+    return requests / served, requests / written, dropped
+
+
+def main():
+    with tempfile.TemporaryDirectory() as log_dir, open(os.devnull, 'w') as console:
+        log_path = os.path.join(log_dir, "bench.log")
+        print(f"{requests} BUY requests with DEBUG logging to a file and the console (sent to {os.devnull})")
+        print(f"{'setup':>10} {'request path req/s':>20} {'until written req/s':>20} {'records dropped':>16}")
+        # At INFO the DEBUG calls return before building a record, which their lazy arguments make nearly free
+        for name, queued, level in (("sync", False, logging.DEBUG), ("queued", True, logging.DEBUG), ("INFO only", True, logging.INFO)):
+            served, written, dropped = run(log_path, console, queued, level)
+            print(f"{name:>10} {served:>20.0f} {written:>20.0f} {dropped:>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import gc
+import importlib.util
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from ticket_metrics import MetricsRegistry
+
+requests = 5000
+rounds = 101
+
+# Lock timing settings compared: the server's lock_timing_sample, 0 for plain locks
+lock_samples = (0, 256, 64, 16, 1)
+
+
+class NullHistogram:
+    def record(self, value):
+        pass
+
+
+class NullMetrics(MetricsRegistry):
+    """ A registry that records nothing: the baseline the server's metrics are measured against. """
+
+    def count(self, name, amount=1):
+        pass
+
+    def histogram(self, name):
+        return NullHistogram()
+
+
+def load_server():
+    """ Imports server-0-10.py as a module, answering its program-name prompts, which only name its log file. """
+    sys.stdin = io.StringIO("bench\nmetrics\n")
+    spec = importlib.util.spec_from_file_location("ticket_server", os.path.join(os.path.dirname(os.path.abspath(__file__)), "server-0-10.py"))
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    sys.stdin = sys.__stdin__
+    logging.getLogger().setLevel(logging.WARNING)  # bench-logging.py measures the log calls
+    server.client_rate = None  # One connection sends everything here; unthrottled, the bench times the scheduler itself
+    return server
+
+
+def build(server, metrics, sample):
+    """ The state start_server builds, without its background threads, recording into metrics. """
+    server.metrics = metrics
+    server.lock_timing_sample = sample
+    server.inventory = server.ShardedTicketInventory(server.ticket_prices, server.inventory_shards,
+                                                     lock_factory=server.timed_locks(threading.Lock))
+    server.peers = server.PeerRegistry(server.max_registered_peers)
+    server.market = server.ResaleBook(server.record_resale)
+    server.feed = server.InventoryFeed(server.inventory, server.market, server.market_lock)
+    server.waitlist = server.Waitlist(server.max_waitlist)
+    server.holds = server.SeatHolds(server.inventory, server.hold_seconds, take=server.waitlist.take, handed_off=server.hand_off)
+    server.room = server.WaitingRoom(server.admission_rate, server.admission_burst, server.max_admitted, server.queue_report_interval)
+    server.scheduler = server.build_scheduler(server.dispatch_slots)
+    server.keyed_responses = server.IdempotencyCache(server.idempotency_capacity, server.idempotency_ttl)
+
+
+def serve(server, count):
+    """ handle_client's request path for count alternating BUYs and SELLs; returns the ns taken per request. """
+    address = ('127.0.0.1', 50000)
+    granted = threading.Event()
+    frames = ["BUY 4000", None] * (count // 2)
+    gc.disable()  # As timeit does: a collection landing in one setting's run is not that setting's cost
+    start = time.perf_counter_ns()
+    for frame in frames:
+        frame = frame or f"SELL {response.split()[0]}"
+        data, deadline = server.split_deadline(frame)
+        server.scheduler.wait_turn(address, server.command_cost(data), granted, deadline)
+        try:
+            response = server.process_frame(data, address)
+        finally:
+            server.scheduler.done()
+    elapsed = time.perf_counter_ns() - start
+    gc.enable()
+    return elapsed / count
+
+
+def main():
+    with tempfile.TemporaryDirectory() as log_dir:
+        os.chdir(log_dir)
+        server = load_server()
+        # Each round runs every setting once, back to back and starting one setting later than the last round, and a
+        # setting's cost is its median difference from the baseline in the same round, so the machine's speed drifting
+        # between rounds cancels out
+        setups = [(NullMetrics, 0)] + [(MetricsRegistry, sample) for sample in lock_samples]
+        times = [[] for _ in setups]
+        for round_number in range(rounds):
+            for offset in range(len(setups)):
+                index = (round_number + offset) % len(setups)
+                registry, sample = setups[index]
+                build(server, registry(), sample)
+                times[index].append(serve(server, requests))
+        print(f"{rounds} rounds of {requests} BUY/SELL requests through the scheduler and process_frame")
+        print(f"Without metrics: {statistics.median(times[0]):.0f} ns per request")
+        for (_, sample), recorded in zip(setups[1:], times[1:]):
+            overhead = statistics.median(run - base for run, base in zip(recorded, times[0]))
+            timing = f"1 in {sample} lock acquisitions timed" if sample else "locks untimed"
+            print(f"With metrics, {timing}: {statistics.median(recorded):.0f} ns per request, {overhead:+.0f} ns for the metrics")
+        server.log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
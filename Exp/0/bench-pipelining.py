@@ -0,0 +1,86 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ticket_protocol import RequestPipeline, negotiate_client
+
+server_port = 12345  # Port hard-coded in server-0-10.py
+proxy_port = 12400
+link_delay = 0.002  # Seconds added in each direction by the loopback proxy, i.e. a 4 ms round trip
+windows = [1, 8, 64]
+requests_per_window = 2000
+
+
+async def forward(reader, writer, delay):
+    """ Copies one direction of a connection, delivering every chunk delay seconds after it arrived. """
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        loop.call_later(delay, writer.write, data)
+    loop.call_later(delay, writer.close)
+
+
+async def run_proxy(ready):
+    """ TCP proxy in front of the server that adds link_delay to each direction. """
+    async def on_connect(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection('localhost', server_port)
+        await asyncio.gather(forward(client_reader, server_writer, link_delay),
+                             forward(server_reader, client_writer, link_delay))
+
+    proxy = await asyncio.start_server(on_connect, 'localhost', proxy_port)
+    ready.set()
+    async with proxy:
+        await proxy.serve_forever()
+
+
+def measure(connection, window):
+    """ Requests/sec for requests_per_window BUYs with up to window of them in flight. """
+    pipeline = RequestPipeline(connection, window)
+    replies = []
+    start = time.perf_counter()
+    for _ in range(requests_per_window):
+        # A zero balance always gets NOFUNDS, so the inventory never runs out during the run
+        pipeline.submit("BUY 0", replies.append)
+    pipeline.drain()
+    elapsed = time.perf_counter() - start
+    assert replies == ["NOFUNDS"] * requests_per_window
+    return requests_per_window / elapsed
+
+
+def main():
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server-0-10.py")
+    with tempfile.TemporaryDirectory() as log_dir:
+        server = subprocess.Popen([sys.executable, script], cwd=log_dir, stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server.stdin.write(b"bench\npipelining\nthreaded\n")
+        server.stdin.close()
+        time.sleep(1.0)
+
+        ready = threading.Event()
+        threading.Thread(target=lambda: asyncio.run(run_proxy(ready)), daemon=True).start()
+        ready.wait()
+
+        # The server waits for two clients before it starts serving
+        idle_client = negotiate_client(socket.create_connection(('localhost', server_port)))
+        connection = negotiate_client(socket.create_connection(('localhost', proxy_port)))
+        assert connection.framed
+
+        print(f"Loopback with {link_delay * 2000:.0f} ms added round trip, {requests_per_window} BUYs per run")
+        print(f"{'in flight':>10} {'requests/s':>12}")
+        for window in windows:
+            print(f"{window:>10} {measure(connection, window):>12.0f}")
+
+        connection.close()
+        idle_client.close()
+        server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import random
+import time
+
+from resale_market import ResaleBook
+
+clients = 200
+tickets = 20000
+operations = 500000
+mix = {"ASK": 40, "BID": 40, "CANCEL": 15, "FILLS": 5}
+
+
+def dispatch(book, owner, data):
+    """ The resale branches of the server's process_command, so the replay pays for parsing too. """
+    cmd, *args = data.split()
+    if cmd == "ASK":
+        return book.ask(owner, args[0], int(args[1]))
+    elif cmd == "BID":
+        return book.bid(owner, int(args[0]))
+    elif cmd == "CANCEL":
+        return book.cancel(owner, int(args[0]))
+    elif cmd == "FILLS":
+        return " ".join(["FILLS"] + book.take_fills(owner))
+
+
+def fresh_book():
+    book = ResaleBook()
+    for ticket in range(tickets):
+        book.acquire(str(10000 + ticket), ticket % clients)
+    return book
+
+
+def script():
+    """ A valid order flow, recorded against a scratch book: asks only on owned tickets, cancels of real orders. """
+    book = fresh_book()
+    ticket_numbers = list(book.owners)
+    placed = []
+    commands = []
+    operation_names, weights = list(mix), list(mix.values())
+    for operation in random.choices(operation_names, weights, k=operations):
+        ticket_number = random.choice(ticket_numbers)
+        if operation == "ASK" and ticket_number not in book.asked:
+            commands.append((book.owners[ticket_number], f"ASK {ticket_number} {random.randint(200, 400)}"))
+        elif operation == "CANCEL" and placed:
+            order_id = random.choice(placed[-1000:])
+            order = book.orders.get(order_id)
+            commands.append((order[0] if order else 0, f"CANCEL {order_id}"))
+        elif operation == "FILLS":
+            commands.append((random.randrange(clients), "FILLS"))
+        else:
+            commands.append((random.randrange(clients), f"BID {random.randint(200, 400)}"))
+        reply = dispatch(book, *commands[-1])
+        if reply.startswith("ASKED") or reply.startswith("BIDDING"):
+            placed.append(int(reply.split()[1]))
+    return commands
+
+
+def main():
+    commands = script()
+    book = fresh_book()
+    trades = 0
+    start = time.perf_counter()
+    for owner, data in commands:
+        if dispatch(book, owner, data).startswith("FILLED"):
+            trades += 1
+    elapsed = time.perf_counter() - start
+
+    # Every ticket still has exactly one owner and every resting ask is on a ticket its owner holds
+    assert len(book.owners) == tickets
+    for ticket_number, order_id in book.asked.items():
+        assert book.orders[order_id][0] == book.owners[ticket_number]
+    print(f"{len(commands)} order operations in {elapsed:.2f} s: {len(commands) / elapsed:.0f} ops/s, "
+          f"{trades} trades, {len(book)} orders resting")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import random
+import socket
+import threading
+import time
+
+from ticket_client import client
+
+scalps = 200
+loss_rates = [0.0, 0.1, 0.2, 0.3]
+
+# Loopback round trips take microseconds, so retransmit much sooner than the client's defaults
+client.scalp_retry_timeout = 0.01
+client.done_retry_interval = 0.01
+
+# Long enough for several SCALP retransmissions at the shortened timeout
+client.quote_deadline = 1.0
+
+
+class LossySocket:
+    """ UDP socket that drops each outgoing datagram with probability loss. """
+
+    def __init__(self, sock, loss):
+        self.sock = sock
+        self.loss = loss
+        self.sent = 0
+        self.dropped = 0
+
+    def sendto(self, data, addr):
+        self.sent += 1
+        if random.random() < self.loss:
+            self.dropped += 1
+            return
+        self.sock.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class Peer:
+    """ One side of the exchange: a lossy UDP socket served by the client's own udp_listener. """
+
+    def __init__(self, client_id, loss, balance, tickets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('localhost', 0))
+        sock.settimeout(1.0)
+        self.address = sock.getsockname()
+        self.udp_socket = LossySocket(sock, loss)
+        self.client_id = client_id
+        self.user_balance = [balance]
+        self.ticket_db = client.TicketWallet(tickets)
+        self.stop_event = threading.Event()
+        self.transaction_complete = threading.Event()
+        self.transaction_complete.set()
+        self.session = client.PeerSession(self.ticket_db, self.user_balance)
+        self.thread = threading.Thread(target=client.udp_listener, args=(
+            self.udp_socket, self.stop_event, self.ticket_db, self.user_balance, self.client_id, self.session))
+        self.thread.start()
+
+    def finish(self, peer):
+        client.finish_session(self.udp_socket, self.session, self.transaction_complete, self.client_id, [peer.address])
+
+    def stop(self):
+        self.stop_event.set()
+        self.udp_socket.sock.sendto(b"", self.address)
+        self.thread.join()
+
+
+def run(loss):
+    """ Buys `scalps` tickets from a scalper over a link losing `loss` of the datagrams in each direction.
+
+    Times the whole exchange including the DONE/ACK end of session, then
+    checks that no ticket was lost, duplicated or paid for twice.
+    """
+    tickets = {str(10000 + i): 1 + i % 50 for i in range(scalps)}
+    scalper = Peer("1", loss, 0, tickets)
+    buyer = Peer("2", loss, 100 * scalps, {})
+    start = time.perf_counter()
+    given_up = 0
+    for _ in range(scalps):
+        buyer.transaction_complete.clear()
+        if client.become_scalper(buyer.user_balance, buyer.udp_socket, buyer.client_id, [scalper.address],
+                                 buyer.transaction_complete, buyer.session) != "BOUGHT":
+            given_up += 1
+    finishing = threading.Thread(target=scalper.finish, args=(buyer,))
+    finishing.start()
+    buyer.finish(scalper)  # DONE acknowledges the last reply, settling a sale the buyer gave up on
+    finishing.join()
+    elapsed = time.perf_counter() - start
+    scalper.stop()
+    buyer.stop()
+
+    # Every ticket is held by exactly one side and every payment is accounted for
+    assert set(scalper.ticket_db) | set(buyer.ticket_db) == set(tickets)
+    assert not set(scalper.ticket_db) & set(buyer.ticket_db)
+    assert scalper.user_balance[0] + buyer.user_balance[0] == 100 * scalps
+    assert 100 * scalps - buyer.user_balance[0] == 2 * sum(tickets[number] for number in buyer.ticket_db)
+    sent = scalper.udp_socket.sent + buyer.udp_socket.sent
+    dropped = scalper.udp_socket.dropped + buyer.udp_socket.dropped
+    return elapsed, len(buyer.ticket_db), given_up, sent, dropped
+
+
+def main():
+    print(f"{scalps} SCALP transactions per run, first retransmission after {client.scalp_retry_timeout * 1000:.0f} ms")
+    print(f"{'loss':>6} {'time s':>8} {'scalps/s':>9} {'bought':>7} {'gave up':>8} {'datagrams':>10} {'dropped':>8}")
+    for loss in loss_rates:
+        elapsed, bought, given_up, sent, dropped = run(loss)
+        print(f"{loss:>6.0%} {elapsed:>8.2f} {scalps / elapsed:>9.0f} {bought:>7} {given_up:>8} {sent:>10} {dropped:>8}")
+
+
+if __name__ == "__main__":
+    main()
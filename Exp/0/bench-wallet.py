@@ -0,0 +1,73 @@
+import random
+import time
+
+from scalp_market import ScalpDesk
+from ticket_wallet import TicketWallet
+
+holdings = [100, 1000, 10000, 50000]
+scalps = 2000
+
+
+def make_tickets(count):
+    return {str(10000 + i): random.randint(200, 400) for i in range(count)}
+
+
+def scan_quote(ticket_db, buyer_balance):
+    """ What ScalpDesk.quote did on a plain dict: a min() over every ticket held. """
+    ticket_number, ticket_price = min(ticket_db.items(), key=lambda x: x[1])
+    if buyer_balance < 2 * ticket_price:
+        return None
+    del ticket_db[ticket_number]
+    return ticket_number, ticket_price
+
+
+def time_dict_scalps(tickets):
+    """ Nanoseconds per quote-and-decline with the old scan. """
+    ticket_db = dict(tickets)
+    start = time.perf_counter_ns()
+    for _ in range(scalps):
+        ticket_number, ticket_price = scan_quote(ticket_db, 10 ** 9)
+        ticket_db[ticket_number] = ticket_price  # Declined: back in the pool
+    return (time.perf_counter_ns() - start) / scalps
+
+
+def time_desk_scalps(tickets):
+    """ Nanoseconds per SCALP and DECLINE through ScalpDesk on a TicketWallet. """
+    desk = ScalpDesk(TicketWallet(tickets), [0])
+    buyer = ('127.0.0.1', 40000)
+    start = time.perf_counter_ns()
+    for seq in range(1, scalps + 1):
+        desk.scalp(buyer, seq, 0, 10 ** 9, 0.0)
+        desk.decline(buyer, seq)
+    return (time.perf_counter_ns() - start) / scalps
+
+
+def time_dict_drain(tickets):
+    """ Nanoseconds per sale when sell_ticket took next(iter(...)) from a dict until it was empty. """
+    ticket_db = dict(tickets)
+    start = time.perf_counter_ns()
+    while ticket_db:
+        ticket_number, _ = next(iter(ticket_db.items()))
+        del ticket_db[ticket_number]
+    return (time.perf_counter_ns() - start) / len(tickets)
+
+
+def time_wallet_drain(tickets):
+    """ Nanoseconds per sale taking the dearest ticket from a TicketWallet until it is empty. """
+    wallet = TicketWallet(tickets)
+    start = time.perf_counter_ns()
+    while wallet.pop_most_expensive() is not None:
+        pass
+    return (time.perf_counter_ns() - start) / len(tickets)
+
+
+def main():
+    print(f"{'tickets':>8} {'dict SCALP us':>14} {'wallet SCALP us':>16} {'dict sell us':>13} {'wallet sell us':>15}")
+    for count in holdings:
+        tickets = make_tickets(count)
+        print(f"{count:>8} {time_dict_scalps(tickets) / 1000:>14.2f} {time_desk_scalps(tickets) / 1000:>16.2f}"
+              f" {time_dict_drain(tickets) / 1000:>13.2f} {time_wallet_drain(tickets) / 1000:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
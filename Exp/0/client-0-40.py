@@ -1,25 +1,114 @@
+import asyncio
+import itertools
+import random
 import socket
 import threading
 import logging
 import time
+import uuid
 
-server_prog = input('Enter the server program name: ')
-client_prog = input('Enter the client program name: ')
+from scalp_market import ScalpDesk, ScalpRequest
+from ticket_logging import setup_queued_logging
+from ticket_protocol import RequestPipeline, negotiate_async_client, negotiate_client
+from ticket_wallet import TicketWallet
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    handlers=[
-                        logging.FileHandler("{}-{}.log".format(server_prog, client_prog)),
-                        logging.StreamHandler()
-                    ])
+# BUY requests kept in flight on a framed connection; 1 keeps the original one-request-per-round-trip flow
+pipeline_window = 1
 
+# Highest ticket price the server hands out; a pipelined BUY never offers more than this
+max_ticket_price = 400
 
+# Tickets requested per BUY_N message; 1 keeps one BUY per transaction
+batch_size = 1
 
-def udp_listener(udp_socket, stop_event, ticket_db, user_balance, tcp_socket, transaction_complete, client_id):
+# Most peers a SCALP asks for quotes: the best stocked ones the server's peer registry knows
+scalp_fanout = 8
+
+# Seconds a buyer collects quotes after sending SCALP to every peer
+quote_deadline = 1.0
+
+# Seconds before the first SCALP or ACCEPT retransmission; each further one waits twice as long
+scalp_retry_timeout = 0.25
+
+# ACCEPT retransmissions before the buyer gives up on the scalper
+scalp_retries = 6
+
+# Seconds between DONE retransmissions until the peer ACKs
+done_retry_interval = 0.5
+
+# Longest wait for a pending scalp or the peer's end of session before giving up on a silent peer
+session_timeout = 30
+
+# SUBSCRIBE to the server's inventory feed (framed connections only) and, when neither the server nor a peer
+# has a ticket, wait for one to be released instead of moving straight on to the next transaction
+watch_inventory = False
+
+# Longest wait for a released ticket after a SOLDOUT that scalping could not make up for
+restock_wait = 2.0
+
+# Send BUY with WAIT (framed connections only), so a sold-out BUY joins the server's waitlist
+# and is handed the next ticket sold back that the balance covers, before falling back to scalping
+join_waitlist = False
+
+# Longest wait on the waitlist before leaving it and scalping instead
+waitlist_timeout = 2.0
+
+# Milliseconds the server gets to start a BUY or SELL before it drops it as EXPIRED; None sends no deadline
+request_deadline = None
+
+# Seconds to wait before resending a BUY or SELL the server shed as BUSY or EXPIRED. Each retry in a row waits up to
+# twice as long, capped at busy_backoff_max, picked at random so shed clients do not all come back at once.
+busy_backoff = 0.01
+busy_backoff_max = 0.25
+
+# Resends of a shed BUY or SELL before the client gives up on it
+busy_retries = 8
+
+# Replies of a server shedding load: the request was not run and may be sent again
+shed_replies = ("BUSY", "EXPIRED")
+
+# Send each BUY and SELL with an idempotency key, the same for all its resends, so the server answers a resend of
+# one it has already run with the original response instead of running it again, e.g. selling a second ticket
+idempotency_keys = False
+
+# Idempotency keys are this prefix, unique to the process, and a count
+key_prefix = uuid.uuid4().hex[:16]
+key_counter = itertools.count(1)
+
+
+class PeerSession:
+    """ UDP exchange state with the other clients: request-for-quote scalping and the end-of-session handshake.
+
+    As a buyer, a client sends SCALP to every peer at once, collects their
+    quotes until all have answered or quote_deadline passes, ACCEPTs the
+    cheapest OFFER and DECLINEs the rest. Each SCALP has a new sequence
+    number, which its retransmissions and the ACCEPT reuse. As a scalper, it
+    answers through its ScalpDesk, which also makes retransmissions safe.
+
+    A client sends DONE once it will send no more SCALP requests and repeats
+    it until every peer answers ACK. It keeps answering the peers' SCALPs
+    until each of their own DONEs arrives, so everyone can exit as soon as
+    their transactions and pending scalps are settled.
+
+    The peers are found through the server's peer registry: a buyer scalps
+    from the best stocked peers it names, and says goodbye to every peer
+    registered when it finishes.
+    """
+
+    def __init__(self, ticket_db, user_balance):
+        self.ticket_db = ticket_db
+        self.user_balance = user_balance
+        self.desk = ScalpDesk(ticket_db, user_balance)  # Our side as a scalper
+        self.request = None  # Our latest ScalpRequest as a buyer
+        self.scalp_seq = 0
+        self.answered = {}  # Scalper address -> latest of our SCALPs it sold us a ticket on, acknowledged back to it
+        self.done_from = set()  # Peers that will send no more requests
+        self.acked_by = set()  # Peers that know we will send no more requests
+        self.changed = threading.Condition()  # Guards the buyer-side fields; notified whenever a reply arrives
+
+
+def udp_listener(udp_socket, stop_event, ticket_db, user_balance, client_id, session):
     """ Listens for messages on the UDP socket and handles scalping requests. """
-    last_message_time = time.time()
     try:
         while not stop_event.is_set():
             try:
@@ -29,152 +118,843 @@ def udp_listener(udp_socket, stop_event, ticket_db, user_balance, tcp_socket, tr
                     if ':' in message:
                         sender_id, actual_message = message.split(':', 1)
                         if sender_id != client_id:
-                            logging.debug(f"Received from {sender_id} at {sender_addr}: {actual_message}")
-                            handle_udp_message(actual_message, udp_socket, ticket_db, user_balance, sender_addr, tcp_socket, transaction_complete, client_id)
-                            last_message_time = time.time()
+                            logging.debug("Received from %s at %s: %s", sender_id, sender_addr, actual_message)
+                            handle_udp_message(actual_message, udp_socket, ticket_db, user_balance, sender_addr, client_id, session)
                         else:
-                            logging.debug(f"Ignored own message from {client_id}")
+                            logging.debug("Ignored own message from %s", client_id)
                     else:
-                        logging.error(f"Malformed message received: {message}")
+                        logging.error("Malformed message received: %s", message)
             except socket.timeout:
-                if time.time() - last_message_time > 180:
-                    logging.debug("No UDP activity for 3 minutes, considering transactions complete.")
-                    break
+                continue
             except Exception as e:
-                logging.error(f"UDP data processing error: {e}")
+                logging.error("UDP data processing error: %s", e)
     finally:
         udp_socket.close()
         logging.info("UDP connection closed.")
 
 
-def handle_udp_message(message, udp_socket, ticket_db, user_balance, addr, tcp_socket, transaction_complete, client_id):
+def handle_udp_message(message, udp_socket, ticket_db, user_balance, addr, client_id, session):
     """ Processes received messages via UDP and performs actions based on the message type. """
+    response = peer_reply(session, message, addr)
+    if response is not None:
+        udp_socket.sendto(f"{client_id}:{response}".encode(), addr)
+
+
+def peer_reply(session, message, addr):
+    """ Applies a peer's datagram to the session and returns the reply to send it, or None; shared by both clients. """
     parts = message.split()
+    if not parts:
+        return None
     command = parts[0]
+    response = None
 
     if command == "SCALP":
         # This client is the scalper and should respond to a scalping request
-        buyer_balance = int(parts[1])
-        if ticket_db:
-            ticket_number, ticket_price = min(ticket_db.items(), key=lambda x: x[1])
-            doubled_price = 2 * ticket_price
-            if buyer_balance >= doubled_price:
-                response = f"{ticket_number} {doubled_price}"
-                response_with_id = f"{client_id}:{response}"
-                udp_socket.sendto(response_with_id.encode(), addr)
-                del ticket_db[ticket_number]
-                user_balance[0] += doubled_price
-                logging.debug(f"Scalped message: {response_with_id}")
-            else:
-                response_with_id = f"{client_id}:NOMONEY"
-                udp_socket.sendto(response_with_id.encode(), addr)
-                logging.debug("Sent NOMONEY to buyer due to insufficient funds")
-        else:
-            response_with_id = f"{client_id}:Scalper is sold-out"
-            udp_socket.sendto(response_with_id.encode(), addr)
-            logging.debug("No tickets available to scalp")
+        response = session.desk.scalp(addr, int(parts[1]), int(parts[2]), int(parts[3]), time.monotonic())
 
-    elif parts[0].isdigit() and len(parts) == 2:
-        ticket_number, ticket_price = parts
-        ticket_price = int(ticket_price)
-        ticket_db[ticket_number] = ticket_price
-        user_balance[0] -= ticket_price
-        logging.debug(f"Bought scalped ticket {ticket_number} for {ticket_price}")
-        transaction_complete.set()
+    elif command == "ACCEPT":
+        response = session.desk.accept(addr, int(parts[1]), time.monotonic())
 
-    elif message == "NOMONEY":
-        if ticket_db:
-            sell_ticket(tcp_socket, ticket_db, user_balance)
-        transaction_complete.set()
+    elif command == "DECLINE":
+        session.desk.decline(addr, int(parts[1]))
+
+    elif command == "QUOTE":
+        _, seq, reply = message.split(None, 2)
+        with session.changed:
+            request = session.request
+            if request is None or int(seq) != request.seq:
+                logging.debug("Ignored stale reply to SCALP %s", seq)
+                return None
+            bought = request.quote_received(addr, reply)
+            if bought is not None:
+                # Recorded even if the buyer already gave up, since its next message will acknowledge it
+                ticket_number, ticket_price = bought
+                session.ticket_db[ticket_number] = ticket_price
+                session.user_balance[0] -= ticket_price
+                session.answered[addr] = request.seq
+                logging.debug("Bought scalped ticket %s for %s", ticket_number, ticket_price)
+            session.changed.notify_all()
+
+    elif command == "DONE":
+        session.desk.done(addr, int(parts[1]))
+        response = "ACK"  # Every copy is ACKed, in case an ACK was lost
+        with session.changed:
+            session.done_from.add(addr)
+            session.changed.notify_all()
+
+    elif command == "ACK":
+        with session.changed:
+            session.acked_by.add(addr)
+            session.changed.notify_all()
 
     else:
-        logging.debug(f"Received unexpected message: {message}")
+        logging.debug("Received unexpected message: %s", message)
 
+    return response
 
-def send_requests_to_server(tcp_socket, udp_socket, ticket_db, user_balance, transaction_complete, client_id, other_client_address):
+
+def send_requests_to_server(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session):
     """ Handles automated buy/sell requests to the server """
     for _ in range(15):
         transaction_complete.wait()  # Wait here if the previous loop iteration set it to wait
         transaction_complete.clear()  # Clear it to handle next message
-        message = f"BUY {user_balance[0]}"
-        tcp_socket.sendall(message.encode())
-        logging.debug(f"Sent to server: {message}")  # Log outgoing message
-        response = tcp_socket.recv(1024).decode()
-        logging.debug(f"Received from server: {response}")
+        response = buy_ticket(server_connection, ticket_db, user_balance)
+        if response is None:
+            raise ConnectionError("Server closed the connection")
 
         if "NOFUNDS" in response:
-            sell_ticket(tcp_socket, ticket_db, user_balance)
+            sell_ticket(server_connection, ticket_db, user_balance)
             transaction_complete.set()  # Transaction complete, move to next
         elif "SOLDOUT" in response:
-            become_scalper(user_balance, udp_socket, client_id, other_client_address)
+            outcome = scalp_from_peers(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session)
+            if outcome == "NOMONEY":
+                sell_ticket(server_connection, ticket_db, user_balance)
+            elif outcome == "SOLDOUT" and watch_inventory:
+                wait_for_restock(server_connection, restock_wait)
         else:
-            ticket_number, price = response.split()
-            ticket_db[ticket_number] = int(price)
-            user_balance[0] -= int(price)
             transaction_complete.set()  # Transaction complete, move to next
 
-def sell_ticket(tcp_socket, ticket_db, user_balance):
-    """ Sells a ticket back to the server. """
-    if ticket_db:
-        ticket_number, ticket_price = next(iter(ticket_db.items()))
-        sell_message = f"SELL {ticket_number}"
-        tcp_socket.sendall(sell_message.encode())
-        received_message = tcp_socket.recv(1024).decode()
+
+def with_deadline(message):
+    return message if request_deadline is None else f"{message} DEADLINE {request_deadline}"
+
+
+def with_idempotency_key(message):
+    return f"{message} KEY {key_prefix}-{next(key_counter)}" if idempotency_keys else message
+
+
+def backoff_delay(attempt):
+    """ Seconds to wait before resending a shed request for the attempt-th time, counting from 1. """
+    return random.uniform(0, min(busy_backoff_max, busy_backoff * 2 ** (attempt - 1)))
+
+
+# The protocol decisions below are generators shared by the threaded client and AsyncClient. Each yields the I/O it
+# needs, gets its result sent back, and returns its outcome; drive() and AsyncClient.drive() do the I/O:
+#   ("request", message)            one round trip to the server; the response, None once the server has closed
+#   ("event", timeout)              the next frame the server pushes; None on timeout or close, timeout None waits on
+#   ("sleep", seconds)
+#   ("datagram", message, addr)     message to a peer over UDP, prefixed with the client id
+#   ("settle", predicate, timeout)  waits for predicate() to hold as the peers' datagrams arrive; False on timeout
+# Steps that read the PeerSession fields the UDP side updates are driven holding session.changed.
+
+
+def drive(steps, server_connection=None, udp_socket=None, client_id=None, session=None):
+    """ Runs protocol steps with blocking I/O on the calling thread and returns their outcome. """
+    result = None
+    while True:
+        try:
+            action = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        kind = action[0]
+        if kind == "request":
+            server_connection.send(action[1])
+            result = server_connection.recv()
+            logging.debug("Sent to server: %s, received: %s", action[1], result)
+        elif kind == "event":
+            result = server_connection.recv_event(action[1])
+        elif kind == "sleep":
+            time.sleep(action[1])
+            result = None
+        elif kind == "datagram":
+            udp_socket.sendto(f"{client_id}:{action[1]}".encode(), action[2])
+            result = None
+        else:
+            result = session.changed.wait_for(action[1], action[2])
+
+
+def admission_steps(framed):
+    """ Waits in the server's waiting room until it is ADMITTED, logging the queue positions it reports. """
+    if not framed:
+        return  # A legacy text connection is not told; its first request just waits
+    while True:
+        event = yield "event", None
+        if event is None:
+            raise ConnectionError("Server closed the connection in the waiting room")
+        if event.startswith("ADMITTED"):
+            logging.debug("Left the waiting room: %s", event)
+            return
+        logging.info("In the server's waiting room: %s", event)
+
+
+def backoff_steps(message):
+    """ One inventory command round trip, resent after a backoff while the server sheds it; returns the last response.
+
+    A BUY or SELL gets the deadline and, with idempotency_keys, a key; every
+    resend carries the key of the first, so a resend of a request the
+    server did run cannot run it twice.
+    """
+    if message.startswith(("BUY ", "SELL ")):
+        message = with_deadline(with_idempotency_key(message))
+    for attempt in range(busy_retries + 1):
+        if attempt:
+            yield "sleep", backoff_delay(attempt)
+        response = yield "request", message
+        if response not in shed_replies:
+            break
+    return response
+
+
+def buy_steps(ticket_db, user_balance, framed):
+    """ One BUY with the whole balance; records a bought ticket and returns the response, None if the server closed.
+
+    With join_waitlist a sold-out BUY waits on the server's waitlist and
+    answers like a BUY once that is over, with the ticket handed off or
+    SOLDOUT.
+    """
+    message = f"BUY {user_balance[0]}" + (" WAIT" if join_waitlist and framed else "")
+    response = yield from backoff_steps(message)
+    if response is not None and response[:1].isdigit():
+        ticket_number, price = response.split()
+        ticket_db[ticket_number] = int(price)
+        user_balance[0] -= int(price)
+    elif response is not None and response.startswith("WAITING"):
+        response = yield from handoff_steps(ticket_db, user_balance, waitlist_timeout)
+    return response
+
+
+def handoff_steps(ticket_db, user_balance, timeout):
+    """ Waits on the server's waitlist for a returned ticket; answers like a BUY, with SOLDOUT if none came in time.
+
+    On timeout the client sends UNWAIT. NOTWAITING means the server had
+    just handed it a ticket, so it waits for that HANDOFF after all.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        event = yield "event", max(0.0, deadline - time.monotonic())
+        if event is None:
+            break
+        sale = handed_off(event, ticket_db, user_balance)
+        if sale is not None:
+            return sale
+    response = yield "request", "UNWAIT"
+    while response == "NOTWAITING":
+        event = yield "event", session_timeout
+        if event is None:
+            logging.warning("No HANDOFF within %s seconds of leaving the waitlist.", session_timeout)
+            break
+        sale = handed_off(event, ticket_db, user_balance)
+        if sale is not None:
+            return sale
+    return "SOLDOUT"
+
+
+def sell_steps(ticket_db, user_balance):
+    """ Sells the dearest ticket back to the server, which frees the most balance for the next BUY.
+
+    Returns the response, None if the server closed, or "" if there was
+    no ticket to sell.
+    """
+    sold = ticket_db.pop_most_expensive()  # Before the round trip, so a buyer scalping meanwhile cannot be offered it
+    if sold is None:
+        return ""
+    ticket_number, ticket_price = sold
+    sell_message = f"SELL {ticket_number}"
+    received_message = yield from backoff_steps(sell_message)
+    settle_sell(ticket_db, user_balance, ticket_number, ticket_price, received_message)
+    return received_message
+
+
+def sold_back(response, ticket_number):
+    """ Whether a SELL response, "<ticket> <price>", says the server took the ticket back. """
+    return response is not None and response.split()[:1] == [ticket_number] and len(response.split()) == 2
+
+
+def settle_sell(ticket_db, user_balance, ticket_number, ticket_price, response):
+    """ Credits a ticket the server took back; any other response, e.g. NOTOWNER, HELD or none at all, leaves it ours. """
+    logging.debug("Sent SELL %s to server, received: %s", ticket_number, response)
+    if sold_back(response, ticket_number):
         user_balance[0] += ticket_price
-        del ticket_db[ticket_number]
-        logging.debug(f"Sent SELL to server: {sell_message}, received: {received_message}")
+    else:
+        ticket_db[ticket_number] = ticket_price
 
 
-def become_scalper(user_balance, udp_socket, client_id, other_client_address):
-    """ Initiates scalping transaction due to SOLDOUT, including client identifier in the message. """
-    message = f"{client_id}:SCALP {user_balance[0]}"
-    udp_socket.sendto(message.encode(), other_client_address)
-    logging.info(f"Client initiated scalping transaction due to SOLDOUT. Sent: {message}")
+def restock_steps(framed, timeout):
+    """ Reads the inventory feed until a ticket is released; False if none was within timeout or the feed is missing. """
+    if not framed:
+        return False
+    deadline = time.monotonic() + timeout
+    while True:
+        event = yield "event", max(0.0, deadline - time.monotonic())
+        if event is None:
+            logging.debug("No ticket released within %s seconds.", timeout)
+            return False
+        if restocked(event):
+            logging.debug("Tickets released: %s", event)
+            return True
+
+
+def send_until_steps(message, targets, settled, deadline):
+    """ Sends message(addr) to every address in targets() and retransmits with exponential backoff until settled() or deadline. """
+    timeout = scalp_retry_timeout
+    while not settled():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        for addr in targets():
+            yield "datagram", message(addr), addr
+        yield "settle", settled, min(timeout, remaining)
+        timeout *= 2
+    return True
+
+
+def finish_steps(session, peer_addresses):
+    """ Trades DONE/ACK with every peer; returns once all sides are done or session_timeout passes. """
+    deadline = time.monotonic() + session_timeout
+    peers = set(peer_addresses)
+    while not peers <= session.acked_by and time.monotonic() < deadline:
+        for addr in peers - session.acked_by:
+            yield "datagram", f"DONE {session.answered.get(addr, 0)}", addr
+        yield "settle", lambda: peers <= session.acked_by, done_retry_interval
+    finished = yield "settle", lambda: peers <= session.done_from, max(0.0, deadline - time.monotonic())
+    if not finished or not peers <= session.acked_by:
+        logging.warning("Peers did not finish their sessions within %s seconds.", session_timeout)
+    session.desk.expire(float('inf'))  # Tickets still reserved for a buyer go back to ticket_db
+    logging.debug("Session complete: all transactions and pending scalps are settled.")
+
+
+def request_with_backoff(server_connection, message):
+    """ backoff_steps over the blocking connection. """
+    return drive(backoff_steps(message), server_connection)
+
+
+def buy_ticket(server_connection, ticket_db, user_balance):
+    """ buy_steps over the blocking connection. """
+    return drive(buy_steps(ticket_db, user_balance, server_connection.framed), server_connection)
+
+
+def send_pipelined_requests(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session):
+    """ send_requests_to_server with up to pipeline_window BUYs in flight, replies matched by request ID.
+
+    Each BUY offers at most max_ticket_price out of the balance not already
+    offered by the BUYs in flight, so pipelined purchases never overspend.
+    Once the server reports SOLDOUT, the remaining transactions are scalped
+    one at a time as before.
+    """
+    pipeline = RequestPipeline(server_connection, pipeline_window)
+    offered = [0]
+    outcomes = []
+
+    def on_buy_reply(offer):
+        def handle(response):
+            offered[0] -= offer
+            logging.debug("Received from server: %s", response)
+            if response == "NOFUNDS" or response == "SOLDOUT" or response in shed_replies:
+                outcomes.append(response)
+            else:
+                ticket_number, price = response.split()
+                ticket_db[ticket_number] = int(price)
+                user_balance[0] -= int(price)
+        return handle
+
+    def on_sell_reply(ticket_number, ticket_price):
+        def handle(response):
+            settle_sell(ticket_db, user_balance, ticket_number, ticket_price, response)
+        return handle
+
+    transactions = 15
+    shed = 0  # Times the server shed BUYs so far
+    while transactions and "SOLDOUT" not in outcomes:
+        if "BUSY" in outcomes or "EXPIRED" in outcomes:
+            # Resend the shed BUYs once the server has had time to catch up
+            shed_now = sum(outcomes.count(reply) for reply in shed_replies)
+            outcomes[:] = [outcome for outcome in outcomes if outcome not in shed_replies]
+            shed += 1
+            if shed <= busy_retries:
+                transactions += shed_now
+            time.sleep(backoff_delay(shed))
+            continue
+        if "NOFUNDS" in outcomes:
+            outcomes.remove("NOFUNDS")
+            sold = ticket_db.pop_most_expensive()
+            if sold is not None:
+                ticket_number, ticket_price = sold
+                sell_message = f"SELL {ticket_number}"
+                pipeline.submit(with_deadline(sell_message), on_sell_reply(ticket_number, ticket_price))
+            continue
+        offer = min(max_ticket_price, user_balance[0] - offered[0])
+        offered[0] += offer
+        message = with_deadline(f"BUY {offer}")
+        pipeline.submit(message, on_buy_reply(offer))
+        logging.debug("Sent to server: %s", message)  # Log outgoing message
+        transactions -= 1
+    pipeline.drain()
+
+    for _ in range(outcomes.count("NOFUNDS")):
+        sell_ticket(server_connection, ticket_db, user_balance)
+    for _ in range(transactions + outcomes.count("SOLDOUT")):
+        transaction_complete.wait()
+        transaction_complete.clear()
+        if scalp_from_peers(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session) == "NOMONEY":
+            sell_ticket(server_connection, ticket_db, user_balance)
+
+
+def send_batched_requests(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session):
+    """ send_requests_to_server with up to batch_size transactions per BUY_N round trip.
+
+    A batch that stops on NOFUNDS sells back one ticket per missing
+    purchase in a single SELL_MANY; one that stops on SOLDOUT scalps. A
+    batch the server sheds is resent after a backoff like a single BUY.
+    """
+    remaining = 15
+    while remaining:
+        transaction_complete.wait()  # Wait here if the previous batch started a scalp
+        transaction_complete.clear()
+        count = min(batch_size, remaining)
+        message = f"BUY_N {count} {user_balance[0]}"
+        response = request_with_backoff(server_connection, message)
+        if response is None:
+            raise ConnectionError("Server closed the connection")
+
+        bought = response.split()
+        status = bought.pop() if ":" not in bought[-1] else None
+        for item in bought:
+            ticket_number, price = item.split(":")
+            ticket_db[ticket_number] = int(price)
+            user_balance[0] -= int(price)
+
+        if status == "SOLDOUT":
+            remaining -= len(bought) + 1
+            if scalp_from_peers(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session) == "NOMONEY":
+                sell_ticket(server_connection, ticket_db, user_balance)
+        else:
+            if status == "NOFUNDS":
+                sell_tickets(server_connection, ticket_db, user_balance, count - len(bought))
+            remaining -= count
+            transaction_complete.set()
+
+
+def sell_tickets(server_connection, ticket_db, user_balance, count):
+    """ Sells up to count of the dearest tickets back to the server in one SELL_MANY round trip. """
+    selling = {}  # Out of ticket_db during the round trip, so the UDP thread cannot offer them meanwhile
+    while len(selling) < count:
+        sold = ticket_db.pop_most_expensive()
+        if sold is None:
+            break
+        selling[sold[0]] = sold[1]
+    if selling:
+        sell_message = "SELL_MANY " + " ".join(selling)
+        received_message = request_with_backoff(server_connection, sell_message)
+        for item in (received_message or "").split():
+            ticket_number = item.split(":")[0]
+            if ":" in item and ticket_number in selling:
+                user_balance[0] += selling.pop(ticket_number)
+        ticket_db.update(selling)  # Tickets the server did not take back
+        logging.debug("Sent SELL_MANY to server: %s, received: %s", sell_message, received_message)
+
+
+def sell_ticket(server_connection, ticket_db, user_balance):
+    """ sell_steps over the blocking connection. """
+    return drive(sell_steps(ticket_db, user_balance), server_connection)
+
+
+def has_peer_registry(server_connection):
+    """ Whether the server keeps a peer registry.
+
+    A server from before the registry speaks only the legacy text protocol
+    and never answers REGISTER, PEERS or ROSTER, so a client waiting for
+    the reply would hang.
+    """
+    return server_connection.framed
+
+
+def register_peer(server_connection, udp_address):
+    """ Enters this client's UDP endpoint in the server's peer registry, so buyers can find it. """
+    if not has_peer_registry(server_connection):
+        logging.warning("The server has no peer registry: this client will not scalp or be scalped from.")
+        return
+    message = f"REGISTER {udp_address[1]} {udp_address[0]}"
+    server_connection.send(message)
+    response = server_connection.recv()
+    logging.debug("Sent to server: %s, received: %s", message, response)
+    if response != "REGISTERED":
+        logging.warning("Not registered as a scalper: %s", response)
+
+
+def wait_for_admission(server_connection):
+    """ admission_steps over the blocking connection. """
+    drive(admission_steps(server_connection.framed), server_connection)
+
+
+def handed_off(event, ticket_db, user_balance):
+    """ Records the ticket of a "HANDOFF <ticket> <price>" frame and returns its "<ticket> <price>"; None for other frames. """
+    if not event.startswith("HANDOFF "):
+        return None
+    ticket_number, price = event.split()[1:]
+    ticket_db[ticket_number] = int(price)
+    user_balance[0] -= int(price)
+    return f"{ticket_number} {price}"
+
+
+def subscribe_inventory(server_connection):
+    """ Asks the server to push inventory deltas; False on a legacy text connection, which cannot carry them. """
+    if not server_connection.framed:
+        return False
+    server_connection.send("SUBSCRIBE")
+    response = server_connection.recv()
+    logging.debug("Sent to server: SUBSCRIBE, received: %s", response)
+    return response is not None and response.startswith("SUBSCRIBED")
+
+
+def restocked(event):
+    """ Whether an "EVENT <seq> <delta> ..." frame puts a ticket back in the server's pool. """
+    return any(delta.startswith("+") for delta in event.split()[2:])
+
+
+def wait_for_restock(server_connection, timeout):
+    """ restock_steps over the blocking connection. """
+    return drive(restock_steps(server_connection.framed, timeout), server_connection)
+
+
+def parse_peers(response):
+    """ "PEERS 127.0.0.1:12346:3 ..." or "ROSTER 127.0.0.1:12346 ..." -> [("127.0.0.1", 12346), ...] """
+    addresses = []
+    for entry in response.split()[1:]:
+        host, port = entry.split(":")[:2]
+        addresses.append((host, int(port)))
+    return addresses
+
+
+def find_peers(server_connection, ticket_db):
+    """ Reports this client's stock to the peer registry and returns the best stocked peers, at most scalp_fanout. """
+    if not has_peer_registry(server_connection):
+        return []
+    message = f"PEERS {len(ticket_db)} {scalp_fanout}"
+    server_connection.send(message)
+    response = server_connection.recv()
+    logging.debug("Sent to server: %s, received: %s", message, response)
+    return parse_peers(response)
+
+
+def list_peers(server_connection):
+    """ Every other registered peer, whatever its stock. """
+    if not has_peer_registry(server_connection):
+        return []
+    server_connection.send("ROSTER")
+    response = server_connection.recv()
+    logging.debug("Sent to server: ROSTER, received: %s", response)
+    return parse_peers(response)
+
+
+def scalp_from_peers(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session):
+    """ become_scalper with the peers the registry says have tickets; a ticket bought is reported to the server.
+
+    Returns become_scalper's outcome. With no stocked peer registered it is
+    SOLDOUT without a single datagram sent.
+    """
+    peer_addresses = find_peers(server_connection, ticket_db)
+    outcome = become_scalper(user_balance, udp_socket, client_id, peer_addresses, transaction_complete, session)
+    if outcome == "BOUGHT":
+        # Also makes the ticket ours to ASK on the resale book
+        message = scalped_message(session)
+        server_connection.send(message)
+        logging.debug("Sent to server: %s, received: %s", message, server_connection.recv())
+    return outcome
+
+
+def send_until(udp_socket, client_id, session, message, targets, settled, deadline):
+    """ send_until_steps over the UDP socket. """
+    with session.changed:
+        return drive(send_until_steps(message, targets, settled, deadline), None, udp_socket, client_id, session)
+
+
+def become_scalper(user_balance, udp_socket, client_id, peer_addresses, transaction_complete, session):
+    """ scalp_steps over the UDP socket; transaction_complete is set either way. """
+    with session.changed:
+        outcome = drive(scalp_steps(session, peer_addresses), None, udp_socket, client_id, session)
+    transaction_complete.set()
+    return outcome
+
+
+def scalp_steps(session, peer_addresses):
+    """ Scalping transaction due to SOLDOUT: asks every peer for a quote and buys the cheapest offer.
+
+    Returns BOUGHT, NOMONEY (a peer had a ticket the buyer cannot afford),
+    SOLDOUT, or None if no peer answered.
+    """
+    session.scalp_seq += 1
+    request = session.request = ScalpRequest(session.scalp_seq, peer_addresses)
+    balance = session.user_balance[0]
+
+    def message(addr):
+        return f"SCALP {request.seq} {session.answered.get(addr, 0)} {balance}"
+
+    logging.info("Client initiated scalping transaction due to SOLDOUT. Sent SCALP %s to %s peers.", request.seq, len(peer_addresses))
+    yield from send_until_steps(message, request.unquoted, request.all_quoted, time.monotonic() + quote_deadline)
+
+    winner = request.winner = request.best_offer()
+    declined = [addr for addr, reply in request.quotes.items() if addr != winner and reply.startswith("OFFER")]
+    for addr in declined:
+        yield "datagram", f"DECLINE {request.seq}", addr
+
+    if winner is None:
+        outcome = request.outcome() if request.quotes or not peer_addresses else None
+    else:
+        accept_deadline = time.monotonic() + scalp_retry_timeout * (2 ** (scalp_retries + 1) - 1)
+        yield from send_until_steps(lambda addr: f"ACCEPT {request.seq}", lambda: [winner],
+                                    lambda: request.result is not None, accept_deadline)
+        if request.result is None:
+            outcome = None
+        else:
+            outcome = "BOUGHT" if request.result.startswith("SOLD") else "SOLDOUT"  # EXPIRED: the offer lapsed
+    if outcome is None:
+        logging.warning("Gave up on SCALP %s: no answer from the peers.", request.seq)
+    logging.debug("SCALP %s: %s quotes, outcome %s", request.seq, len(request.quotes), outcome)
+    return outcome
+
+
+def scalped_message(session):
+    """ The SCALPED report of the ticket the last scalp bought, which moves it between the two peers' registry stock. """
+    host, port = session.request.winner
+    return f"SCALPED {host} {port} {session.request.result.split()[1]}"
+
+
+def finish_session(udp_socket, session, transaction_complete, client_id, peer_addresses):
+    """ Waits for the last scalp to settle, then trades DONE/ACK with every peer; returns once all sides are done. """
+    if not transaction_complete.wait(session_timeout):
+        logging.warning("No reply to the last SCALP within %s seconds.", session_timeout)
+    with session.changed:
+        drive(finish_steps(session, peer_addresses), None, udp_socket, client_id, session)
+
+
+class AsyncClient(asyncio.DatagramProtocol):
+    """ A client served entirely by one event loop: trading over the TCP connection, scalping over a UDP endpoint.
+
+    The UDP endpoint is this protocol object, so datagrams are handled as
+    they arrive instead of by a thread polling with a receive timeout.
+    Everything runs on the loop thread, so ticket_db and user_balance need
+    no lock, and a NOMONEY outcome is acted on by the trading coroutine,
+    which keeps the TCP connection to one user. The scalping exchange is
+    the one PeerSession describes. One process can run thousands of these
+    clients on one loop.
+    """
+
+    def __init__(self, client_id, user_balance):
+        self.client_id = client_id
+        self.user_balance = [user_balance]
+        self.ticket_db = TicketWallet()
+        self.server_connection = None
+        self.udp_transport = None
+        self.session = PeerSession(self.ticket_db, self.user_balance)  # Its Condition is never contended on the loop
+        self.changed = asyncio.Event()  # Set whenever a reply arrives
+
+    async def connect(self, hostname, tcp_port, udp_address):
+        loop = asyncio.get_running_loop()
+        self.udp_transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=udp_address)
+        reader, writer = await asyncio.open_connection(hostname, tcp_port)
+        self.server_connection = await negotiate_async_client(reader, writer)
+        await self.wait_for_admission()
+        if not has_peer_registry(self.server_connection):
+            logging.warning("The server has no peer registry: this client will not scalp or be scalped from.")
+        else:
+            host, port = self.udp_transport.get_extra_info('sockname')[:2]
+            response = await self.round_trip(f"REGISTER {port} {host}")
+            if response != "REGISTERED":
+                logging.warning("Not registered as a scalper: %s", response)
+        if watch_inventory and self.server_connection.framed:
+            await self.round_trip("SUBSCRIBE")
+
+    async def drive(self, steps):
+        """ drive on the event loop: runs protocol steps over this client's connection and UDP endpoint. """
+        result = None
+        while True:
+            try:
+                action = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            kind = action[0]
+            if kind == "request":
+                result = await self.round_trip(action[1])
+            elif kind == "event":
+                result = await self.server_connection.recv_event(action[1])
+            elif kind == "sleep":
+                await asyncio.sleep(action[1])
+                result = None
+            elif kind == "datagram":
+                self.sendto(action[1], action[2])
+                result = None
+            else:
+                result = await self.wait_for(action[1], action[2])
+
+    async def wait_for_admission(self):
+        await self.drive(admission_steps(self.server_connection.framed))
+
+    async def request_with_backoff(self, message):
+        """ backoff_steps on the event loop; None if the server closed the connection. """
+        return await self.drive(backoff_steps(message))
+
+    async def round_trip(self, message):
+        """ One round trip to the server; None if it closed the connection. """
+        await self.server_connection.send(message)
+        response = await self.server_connection.recv()
+        logging.debug("Sent to server: %s, received: %s", message, response)
+        return response
+
+    def close(self):
+        self.udp_transport.close()
+        self.server_connection.close()
+
+    def sendto(self, message, addr):
+        self.udp_transport.sendto(f"{self.client_id}:{message}".encode(), addr)
+
+    def datagram_received(self, data, addr):
+        message = data.decode()
+        if ':' not in message:
+            logging.error("Malformed message received: %s", message)
+            return
+        sender_id, message = message.split(':', 1)
+        if sender_id == self.client_id:
+            return
+        logging.debug("Received from %s at %s: %s", sender_id, addr, message)
+        response = peer_reply(self.session, message, addr)
+        if response is not None:
+            self.sendto(response, addr)
+        self.changed.set()
+
+    async def wait_for(self, predicate, timeout):
+        """ Waits until predicate() holds, rechecking it whenever a datagram arrives; False on timeout. """
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def send_until(self, message, targets, settled, deadline):
+        return await self.drive(send_until_steps(message, targets, settled, deadline))
+
+    async def buy(self):
+        """ buy_steps on the event loop; returns None if the server closed the connection. """
+        return await self.drive(buy_steps(self.ticket_db, self.user_balance, self.server_connection.framed))
+
+    async def sell(self):
+        return await self.drive(sell_steps(self.ticket_db, self.user_balance))
+
+    async def scalp(self):
+        """ scalp_from_peers on the event loop; returns BOUGHT, NOMONEY, SOLDOUT or None. """
+        if not has_peer_registry(self.server_connection):
+            return "SOLDOUT"
+        peer_addresses = parse_peers(await self.round_trip(f"PEERS {len(self.ticket_db)} {scalp_fanout}"))
+        outcome = await self.drive(scalp_steps(self.session, peer_addresses))
+        if outcome == "BOUGHT":
+            await self.round_trip(scalped_message(self.session))
+        return outcome
+
+    async def run(self, transactions=15):
+        """ send_requests_to_server on the event loop. """
+        for _ in range(transactions):
+            response = await self.buy()
+            if response is None:
+                raise ConnectionError("Server closed the connection")
+            if "NOFUNDS" in response:
+                await self.sell()
+            elif "SOLDOUT" in response:
+                outcome = await self.scalp()
+                if outcome == "NOMONEY":
+                    await self.sell()
+                elif outcome == "SOLDOUT" and watch_inventory:
+                    await self.wait_for_restock(restock_wait)
+
+    async def wait_for_restock(self, timeout):
+        return await self.drive(restock_steps(self.server_connection.framed, timeout))
+
+    async def finish_session(self):
+        """ finish_steps on the event loop, with every peer the registry knows. """
+        peers = parse_peers(await self.round_trip("ROSTER")) if has_peer_registry(self.server_connection) else []
+        await self.drive(finish_steps(self.session, peers))
+
+
+async def run_async_client(client_id, hostname, tcp_port):
+    client = AsyncClient(client_id, 4000)
+    await client.connect(hostname, tcp_port, (hostname, 0))
+    logging.debug("TCP connection established using the %s protocol.", 'framed' if client.server_connection.framed else 'legacy text')
+    try:
+        await client.run()
+        await client.finish_session()
+        if watch_inventory and client.server_connection.framed:
+            await client.round_trip("UNSUBSCRIBE")
+    finally:
+        client.close()
+        logging.info("UDP and TCP connections closed.")
+    print(f"Final Ticket Database: {client.ticket_db}")
+    print(f"Remaining Balance: ${client.user_balance[0]}")
+
+
+def configure_logging():
+    server_prog = input('Enter the server program name: ')
+    client_prog = input('Enter the client program name: ')
+
+    # Configure logging: records go through a bounded queue to a background writer, off the request path
+    setup_queued_logging(handlers=[
+                             logging.FileHandler("{}-{}.log".format(server_prog, client_prog)),
+                             logging.StreamHandler()
+                         ])
+
 
 def main():
+    configure_logging()
     client_id = input("Enter this client's unique identifier (e.g., Client1): ")
+    client_mode = input("Enter the client mode (threaded/asyncio) [threaded]: ").strip() or "threaded"
 
     hostname = 'localhost'
     tcp_port = 12345  # TCP port for server connection
-    base_udp_port = tcp_port + 1
-    udp_port = base_udp_port + int(client_id) # UDP port is one more than the TCP port
+
+    if client_mode == "asyncio":
+        asyncio.run(run_async_client(client_id, hostname, tcp_port))
+        return
 
     user_balance = [4000]  # Use a list to maintain a mutable integer
-    ticket_db = {}
+    ticket_db = TicketWallet()
     stop_event = threading.Event()
     transaction_complete = threading.Event()
     transaction_complete.set()  # Initially allow processing
+    session = PeerSession(ticket_db, user_balance)
 
-    # Set up the UDP socket
+    # Set up the UDP socket on a free port; peers learn it from the server's peer registry
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    udp_socket.bind((hostname, udp_port))
+    udp_socket.bind((hostname, 0))
     udp_socket.settimeout(1.0)  # Responsive timeout
-    logging.debug(f"Client bound UDP socket to port {udp_port}")
-
-    # Identify the other client's address and port
-    other_client_id = "2" if client_id == "1" else "1"
-    other_udp_port = base_udp_port + int(other_client_id)
-    other_client_address = ('localhost', other_udp_port)
-    logging.debug(f"Client {client_id} bound UDP socket to port {udp_port}")
+    logging.debug("Client %s bound UDP socket to port %s", client_id, udp_socket.getsockname()[1])
 
     # Set up the TCP connection
     tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp_socket.connect((hostname, tcp_port))
-    logging.debug("TCP connection established.")
+    server_connection = negotiate_client(tcp_socket)
+    logging.debug("TCP connection established using the %s protocol.", 'framed' if server_connection.framed else 'legacy text')
+    wait_for_admission(server_connection)
+    register_peer(server_connection, udp_socket.getsockname())
+    if watch_inventory:
+        subscribe_inventory(server_connection)
 
     # Start UDP listening in a separate thread
-    udp_thread = threading.Thread(target=udp_listener, args=(udp_socket, stop_event, ticket_db, user_balance, tcp_socket, transaction_complete, client_id))
+    udp_thread = threading.Thread(target=udp_listener, args=(udp_socket, stop_event, ticket_db, user_balance, client_id, session))
     udp_thread.start()
 
-    send_requests_to_server(tcp_socket, udp_socket, ticket_db, user_balance, transaction_complete, client_id, other_client_address)
+    if batch_size > 1:
+        send_batched_requests(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session)
+    elif pipeline_window > 1 and server_connection.framed:
+        send_pipelined_requests(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session)
+    else:
+        send_requests_to_server(server_connection, udp_socket, ticket_db, user_balance, transaction_complete, client_id, session)
 
-    time.sleep(180)  # Allow time for any late UDP messages after transactions
+    finish_session(udp_socket, session, transaction_complete, client_id, list_peers(server_connection))
     stop_event.set()
+    try:
+        udp_socket.sendto(b"", udp_socket.getsockname())  # Wake the listener instead of waiting out its timeout
+    except OSError:
+        pass  # The listener timed out, saw stop_event and closed the socket first
     udp_thread.join()
     udp_socket.close()
     logging.info("UDP connection properly closed.")
-    tcp_socket.close()
+    if watch_inventory and server_connection.framed:
+        server_connection.send("UNSUBSCRIBE")  # Drain the feed so closing with unread events does not reset the connection
+        server_connection.recv()
+    server_connection.close()
     logging.info("TCP connection closed.")
 
     # Output the final ticket database and remaining balance
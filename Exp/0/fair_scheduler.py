@@ -0,0 +1,295 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket:
+    """ Per-client rate limit: tokens accrue at rate per second up to burst, and each command spends its cost.
+
+    delay() spends the tokens at once and says how long the caller has to
+    wait to have earned them, so a client over its rate is slowed down to
+    it rather than refused. Given a deadline the wait would run past, it
+    spends nothing and returns None, so a refused command costs no quota.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self, cost, now=None, deadline=None):
+        now = time.monotonic() if now is None else now
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        wait = (cost - tokens) / self.rate if tokens < cost else 0.0
+        if deadline is not None and now + wait > deadline:
+            return None
+        self.tokens = tokens - cost
+        self.updated = now
+        return wait
+
+
+class Session:
+    """ One client's place in the FairScheduler: its queued commands, deficit, rate limit and starvation figures. """
+
+    def __init__(self, address, bucket):
+        self.address = address
+        self.bucket = bucket
+        self.queue = deque()  # (cost, grant, perf_counter_ns when queued)
+        self.deficit = 0
+        self.connected = time.monotonic()
+        self.dispatched = 0
+        self.work = 0  # Summed cost of the dispatched commands
+        self.waited_ns = 0
+        self.max_wait_ns = 0
+        self.throttled_ns = 0
+
+    def summary(self):
+        """ Starvation figures for the metrics and the disconnect log line. """
+        return {
+            'commands': self.dispatched,
+            'work': self.work,
+            'mean_wait_us': self.waited_ns / self.dispatched / 1000 if self.dispatched else 0.0,
+            'max_wait_us': self.max_wait_ns / 1000,
+            'throttled_ms': self.throttled_ns / 1e6,
+        }
+
+
+class FairScheduler:
+    """ Deficit round robin across client sessions for the commands that touch the inventory.
+
+    A command costs the inventory work it does, e.g. one per ticket of a
+    batch. Service goes in rounds: each session with a queued command adds
+    quantum to its deficit and dispatches its command once the deficit
+    covers the cost. A client looping BUY/SELL, or firing batches, gets
+    the same share of the inventory per round as any other, however fast
+    it sends. A round in which nobody can go is followed by another, so
+    the inventory never idles while commands wait.
+
+    Threads call wait_turn() and done() around a command, with at most
+    `slots` commands running at once. On an event loop, turn() queues the
+    command and one round runs per loop pass, over every connection that
+    has a command ready by then; commands run one at a time there anyway.
+
+    Each session also has a TokenBucket, applied before the command
+    queues, and every dispatch records how long the command queued, in
+    the session's figures and in wait_histogram, so starvation shows.
+
+    A command can come with a deadline on the time.monotonic() clock: one
+    that the rate limit would hold past it is refused at once, and one
+    still queued when it passes is withdrawn, so wait_turn() and turn()
+    return False and the caller answers without running it. queued counts
+    the commands waiting for their turn, the depth the server sheds at.
+    """
+
+    def __init__(self, quantum=8, slots=1, rate=None, burst=1, wait_histogram=None):
+        self.quantum = quantum
+        self.slots = slots
+        self.rate = rate
+        self.burst = burst
+        self.wait_histogram = wait_histogram
+        self.sessions = {}  # Address -> Session
+        self.active = deque()  # Sessions with queued commands, in round order
+        self.ready = deque()  # Grants of the current round not yet given a slot
+        self.running = 0
+        self.queued = 0
+        self.round_scheduled = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def session(self, address):
+        session = self.sessions.get(address)
+        if session is None:
+            bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+            session = self.sessions[address] = Session(address, bucket)
+        return session
+
+    def remove(self, address):
+        """ Forgets a disconnected session and returns it, or None; it must have no command queued. """
+        with self.lock:
+            return self.sessions.pop(address, None)
+
+    def throttle(self, address, cost, deadline=None):
+        """ Seconds the client has to wait to stay within its rate before the command is submitted.
+
+        None if that wait would run past the deadline; the command is refused then and spends none of the rate.
+        """
+        now = time.monotonic()
+        with self.lock:
+            session = self.session(address)
+            if session.bucket is None:
+                return 0.0 if deadline is None or now <= deadline else None
+            delay = session.bucket.delay(cost, now, deadline)
+            if delay is not None:
+                session.throttled_ns += int(delay * 1e9)
+            return delay
+
+    def wait_turn(self, address, cost, granted, deadline=None):
+        """ Blocks until the command may run, throttled first; granted is the caller's threading.Event to wait on.
+
+        False if the deadline passes first: the command must not run, and needs no done().
+        """
+        delay = self.throttle(address, cost, deadline)
+        if delay is None:
+            return False
+        if delay:
+            time.sleep(delay)
+        granted.clear()
+        grant = granted.set
+        if self.submit(address, cost, grant):
+            return True
+        if granted.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+            return True
+        if self.withdraw(address, grant):
+            return False
+        granted.wait()  # Granted just as the deadline passed; waited for, so the late set() cannot grant the next command
+        return True
+
+    def submit(self, address, cost, grant):
+        """ Queues a command; True if it may run at once, otherwise grant() is called when its turn comes. """
+        with self.lock:
+            session = self._enqueue(address, cost, grant)
+            if self.running < self.slots and not self.ready and len(self.active) == 1 and len(session.queue) == 1:
+                # Nobody else is waiting: skip the round and the wake-up
+                self.active.pop()
+                self._dispatched(session, *session.queue.popleft())
+                self.running += 1
+                return True
+            grants = self._fill_slots()
+        for pending in grants:
+            if pending is not grant:
+                pending()
+        return grant in grants
+
+    def done(self):
+        """ A dispatched command finished: its slot goes to the next command in round order. """
+        with self.lock:
+            self.running -= 1
+            grants = self._fill_slots()
+        for grant in grants:
+            grant()
+
+    async def turn(self, address, cost, deadline=None):
+        """ wait_turn for a connection served by the running event loop; no done() needed. """
+        delay = self.throttle(address, cost, deadline)
+        if delay is None:
+            return False
+        if delay:
+            await asyncio.sleep(delay)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            if not granted.done():
+                granted.set_result(None)
+
+        with self.lock:
+            self._enqueue(address, cost, grant)
+            if not self.round_scheduled:
+                # Deferred to the next loop pass, so every connection with a command ready can queue first
+                self.round_scheduled = True
+                loop.call_soon(self._run_round, loop)
+        if deadline is None:
+            await granted
+            return True
+        try:
+            await asyncio.wait_for(granted, max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            return not self.withdraw(address, grant)
+        return True
+
+    def withdraw(self, address, grant):
+        """ Takes a command that is still queued out of the scheduler; False if it has been granted meanwhile. """
+        with self.lock:
+            session = self.sessions.get(address)
+            if session is None:
+                return False
+            for entry in session.queue:
+                if entry[1] is grant:
+                    session.queue.remove(entry)
+                    self.queued -= 1
+                    if not session.queue:
+                        self.active.remove(session)
+                        session.deficit = 0
+                    return True
+            return False
+
+    def _run_round(self, loop):
+        with self.lock:
+            self._round()
+            grants = list(self.ready)
+            self.ready.clear()
+            self.round_scheduled = bool(self.active)  # Commands still short of deficit wait for the next pass
+            if self.round_scheduled:
+                loop.call_soon(self._run_round, loop)
+        for grant in grants:
+            grant()
+
+    def _enqueue(self, address, cost, grant):
+        session = self.session(address)
+        session.queue.append((cost, grant, time.perf_counter_ns()))
+        self.queued += 1
+        if len(session.queue) == 1:
+            self.active.append(session)
+        return session
+
+    def _fill_slots(self):
+        grants = []
+        while self.running < self.slots:
+            if not self.ready:
+                self._round()
+                if not self.ready:
+                    break
+            grants.append(self.ready.popleft())
+            self.running += 1
+        return grants
+
+    def _round(self):
+        """ One deficit round robin round: moves the commands whose session's deficit covers them to ready. """
+        while self.active and not self.ready:
+            for _ in range(len(self.active)):
+                session = self.active.popleft()
+                session.deficit += self.quantum
+                while session.queue and session.queue[0][0] <= session.deficit:
+                    cost, grant, queued = session.queue.popleft()
+                    session.deficit -= cost
+                    self._dispatched(session, cost, grant, queued)
+                    self.ready.append(grant)
+                if session.queue:
+                    self.active.append(session)
+                else:
+                    session.deficit = 0  # An idle session does not bank credit
+
+    def _dispatched(self, session, cost, grant, queued):
+        wait = time.perf_counter_ns() - queued
+        self.queued -= 1
+        if self.wait_histogram is not None:
+            self.wait_histogram.record(wait)
+        session.dispatched += 1
+        session.work += cost
+        session.waited_ns += wait
+        if wait > session.max_wait_ns:
+            session.max_wait_ns = wait
+
+    def starvation(self, worst=5):
+        """ Fairness across the connected sessions for the metrics gauge.
+
+        jain_index is Jain's fairness index of the work each session got
+        per second connected: 1.0 when all got the same, 1/n when one got
+        everything. It means most when every client is busy, as under a
+        load test. worst lists the sessions that waited longest.
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+        now = time.monotonic()
+        rates = [session.work / max(now - session.connected, 1e-3) for session in sessions]
+        squares = sum(rate * rate for rate in rates)
+        worst_sessions = sorted(sessions, key=lambda session: session.max_wait_ns, reverse=True)[:worst]
+        return {
+            'sessions': len(sessions),
+            'jain_index': sum(rates) ** 2 / (len(rates) * squares) if squares else 1.0,
+            'worst': {f"{session.address[0]}:{session.address[1]}": session.summary() for session in worst_sessions},
+        }
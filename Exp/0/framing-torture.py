@@ -0,0 +1,104 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ticket_protocol import FRAMED_HELLO, Connection, FrameReader, negotiate_server
+
+server_port = 12345  # Port hard-coded in server-0-10.py
+requests_per_client = 500
+
+
+def write_fragmented(sock, data, chunk_size):
+    """ Sends data in chunk_size pieces, with TCP_NODELAY so small pieces really leave as separate segments. """
+    if sock.family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for start in range(0, len(data), chunk_size):
+        sock.sendall(data[start:start + chunk_size])
+
+
+def check_frame_reader():
+    """ Feeds one stream to FrameReader in every fragmentation from 1 byte to 64 KiB. """
+    messages = [f"BUY {i}" for i in range(2000)] + ["SELL " + "9" * 60000]
+    stream = b"".join(message.encode() + b"\n" for message in messages)
+    for chunk_size in (1, 2, 3, 7, 64, 1500, 65536):
+        reader = FrameReader()
+        frames = []
+        for start in range(0, len(stream), chunk_size):
+            frames.extend(reader.feed(stream[start:start + chunk_size]))
+        assert frames == messages, f"FrameReader broke the stream at {chunk_size}-byte reads"
+    print("FrameReader: ok for 1 byte to 64 KiB reads")
+
+
+def check_negotiation(chunk_size):
+    """ Runs negotiate_server against a client whose hello and commands arrive in chunk_size pieces. """
+    client, server = socket.socketpair()
+    messages = [f"BUY {4000 + i}" for i in range(requests_per_client)]
+    stream = FRAMED_HELLO + b"".join(message.encode() + b"\n" for message in messages)
+    writer = threading.Thread(target=write_fragmented, args=(client, stream, chunk_size))
+    writer.start()
+    connection = negotiate_server(server)
+    received = [connection.recv() for _ in messages]
+    writer.join()
+    assert connection.framed and received == messages, f"negotiation failed with {chunk_size}-byte writes"
+    assert client.recv(len(FRAMED_HELLO)) == FRAMED_HELLO
+
+    legacy_client, legacy_server = socket.socketpair()
+    legacy_client.sendall(b"BUY 4000")
+    connection = negotiate_server(legacy_server)
+    assert not connection.framed and connection.recv() == "BUY 4000", "legacy client was not detected"
+    for sock in (client, server, legacy_client, legacy_server):
+        sock.close()
+    print(f"negotiation: ok with {chunk_size}-byte writes and with a legacy client")
+
+
+def torture_client(chunk_size, results):
+    """ Pipelines requests_per_client framed BUYs to the server in chunk_size writes and collects the replies. """
+    sock = socket.create_connection(('localhost', server_port))
+    stream = FRAMED_HELLO + b"".join(b"BUY 4000\n" for _ in range(requests_per_client))
+    writer = threading.Thread(target=write_fragmented, args=(sock, stream, chunk_size))
+    writer.start()
+    assert sock.recv(len(FRAMED_HELLO), socket.MSG_WAITALL) == FRAMED_HELLO
+    connection = Connection(sock, True)
+    results[chunk_size] = [connection.recv() for _ in range(requests_per_client)]
+    writer.join()
+    connection.close()
+
+
+def check_server(mode):
+    """ Starts server-0-10.py in the given mode and tortures it with a 1-byte and a 64 KiB client. """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server-0-10.py")
+    with tempfile.TemporaryDirectory() as log_dir:
+        server = subprocess.Popen([sys.executable, script], cwd=log_dir, stdin=subprocess.PIPE,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server.stdin.write(f"torture\ntorture\n{mode}\n".encode())
+        server.stdin.close()
+        time.sleep(1.0)
+
+        results = {}
+        clients = [threading.Thread(target=torture_client, args=(chunk_size, results)) for chunk_size in (1, 65536)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        server.wait(timeout=30)
+
+    sold = [reply.split()[0] for replies in results.values() for reply in replies if reply != "SOLDOUT"]
+    assert all(len(replies) == requests_per_client for replies in results.values()), "replies were lost"
+    assert len(sold) == len(set(sold)) == 25, "tickets were lost or sold twice"
+    print(f"{mode} server: ok, {2 * requests_per_client} pipelined BUYs in 1-byte and 64 KiB writes")
+
+
+def main():
+    check_frame_reader()
+    for chunk_size in (1, 65536):
+        check_negotiation(chunk_size)
+    for mode in ("threaded", "asyncio"):
+        check_server(mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class Entry:
+    """ One idempotency key: the request it was first sent with, who sent it and, once it has run, its response. """
+
+    def __init__(self, request, address, expires):
+        self.request = request
+        self.address = address
+        self.expires = expires
+        self.response = None
+        self.finished = False
+        self.done = None  # threading.Event, made once a claim has to wait for the response
+
+
+class IdempotencyCache:
+    """ Responses to requests sent with an idempotency key, so a resent request is answered without running again.
+
+    claim() is called with the key before a request runs. The first claim
+    runs the request and hands its Entry and response to finish(). Any
+    later claim of the key is told to replay that response instead,
+    whichever connection it comes from, so a client that retries after a
+    lost reply or a reconnect, or hedges on two connections, buys or sells
+    once. A claim made while the first is still running waits for its
+    response; a request that failed leaves nothing behind, so the next
+    claim runs it.
+
+    Keys expire ttl seconds after their first claim, and the oldest go
+    once there are more than capacity. Entries are kept in claim order,
+    so both are taken off the front, at no cost while nothing is due.
+    """
+
+    def __init__(self, capacity=65536, ttl=300.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> Entry, oldest first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def claim(self, key, request, address, now=None):
+        """ Returns (entry, replay): run the request and finish() the entry, or replay the response of the key's first one. """
+        now = time.monotonic() if now is None else now
+        while True:
+            with self.lock:
+                self._expire(now)
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = Entry(request, address, now + self.ttl)
+                    return entry, False
+                if entry.finished:
+                    return entry, True
+                if entry.done is None:
+                    entry.done = threading.Event()
+            entry.done.wait()  # Until the first request has run
+            if entry.response is not None:
+                return entry, True
+
+    def finish(self, key, entry, response):
+        """ Records the response of a claimed request; None if it failed, which frees the key for a retry. """
+        with self.lock:
+            entry.response = response
+            entry.finished = True
+            if response is None and self.entries.get(key) is entry:
+                del self.entries[key]
+        if entry.done is not None:
+            entry.done.set()  # Even once evicted: a claim of the key may be waiting on it
+
+    def _expire(self, now):
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry.expires > now and len(self.entries) < self.capacity:
+                break
+            del self.entries[key]
@@ -0,0 +1,155 @@
+import logging
+import threading
+
+# Most deltas in one EVENT frame; a larger burst goes out as several frames
+max_deltas_per_event = 256
+
+# Bytes of the sold bitsets compared at once while looking for changes
+diff_chunk = 256
+
+
+class InventoryFeed:
+    """ Pushes compact inventory deltas to the connections that sent SUBSCRIBE.
+
+    publish() runs every feed interval. It diffs the sold bitsets of the
+    inventory against the copy taken at the previous run and drains the
+    tickets whose resale ask changed. Each ticket that changed is reported
+    once with its current state, so any burst between two runs coalesces
+    into at most one delta per ticket, and a ticket sold and returned
+    within one interval is not reported at all:
+
+        +<ticket>:<price>   back in the pool at its face price (released)
+        -<ticket>           sold or held, and not offered for resale
+        =<ticket>:<price>   offered on the resale book at a new price (repriced)
+
+    Deltas go out as "EVENT <seq> <delta> ..." frames. Each frame has the
+    next sequence number, so a subscriber can spot a frame it never got.
+    Reading the bitsets takes no lock: a change caught halfway shows up
+    complete at the next run. The multiprocess server's bitsets live in
+    shared memory, so each worker's feed sees every worker's sales.
+
+    Each connection attaches a sink, a callable sending one frame, and
+    SUBSCRIBE switches it on. publish() and the HANDOFF pushes of a
+    seller's request call the sinks one after another, so a sink must not
+    wait for its client: it queues the frame, and raises once a subscriber
+    too slow to keep up has too much queued; it is dropped then. Sinks are
+    called outside the feed's lock, so neither SUBSCRIBE nor a
+    disconnecting connection's detach() waits for them either.
+    """
+
+    def __init__(self, inventory, book=None, book_lock=None):
+        self.inventory = inventory
+        self.book = book
+        self.book_lock = book_lock or threading.Lock()
+        self.sinks = {}  # Connection address -> callable sending one frame
+        self.subscribers = set()
+        self.snapshot = None  # sold_flags() of every segment at the last run, taken while anyone subscribes
+        self.offered = {}  # Ticket -> resale price subscribers were last told
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def attach(self, address, sink):
+        self.sinks[address] = sink
+
+    def detach(self, address):
+        with self.lock:
+            self.sinks.pop(address, None)
+            self.subscribers.discard(address)
+
+    def push(self, address, frame):
+        """ Sends one frame to a single attached connection, subscribed or not; False if it could not. """
+        sink = self.sinks.get(address)
+        if sink is None:
+            return False
+        try:
+            sink(frame)
+        except Exception as e:
+            logging.warning("Could not push to %s: %r", address, e)
+            return False
+        return True
+
+    def subscribe(self, address):
+        """ Starts pushing deltas to the connection; False if it has no sink, i.e. it is not framed. """
+        with self.lock:
+            if address not in self.sinks:
+                return False
+            if self.snapshot is None:
+                self.snapshot = [segment.sold_flags() for segment in self.inventory.segments()]
+                if self.book is not None:
+                    with self.book_lock:
+                        self.book.changed.clear()
+                        self.offered = {ticket: self.book.orders[order_id][2] for ticket, order_id in self.book.asked.items()}
+            self.subscribers.add(address)
+            return True
+
+    def unsubscribe(self, address):
+        with self.lock:
+            self.subscribers.discard(address)
+
+    def publish(self):
+        """ Sends the deltas since the last run to every subscriber; returns how many deltas there were. """
+        with self.lock:
+            if not self.subscribers:
+                self.snapshot = None  # Nobody to tell: stop diffing until the next SUBSCRIBE
+                if self.book is not None:
+                    with self.book_lock:
+                        self.book.changed.clear()
+                return 0
+            deltas = self.collect()
+            frames = []
+            for start in range(0, len(deltas), max_deltas_per_event):
+                self.seq += 1
+                frames.append(" ".join([f"EVENT {self.seq}"] + deltas[start:start + max_deltas_per_event]))
+            sinks = [(address, self.sinks[address]) for address in self.subscribers] if frames else []
+        for address, sink in sinks:
+            try:
+                for frame in frames:
+                    sink(frame)
+            except Exception as e:
+                logging.warning("Dropped inventory subscriber %s: %r", address, e)
+                self.unsubscribe(address)
+        return len(deltas)
+
+    def collect(self):
+        """ One delta per ticket whose pool or resale state changed since the last run. """
+        states = {}
+        for index, segment in enumerate(self.inventory.segments()):
+            flags = segment.sold_flags()
+            previous = self.snapshot[index]
+            self.snapshot[index] = flags
+            if flags == previous:
+                continue
+            for chunk in range(0, len(flags), diff_chunk):
+                if flags[chunk:chunk + diff_chunk] == previous[chunk:chunk + diff_chunk]:
+                    continue
+                for byte in range(chunk, min(chunk + diff_chunk, len(flags))):
+                    flipped = flags[byte] ^ previous[byte]
+                    while flipped:
+                        bit = (flipped & -flipped).bit_length() - 1
+                        flipped &= flipped - 1
+                        offset = byte * 8 + bit
+                        ticket_number = str(segment.first_ticket + offset)
+                        states[ticket_number] = None if flags[byte] >> bit & 1 else segment.prices[offset]
+
+        deltas = []
+        with self.book_lock:
+            changed = self.book.changed if self.book is not None else set()
+            for ticket_number in set(states) | changed:
+                face_price = states.get(ticket_number)
+                if face_price is not None:
+                    self.offered.pop(ticket_number, None)
+                    deltas.append(f"+{ticket_number}:{face_price}")
+                    continue
+                order_id = self.book.asked.get(ticket_number) if self.book is not None else None
+                if order_id is not None:
+                    price = self.book.orders[order_id][2]
+                    if self.offered.get(ticket_number) != price:
+                        self.offered[ticket_number] = price
+                        deltas.append(f"={ticket_number}:{price}")
+                elif ticket_number in states or self.offered.pop(ticket_number, None) is not None:
+                    deltas.append(f"-{ticket_number}")
+            changed.clear()
+        return deltas
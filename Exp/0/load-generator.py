@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import queue
+import random
+import socket
+import threading
+import time
+from collections import Counter
+
+from resale_market import ResaleOrders
+from ticket_client import client
+from ticket_metrics import LatencyHistogram
+from ticket_protocol import negotiate_client
+
+# BUY replies reported as they are; any other one is a ticket, reported as OK
+buy_outcomes = ("NOFUNDS", "SOLDOUT") + client.shed_replies
+
+# Failures that end a user's run, counted as an error of the operation in flight: the server dropped or reset the
+# connection, or stopped answering. Anything else is a bug in the client or the load generator and propagates.
+connection_errors = (ConnectionError, socket.timeout, asyncio.TimeoutError)
+
+# RESALE asks at this multiple of what the ticket cost and bids up to it times the dearest face price
+resale_markup = 1.2
+
+
+def resale_order(orders, ticket_db):
+    """ Half the time an ASK for the cheapest ticket held, otherwise a BID; None if the user can afford neither. """
+    if ticket_db and random.random() < 0.5:
+        return orders.place_ask(resale_markup)
+    return orders.place_bid(random.randint(200, int(client.max_ticket_price * resale_markup)))
+
+
+def sell_outcome(response):
+    """ A SELL reported as OK once the server took the ticket back, as the reply word otherwise; SKIPPED with none to sell. """
+    if not response:
+        return "SKIPPED"
+    return "OK" if response[:1].isdigit() else response.split()[0]
+
+
+def resale_reply(reply):
+    """ A RESALE or FILLS reply, which ResaleOrders settles; raises ConnectionError if the server closed instead. """
+    if reply is None:
+        raise ConnectionError("Server closed the connection")
+    return reply
+
+
+def next_start(arrivals, deadline):
+    """ perf_counter_ns() the next operation's latency counts from; None once the run is over.
+
+    Closed loop (no arrivals) that is now. Open loop it is the time the
+    next request was scheduled to arrive, so the time it waited for a
+    free user counts too, as it would for a real client arriving then.
+    """
+    if time.monotonic() >= deadline:
+        return None
+    if arrivals is None:
+        return time.perf_counter_ns()
+    try:
+        return arrivals.get(timeout=max(0.0, deadline - time.monotonic()))
+    except queue.Empty:
+        return None
+
+
+def schedule_arrivals(arrivals, rate, deadline):
+    """ Open loop: puts request arrival times into arrivals until the deadline, whether or not the users keep up.
+
+    Arrivals are a Poisson stream of rate per second. Requests still
+    queued at the deadline never start; the report counts them.
+    """
+    arrival = time.perf_counter_ns()
+    while time.monotonic() < deadline:
+        arrival += int(random.expovariate(rate) * 1e9)
+        delay = (arrival - time.perf_counter_ns()) / 1e9
+        if delay > 0:
+            time.sleep(delay)
+        arrivals.put(arrival)
+
+
+async def next_start_async(arrivals, deadline):
+    """ next_start on the event loop. """
+    if time.monotonic() >= deadline:
+        return None
+    if arrivals is None:
+        return time.perf_counter_ns()
+    try:
+        return await asyncio.wait_for(arrivals.get(), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        return None
+
+
+async def schedule_arrivals_async(arrivals, rate, deadline):
+    """ schedule_arrivals on the event loop. """
+    arrival = time.perf_counter_ns()
+    while time.monotonic() < deadline:
+        arrival += int(random.expovariate(rate) * 1e9)
+        delay = (arrival - time.perf_counter_ns()) / 1e9
+        if delay > 0:
+            await asyncio.sleep(delay)
+        arrivals.put_nowait(arrival)
+
+
+class UserStats:
+    """ Per-user latency histograms and outcome/error counts, merged across users at the end. """
+
+    def __init__(self):
+        self.histograms = {}
+        self.outcomes = Counter()
+        self.errors = Counter()
+
+    def record(self, operation, outcome, start):
+        if operation not in self.histograms:
+            self.histograms[operation] = LatencyHistogram()
+        self.histograms[operation].record(time.perf_counter_ns() - start)
+        self.outcomes[operation, outcome] += 1
+
+
+class VirtualUser(UserStats):
+    """ One synthetic client: its own TCP connection, UDP socket, wallet and UDP listener thread.
+
+    Operations call straight into the client's buy_ticket, sell_ticket and
+    scalp_from_peers, so the load has the same wire behaviour as the real
+    client, peer registry lookups included.
+    """
+
+    def __init__(self, user_id, host, port, balance):
+        super().__init__()
+        self.client_id = str(user_id)
+        self.user_balance = [balance]
+        self.ticket_db = client.TicketWallet()
+        self.stop_event = threading.Event()
+        self.transaction_complete = threading.Event()
+        self.session = client.PeerSession(self.ticket_db, self.user_balance)
+        self.resale = ResaleOrders(self.ticket_db, self.user_balance)
+
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind((host, 0))
+        self.udp_socket.settimeout(1.0)
+        self.udp_address = self.udp_socket.getsockname()
+        self.server_connection = negotiate_client(socket.create_connection((host, port)))
+        client.register_peer(self.server_connection, self.udp_address)
+        self.udp_thread = threading.Thread(target=client.udp_listener, daemon=True, args=(
+            self.udp_socket, self.stop_event, self.ticket_db, self.user_balance, self.client_id, self.session))
+
+    def run(self, operations, weights, users, think_time, deadline, arrivals=None):
+        """ Runs operations until the deadline: back to back (closed loop), or one per arrival taken off arrivals. """
+        self.udp_thread.start()
+        while True:
+            start = next_start(arrivals, deadline)
+            if start is None:
+                break
+            operation = random.choices(operations, weights)[0]
+            try:
+                if operation == "BUY":
+                    response = client.buy_ticket(self.server_connection, self.ticket_db, self.user_balance)
+                    if response is None:
+                        self.errors[operation] += 1
+                        break  # The server closed the connection
+                    self.record(operation, response if response in buy_outcomes else "OK", start)
+                elif operation == "SELL":
+                    if not self.ticket_db:
+                        self.outcomes[operation, "SKIPPED"] += 1
+                        continue
+                    response = client.sell_ticket(self.server_connection, self.ticket_db, self.user_balance)
+                    if response is None:
+                        raise ConnectionError("Server closed the connection")
+                    self.record(operation, sell_outcome(response), start)
+                elif operation == "RESALE":
+                    message = resale_order(self.resale, self.ticket_db)
+                    if message is None:
+                        self.outcomes[operation, "SKIPPED"] += 1
+                        continue
+                    self.server_connection.send(message)
+                    status = self.resale.placed(resale_reply(self.server_connection.recv()))
+                    self.server_connection.send("FILLS")  # Settles earlier orders that have filled since
+                    self.resale.filled(resale_reply(self.server_connection.recv()))
+                    self.record(operation, status, start)
+                elif len(users) > 1:
+                    self.transaction_complete.clear()
+                    outcome = client.scalp_from_peers(self.server_connection, self.udp_socket, self.ticket_db, self.user_balance,
+                                                      self.transaction_complete, self.client_id, self.session)
+                    if outcome is None:
+                        self.errors[operation] += 1  # No reply despite retransmissions
+                    else:
+                        self.record(operation, "OK" if outcome == "BOUGHT" else outcome, start)
+            except connection_errors:
+                self.errors[operation] += 1
+                break
+            if think_time and arrivals is None:
+                time.sleep(random.expovariate(1 / think_time))
+
+    def close(self):
+        self.stop_event.set()
+        self.server_connection.close()
+
+
+class AsyncVirtualUser(UserStats):
+    """ VirtualUser driving the client's AsyncClient, so thousands of users share one event loop. """
+
+    def __init__(self, user_id, balance):
+        super().__init__()
+        self.client = client.AsyncClient(str(user_id), balance)
+        self.resale = ResaleOrders(self.client.ticket_db, self.client.user_balance)
+
+    async def connect(self, host, port):
+        await self.client.connect(host, port, (host, 0))
+
+    async def run(self, operations, weights, users, think_time, deadline, arrivals=None):
+        while True:
+            start = await next_start_async(arrivals, deadline)
+            if start is None:
+                break
+            operation = random.choices(operations, weights)[0]
+            try:
+                if operation == "BUY":
+                    response = await self.client.buy()
+                    if response is None:
+                        self.errors[operation] += 1
+                        break  # The server closed the connection
+                    self.record(operation, response if response in buy_outcomes else "OK", start)
+                elif operation == "SELL":
+                    if not self.client.ticket_db:
+                        self.outcomes[operation, "SKIPPED"] += 1
+                        await asyncio.sleep(0)  # Let the other users run
+                        continue
+                    response = await self.client.sell()
+                    if response is None:
+                        raise ConnectionError("Server closed the connection")
+                    self.record(operation, sell_outcome(response), start)
+                elif operation == "RESALE":
+                    message = resale_order(self.resale, self.client.ticket_db)
+                    if message is None:
+                        self.outcomes[operation, "SKIPPED"] += 1
+                        await asyncio.sleep(0)
+                        continue
+                    status = self.resale.placed(resale_reply(await self.client.round_trip(message)))
+                    self.resale.filled(resale_reply(await self.client.round_trip("FILLS")))
+                    self.record(operation, status, start)
+                elif len(users) > 1:
+                    outcome = await self.client.scalp()
+                    if outcome is None:
+                        self.errors[operation] += 1  # No reply despite retransmissions
+                    else:
+                        self.record(operation, "OK" if outcome == "BOUGHT" else outcome, start)
+            except connection_errors:
+                self.errors[operation] += 1
+                break
+            if think_time and arrivals is None:
+                await asyncio.sleep(random.expovariate(1 / think_time))
+
+    def close(self):
+        self.client.close()
+
+
+def parse_mix(text):
+    """ "BUY=70,SELL=20,SCALP=10" -> (["BUY", "SELL", "SCALP"], [70, 20, 10]); RESALE trades on the server's resale book """
+    operations, weights = [], []
+    for item in text.split(","):
+        operation, weight = item.split("=")
+        if operation.upper() not in ("BUY", "SELL", "SCALP", "RESALE"):
+            raise argparse.ArgumentTypeError(f"unknown operation {operation}")
+        operations.append(operation.upper())
+        weights.append(float(weight))
+    return operations, weights
+
+
+def parse_balance(text):
+    """ "4000" or a uniform range like "2000-6000" -> (low, high) """
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+
+def report(users, elapsed, unstarted=0):
+    histograms = {}
+    outcomes = Counter()
+    errors = Counter()
+    for user in users:
+        for operation, histogram in user.histograms.items():
+            histograms.setdefault(operation, LatencyHistogram()).merge(histogram)
+        outcomes.update(user.outcomes)
+        errors.update(user.errors)
+
+    completed = sum(histogram.total for histogram in histograms.values())
+    attempted = completed + sum(errors.values())
+    print(f"{len(users)} virtual users, {elapsed:.1f} s, {completed} operations, {completed / elapsed:.0f} ops/s")
+    print(f"{'operation':>10} {'count':>8} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'max ms':>9} {'errors':>8} {'error %':>8}")
+    for operation in sorted(set(histograms) | set(errors)):
+        histogram = histograms.get(operation, LatencyHistogram())
+        tried = histogram.total + errors[operation]
+        print(f"{operation:>10} {histogram.total:>8} {histogram.percentile(0.5) / 1e6:>9.2f} {histogram.percentile(0.99) / 1e6:>9.2f}"
+              f" {histogram.percentile(0.999) / 1e6:>9.2f} {histogram.max / 1e6:>9.2f} {errors[operation]:>8}"
+              f" {100 * errors[operation] / tried if tried else 0:>8.2f}")
+    print(f"{'total':>10} {completed:>8} {'':>9} {'':>9} {'':>9} {'':>9} {sum(errors.values()):>8}"
+          f" {100 * sum(errors.values()) / attempted if attempted else 0:>8.2f}")
+    print("Outcomes: " + ", ".join(f"{operation} {outcome}: {count}" for (operation, outcome), count in sorted(outcomes.items())))
+    if unstarted:
+        print(f"{unstarted} arrivals found no free user before the deadline and never started")
+
+
+async def run_async_users(args):
+    users = [AsyncVirtualUser(user_id, random.randint(*args.balance)) for user_id in range(1, args.users + 1)]
+    operations, weights = args.mix
+    if args.surge:
+        deadline = time.monotonic() + args.duration
+        start = time.perf_counter()
+        await asyncio.gather(*(surge_async_user(user, args, operations, weights, users, deadline) for user in users))
+        report(users, time.perf_counter() - start)
+        return
+    for user in users:
+        await user.connect(args.host, args.port)
+
+    deadline = time.monotonic() + args.duration
+    arrivals = asyncio.Queue() if args.rate else None
+    start = time.perf_counter()
+    runs = [user.run(operations, weights, users, args.think_time, deadline, arrivals) for user in users]
+    if arrivals is not None:
+        runs.append(schedule_arrivals_async(arrivals, args.rate, deadline))
+    await asyncio.gather(*runs)
+    elapsed = time.perf_counter() - start
+    for user in users:
+        user.close()
+    report(users, elapsed, arrivals.qsize() if arrivals is not None else 0)
+
+
+async def surge_async_user(user, args, operations, weights, users, deadline):
+    """ One user of an on-sale surge: connects with everyone else, trades once admitted, and leaves at the deadline. """
+    start = time.perf_counter_ns()
+    await user.connect(args.host, args.port)
+    user.record("CONNECT", "OK", start)  # Time spent in the waiting room
+    try:
+        await user.run(operations, weights, users, args.think_time, deadline)
+    finally:
+        user.close()  # Frees the admission slot for the next user in the waiting room
+
+
+def surge_user(user_id, args, operations, weights, users, deadline):
+    """ surge_async_user for a thread of its own; the user joins users once it is connected. """
+    start = time.perf_counter_ns()
+    user = VirtualUser(user_id, args.host, args.port, random.randint(*args.balance))
+    user.record("CONNECT", "OK", start)
+    users.append(user)
+    try:
+        user.run(operations, weights, users, args.think_time, deadline)
+    finally:
+        user.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the ticket server with many synthetic clients. Users beyond the "
+                                                 "server's max_admitted wait in its waiting room until others disconnect, "
+                                                 "so more of them than that need --surge.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--users", type=int, default=100, help="virtual users, one thread each unless --asyncio")
+    parser.add_argument("--asyncio", action="store_true", help="run every user on one event loop with the asyncio client")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--balance", type=parse_balance, default=(4000, 4000), help="starting balance or LOW-HIGH range")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between operations in seconds (exponential)")
+    parser.add_argument("--fanout", type=int, default=client.scalp_fanout, help="most peers each SCALP asks for a quote")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("BUY=70,SELL=25,SCALP=5"), help="operation weights")
+    parser.add_argument("--surge", action="store_true", help="connect every user at once, as at an on-sale, and time the "
+                                                             "waiting room as CONNECT; each user trades once admitted")
+    parser.add_argument("--deadline", type=int, default=client.request_deadline,
+                        help="milliseconds the server gets to start each BUY and SELL before answering EXPIRED")
+    parser.add_argument("--idempotency-keys", action="store_true", help="send each BUY and SELL with an idempotency key")
+    parser.add_argument("--rate", type=float, help="open loop: operations per second arriving at random (Poisson), each "
+                                                   "taken by the next free user and timed from its arrival, instead of "
+                                                   "every user sending back to back")
+    args = parser.parse_args()
+    if args.rate is not None and (args.rate <= 0 or args.surge):
+        parser.error("--rate must be positive and cannot be combined with --surge")
+    client.scalp_fanout = args.fanout
+    client.request_deadline = args.deadline
+    client.idempotency_keys = args.idempotency_keys
+    if args.asyncio:
+        asyncio.run(run_async_users(args))
+        return
+    operations, weights = args.mix
+    if args.surge:
+        users = []
+        deadline = time.monotonic() + args.duration
+        start = time.perf_counter()
+        threads = [threading.Thread(target=surge_user, args=(user_id, args, operations, weights, users, deadline))
+                   for user_id in range(1, args.users + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(users, time.perf_counter() - start)
+        return
+
+    users = []
+    for user_id in range(1, args.users + 1):
+        users.append(VirtualUser(user_id, args.host, args.port, random.randint(*args.balance)))
+
+    deadline = time.monotonic() + args.duration
+    arrivals = queue.SimpleQueue() if args.rate else None
+    start = time.perf_counter()
+    threads = []
+    for user in users:
+        thread = threading.Thread(target=user.run, args=(operations, weights, users, args.think_time, deadline, arrivals))
+        thread.start()
+        threads.append(thread)
+    if arrivals is not None:
+        schedule_arrivals(arrivals, args.rate, deadline)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for user in users:
+        user.close()
+    report(users, elapsed, arrivals.qsize() if arrivals is not None else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import heapq
+import multiprocessing
+import socket
+import threading
+from array import array
+from multiprocessing.sharedctypes import RawArray
+
+
+def pack_host(host):
+    """ A dotted IPv4 address as the integer the registry stores; ValueError for anything else, hostnames included. """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, host), 'big')
+    except OSError:
+        raise ValueError(f"Invalid IPv4 address: {host}") from None
+
+
+class PeerRegistry:
+    """ Live scalpers, keyed by their server connection: the UDP endpoint each one scalps on and the tickets it holds.
+
+    A client REGISTERs its UDP endpoint over its server connection and is
+    dropped again when the connection closes. Its stock follows the tickets
+    the connection buys from and sells back to the server, the SCALPED
+    reports buyers send after buying from a peer, and the count each client
+    reports with every lookup. lookup() then points a buyer at the peers
+    that actually have tickets, instead of it collecting "Scalper is
+    sold-out" quotes from everyone.
+
+    Entries live in fixed slots of typed arrays; a free slot has port 0.
+    Writers take the lock. Readers do not: a slot's port is written last
+    and cleared first, so a lookup never sees a half-filled entry. Which
+    slot belongs to which connection is only known to the process serving
+    that connection.
+    """
+
+    def __init__(self, capacity=4096, lock=None):
+        self.hosts = array('I', [0]) * capacity  # IPv4 address as an integer
+        self.ports = array('H', [0]) * capacity
+        self.stocks = array('i', [0]) * capacity
+        self.lock = threading.Lock() if lock is None else lock
+        self._used = 0  # Slots below this index have been handed out at least once
+        self._slots = {}  # Connection address -> slot, for the connections this process serves
+        self._connections = {}  # Slot -> connection address, the other way round
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, address):
+        return address in self._slots
+
+    def register(self, address, host, port, stock=0):
+        """ Registers or moves the connection's UDP endpoint; False when every slot is taken. """
+        if not 0 < port < 1 << 16:
+            raise ValueError(f"Invalid UDP port: {port}")
+        packed = pack_host(host)
+        with self.lock:
+            slot = self._slots.get(address)
+            if slot is None:
+                slot = next((slot for slot in range(self._used) if not self.ports[slot]), self._used)
+                if slot == len(self.ports):
+                    return False
+                self._used = max(self._used, slot + 1)
+            self.ports[slot] = 0
+            self.hosts[slot] = packed
+            self.stocks[slot] = stock
+            self.ports[slot] = port
+        self._slots[address] = slot
+        self._connections[slot] = address
+        return True
+
+    def unregister(self, address):
+        slot = self._slots.pop(address, None)
+        if slot is not None:
+            self._connections.pop(slot, None)
+            with self.lock:
+                self.ports[slot] = 0
+
+    def connection(self, host, port):
+        """ Address of the connection that registered host:port, or None; only this process's connections are known. """
+        packed = pack_host(host)
+        for slot in range(self._used):
+            if self.ports[slot] == port and self.hosts[slot] == packed:
+                return self._connections.get(slot)
+        return None
+
+    def report(self, address, stock):
+        """ Sets the connection's stock to the count its client reports. """
+        slot = self._slots.get(address)
+        if slot is not None:
+            with self.lock:
+                self.stocks[slot] = max(0, stock)
+
+    def adjust(self, address, change):
+        """ Adds change to the connection's stock, e.g. +1 for a ticket it bought from the server. """
+        slot = self._slots.get(address)
+        if slot is not None and change:
+            with self.lock:
+                self.stocks[slot] = max(0, self.stocks[slot] + change)
+
+    def transfer(self, address, host, port):
+        """ Moves one ticket from the peer scalping on host:port to the connection; False if that peer is gone. """
+        packed = pack_host(host)
+        own = self._slots.get(address)
+        with self.lock:
+            for slot in range(self._used):
+                if self.ports[slot] == port and self.hosts[slot] == packed:
+                    self.stocks[slot] = max(0, self.stocks[slot] - 1)
+                    if own is not None:
+                        self.stocks[own] += 1
+                    return True
+        return False
+
+    def _entries(self, address):
+        """ (slot, stock) of every registered peer other than the connection's own. """
+        own = self._slots.get(address)
+        used = self._used
+        return [(slot, stock) for slot, (port, stock) in enumerate(zip(self.ports[:used], self.stocks[:used]))
+                if port and slot != own]
+
+    def _endpoint(self, slot):
+        return socket.inet_ntoa(self.hosts[slot].to_bytes(4, 'big')), self.ports[slot]
+
+    def lookup(self, address, limit):
+        """ (host, port, stock) of up to limit other peers holding tickets, the best stocked first. """
+        stocked = [(stock, slot) for slot, stock in self._entries(address) if stock > 0]
+        return [self._endpoint(slot) + (stock,) for stock, slot in heapq.nlargest(limit, stocked)]
+
+    def roster(self, address):
+        """ (host, port) of every other registered peer, whatever its stock. """
+        return [self._endpoint(slot) for slot, _ in self._entries(address)]
+
+
+class SharedPeerRegistry(PeerRegistry):
+    """ PeerRegistry whose slots live in shared memory, so forked worker processes see each other's clients.
+
+    Built before the server forks; lock must then be a multiprocessing lock.
+    """
+
+    def __init__(self, capacity=4096, lock=None):
+        self._state = RawArray('i', 1)  # [slots handed out at least once]
+        super().__init__(capacity, multiprocessing.Lock() if lock is None else lock)
+        self.hosts = RawArray('I', capacity)
+        self.ports = RawArray('H', capacity)
+        self.stocks = RawArray('i', capacity)
+
+    @property
+    def _used(self):
+        return self._state[0]
+
+    @_used.setter
+    def _used(self, count):
+        self._state[0] = count
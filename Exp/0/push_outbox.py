@@ -0,0 +1,139 @@
+import socket
+import threading
+import time
+
+# Send flag that makes a send on a blocking socket take only what fits in the socket buffer; Windows has none, and a
+# push to a client that stopped reading can wait there until the buffer has room
+_dont_wait = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class PushOutbox:
+    """ The bytes waiting to go out on one threaded connection: pushed frames, and the replies queued behind them.
+
+    push() never waits for the client. It sends what the socket buffer
+    takes at once and leaves the rest to the PushFlusher, so a feed
+    publish, a waiting room report or a HANDOFF reaching a client that has
+    stopped reading holds up no one else. Once more than limit bytes are
+    waiting, push() refuses the frame with BufferError, as the asyncio
+    server's sinks do, and the caller drops the connection from whatever
+    it was pushing.
+
+    send() is for replies: it waits for the client to take everything
+    queued before the reply and the reply itself, as the request path
+    always has. Only one sender writes to the socket at a time, and each
+    writes whole frames after what is already queued, so pushed frames
+    and replies never interleave.
+    """
+
+    def __init__(self, sock, flusher, limit=1 << 20):
+        self.sock = sock
+        self.flusher = flusher
+        self.limit = limit
+        self.pending = bytearray()
+        self.error = None  # The OSError a send failed with; the connection is unusable after it
+        self.lock = threading.Lock()  # Guards pending and error, never held while sending
+        self.sending = threading.Lock()  # Held by whichever thread is writing to the socket
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, data):
+        """ Queues a pushed frame and sends what the socket takes without waiting; raises if the client is too slow. """
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if len(self.pending) > self.limit:
+                raise BufferError("client is not reading its pushed frames")
+            self.pending += data
+        self.flush()
+
+    def send(self, data):
+        """ Sends a reply after everything already queued, waiting as long as the client takes to read it. """
+        with self.sending:
+            with self.lock:
+                if self.error is not None:
+                    raise self.error
+                data = bytes(self.pending) + data
+                self.pending.clear()
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                with self.lock:
+                    self.error = e
+                raise
+        self.flush()  # Frames pushed while the reply went out
+
+    def flush(self):
+        """ Sends what the socket takes of the queued bytes without waiting; the flusher retries whatever is left. """
+        while self.sending.acquire(blocking=False):
+            try:
+                blocked = self._send_some()
+            finally:
+                self.sending.release()
+            with self.lock:
+                if blocked or not self.pending or self.error is not None:
+                    return
+        # Another thread is writing, and flushes again once it lets go
+
+    def _send_some(self):
+        """ One send of the queued bytes that does not wait; True if the socket buffer filled up and the flusher takes over. """
+        with self.lock:
+            data = bytes(self.pending)
+        if not data:
+            return False
+        try:
+            sent = self.sock.send(data, _dont_wait)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError as e:
+            with self.lock:
+                self.error = e
+            return False
+        with self.lock:
+            del self.pending[:sent]
+        if sent < len(data):
+            self.flusher.watch(self)
+            return True
+        return False
+
+
+class PushFlusher:
+    """ One background thread finishing the pushes that did not fit in a slow client's socket buffer.
+
+    Every interval it retries each outbox with bytes left, without
+    waiting on any of them, and forgets an outbox once it is empty or its
+    connection has failed. It sleeps while no outbox has bytes left.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.backlogged = set()
+        self.lock = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.backlogged)
+
+    def watch(self, outbox):
+        with self.lock:
+            self.backlogged.add(outbox)
+            self.lock.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="push-flusher", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        """ Retries every backlogged outbox once. """
+        with self.lock:
+            outboxes = list(self.backlogged)
+            self.backlogged.clear()
+        for outbox in outboxes:
+            outbox.flush()  # Watches the outbox again if bytes are still left
+
+    def _run(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.backlogged)
+            self.run_once()
+            time.sleep(self.interval)
@@ -0,0 +1,288 @@
+import heapq
+import itertools
+import threading
+from collections import defaultdict
+
+
+class TicketOwners:
+    """ Which client owns each ticket it bought, striped over locks so no lock is shared by every ticket.
+
+    A ticket's entry lives in one of `stripes` dicts picked by its number,
+    and each read or write takes that stripe's lock only, so recording a
+    BUY or SELL never waits for a trade on an unrelated ticket. An entry
+    also says whether its owner got the ticket through the resale book:
+    the seller escrowed such a ticket in its ask and no longer holds it,
+    so may_sell() refuses it to anyone but the new owner.
+    """
+
+    def __init__(self, stripes=64):
+        self.entries = [{} for _ in range(stripes)]  # Ticket number -> (owner, resold)
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def _stripe(self, ticket_number):
+        index = int(ticket_number) % len(self.entries)
+        return self.entries[index], self.locks[index]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries)
+
+    def __iter__(self):
+        for entries, lock in zip(self.entries, self.locks):
+            with lock:
+                ticket_numbers = list(entries)
+            yield from ticket_numbers
+
+    def __getitem__(self, ticket_number):
+        owner = self.get(ticket_number)
+        if owner is None:
+            raise KeyError(ticket_number)
+        return owner
+
+    def __setitem__(self, ticket_number, owner):
+        """ Records the owner of a ticket it got from the server or a reported scalp. """
+        entries, lock = self._stripe(ticket_number)
+        with lock:
+            entries[ticket_number] = (owner, False)
+
+    def get(self, ticket_number, default=None):
+        entries, lock = self._stripe(ticket_number)
+        with lock:
+            entry = entries.get(ticket_number)
+        return default if entry is None else entry[0]
+
+    def transfer(self, ticket_number, owner):
+        """ Records the owner of a ticket it bought on the resale book. """
+        entries, lock = self._stripe(ticket_number)
+        with lock:
+            entries[ticket_number] = (owner, True)
+
+    def discard(self, ticket_number, owner=None):
+        """ Forgets the ticket's owner; given one, only if the ticket is still that one's. """
+        entries, lock = self._stripe(ticket_number)
+        with lock:
+            entry = entries.get(ticket_number)
+            if entry is not None and (owner is None or entry[0] == owner):
+                del entries[ticket_number]
+
+    def may_sell(self, ticket_number, owner):
+        """ False if the ticket went to another client through the resale book, so owner has no claim on it. """
+        entries, lock = self._stripe(ticket_number)
+        with lock:
+            entry = entries.get(ticket_number)
+        return entry is None or not entry[1] or entry[0] == owner
+
+
+class ResaleBook:
+    """ Server-side resale market: asks on owned tickets, bids for any ticket, matched by price-time priority.
+
+    An ASK offers one ticket its owner holds at a price; a BID offers a
+    price for any one ticket. An incoming order trades against the best
+    resting order on the other side if the prices cross. The resting order
+    keeps priority and sets the price; among equal prices the older order
+    goes first. An order that would trade with one of its owner's own is
+    refused with SELFTRADE. A trade moves the ticket's ownership to the
+    bidder in the same step that takes both orders off the book, so a
+    ticket can never be sold twice.
+
+    Ownership follows the tickets each client buys from and sells back to
+    the server (acquire/release) and the resale trades themselves, in a
+    TicketOwners that can be read and written without the caller's lock
+    for a ticket with no ask. When a ticket changes hands any other way,
+    its resting ask is cancelled.
+    Clients learn about fills of their resting orders from take_fills();
+    on_trade(ticket number, seller, buyer, price) hears of every trade.
+
+    The two sides are heaps of (price, order id) and (-price, order id).
+    Order IDs increase, so they double as time priority. A cancelled order
+    stays in its heap until it reaches the top, and the heaps are rebuilt
+    once most of their entries are cancelled. Not thread safe; callers
+    serialize access with their own lock.
+    """
+
+    def __init__(self, on_trade=None):
+        self.on_trade = on_trade
+        self.owners = TicketOwners()
+        self.orders = {}  # Live order ID -> (owner, ticket number or None for a bid, price)
+        self.asks = []  # (price, order ID)
+        self.bids = []  # (-price, order ID)
+        self.asked = {}  # Ticket number -> ID of its live ask
+        self.owner_orders = defaultdict(set)  # Owner -> IDs of its live orders
+        self.fills = defaultdict(list)  # Owner -> "<order ID>:<ticket>:<price>" of resting orders filled since take_fills
+        self.changed = set()  # Tickets whose ask appeared or went away, for the inventory feed to pick up
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def acquire(self, ticket_number, owner):
+        """ Records that owner now holds the ticket, cancelling an ask the previous owner had on it. """
+        self._cancel_ask(ticket_number)
+        self.owners[ticket_number] = owner
+
+    def release(self, ticket_number):
+        """ The ticket went back to the server: it has no owner and no ask anymore. """
+        self._cancel_ask(ticket_number)
+        self.owners.discard(ticket_number)
+
+    def ask(self, owner, ticket_number, price):
+        """ Offers an owned ticket; FILLED <id> <ticket> <price> if a bid crosses it, else ASKED <id>. """
+        if self.owners.get(ticket_number) != owner:
+            return "NOTOWNER"
+        if ticket_number in self.asked:
+            return "ALREADYASKED"
+        order_id = next(self._ids)
+        best = self._best(self.bids)
+        if best is not None and -best[0] >= price:
+            if self.orders[best[1]][0] == owner:
+                return "SELFTRADE"
+            heapq.heappop(self.bids)
+            bidder, _, bid_price = self._remove(best[1])
+            self.owners.transfer(ticket_number, bidder)
+            self.fills[bidder].append(f"{best[1]}:{ticket_number}:{bid_price}")
+            if self.on_trade is not None:
+                self.on_trade(ticket_number, owner, bidder, bid_price)
+            return f"FILLED {order_id} {ticket_number} {bid_price}"
+        self._add(order_id, owner, ticket_number, price)
+        self.asked[ticket_number] = order_id
+        self.changed.add(ticket_number)
+        heapq.heappush(self.asks, (price, order_id))
+        return f"ASKED {order_id}"
+
+    def bid(self, owner, price):
+        """ Bids for any one ticket; FILLED <id> <ticket> <price> if an ask crosses it, else BIDDING <id>. """
+        order_id = next(self._ids)
+        best = self._best(self.asks)
+        if best is not None and best[0] <= price:
+            if self.orders[best[1]][0] == owner:
+                return "SELFTRADE"
+            heapq.heappop(self.asks)
+            seller, ticket_number, ask_price = self._remove(best[1])
+            del self.asked[ticket_number]
+            self.changed.add(ticket_number)
+            self.owners.transfer(ticket_number, owner)
+            self.fills[seller].append(f"{best[1]}:{ticket_number}:{ask_price}")
+            if self.on_trade is not None:
+                self.on_trade(ticket_number, seller, owner, ask_price)
+            return f"FILLED {order_id} {ticket_number} {ask_price}"
+        self._add(order_id, owner, None, price)
+        heapq.heappush(self.bids, (-price, order_id))
+        return f"BIDDING {order_id}"
+
+    def cancel(self, owner, order_id):
+        order = self.orders.get(order_id)
+        if order is None or order[0] != owner:
+            return "NOORDER"
+        self._remove(order_id)
+        if order[1] is not None:
+            del self.asked[order[1]]
+            self.changed.add(order[1])
+        self._compact()
+        return f"CANCELLED {order_id}"
+
+    def cancel_all(self, owner):
+        """ Withdraws every live order of an owner, e.g. when its connection closes. """
+        for order_id in list(self.owner_orders.get(owner, ())):
+            self.cancel(owner, order_id)
+        self.owner_orders.pop(owner, None)
+        self.fills.pop(owner, None)
+
+    def take_fills(self, owner):
+        """ Fills of the owner's resting orders since the last call, oldest first. """
+        return self.fills.pop(owner, [])
+
+    def _add(self, order_id, owner, ticket_number, price):
+        self.orders[order_id] = (owner, ticket_number, price)
+        self.owner_orders[owner].add(order_id)
+
+    def _remove(self, order_id):
+        order = self.orders.pop(order_id)
+        self.owner_orders[order[0]].discard(order_id)
+        return order
+
+    def _cancel_ask(self, ticket_number):
+        order_id = self.asked.get(ticket_number)
+        if order_id is not None:
+            self.cancel(self.orders[order_id][0], order_id)
+
+    def _best(self, side):
+        """ Top of a side's heap after dropping cancelled orders, or None if it is empty. """
+        while side and side[0][1] not in self.orders:
+            heapq.heappop(side)
+        return side[0] if side else None
+
+    def _compact(self):
+        """ Rebuilds the heaps once cancelled orders make up most of them, so they never outgrow the live book. """
+        if len(self.asks) + len(self.bids) > 2 * len(self.orders) + 64:
+            self.asks = [entry for entry in self.asks if entry[1] in self.orders]
+            self.bids = [entry for entry in self.bids if entry[1] in self.orders]
+            heapq.heapify(self.asks)
+            heapq.heapify(self.bids)
+
+
+class ResaleOrders:
+    """ Client side of the resale book: a client's resting orders and what each one holds in escrow.
+
+    An ASK takes its ticket out of the wallet and a BID its price out of
+    the balance until the order fills, so neither can be scalped, sold or
+    spent twice meanwhile. place_ask and place_bid return the message to
+    send; placed() settles the reply and filled() a FILLS reply.
+    """
+
+    def __init__(self, ticket_db, user_balance):
+        self.ticket_db = ticket_db
+        self.user_balance = user_balance
+        self.asks = {}  # Order ID -> (ticket number, price the client paid for it)
+        self.bids = {}  # Order ID -> bid price held back from the balance
+        self.pending = None  # What the order in flight escrowed
+
+    def place_ask(self, markup):
+        """ Offers the cheapest ticket held at markup times what it cost; None if the wallet is empty. """
+        cheapest = self.ticket_db.pop_cheapest()
+        if cheapest is None:
+            return None
+        ticket_number, paid = cheapest
+        self.pending = ("ASK", ticket_number, paid)
+        return f"ASK {ticket_number} {max(1, int(paid * markup))}"
+
+    def place_bid(self, price):
+        """ Bids price for any ticket; None if the balance cannot cover it. """
+        if self.user_balance[0] < price:
+            return None
+        self.user_balance[0] -= price
+        self.pending = ("BID", None, price)
+        return f"BID {price}"
+
+    def placed(self, reply):
+        """ Settles the reply to the order in flight and returns its status word. """
+        side, ticket_number, amount = self.pending
+        self.pending = None
+        status, *fields = reply.split()
+        if side == "ASK":
+            if status == "FILLED":
+                self.user_balance[0] += int(fields[2])
+            elif status == "ASKED":
+                self.asks[int(fields[0])] = (ticket_number, amount)
+            else:
+                self.ticket_db[ticket_number] = amount  # Refused, e.g. NOTOWNER after a scalp the server never heard of
+        elif status == "FILLED":
+            self._bought(fields[1], int(fields[2]), amount)
+        elif status == "BIDDING":
+            self.bids[int(fields[0])] = amount
+        else:
+            self.user_balance[0] += amount
+        return status
+
+    def filled(self, reply):
+        """ Settles a FILLS reply: resting asks that sold and resting bids that bought. """
+        for fill in reply.split()[1:]:
+            order_id, ticket_number, price = fill.split(":")
+            order_id, price = int(order_id), int(price)
+            if order_id in self.asks:
+                del self.asks[order_id]
+                self.user_balance[0] += price
+            elif order_id in self.bids:
+                self._bought(ticket_number, price, self.bids.pop(order_id))
+
+    def _bought(self, ticket_number, price, bid):
+        self.ticket_db[ticket_number] = price
+        self.user_balance[0] += bid - price  # The trade price is at most the bid
@@ -0,0 +1,152 @@
+import logging
+from collections import deque
+
+# Seconds a scalper keeps a quoted ticket reserved for the buyer to accept
+offer_seconds = 5.0
+
+
+class ScalpDesk:
+    """ Scalper side of the request-for-quote exchange between clients.
+
+    A SCALP reserves the cheapest ticket the buyer can afford at twice its
+    price and quotes it with OFFER. The ticket stays out of ticket_db until
+    the buyer ACCEPTs it (SOLD), DECLINEs it, or offer_seconds pass. The
+    last record per buyer address answers retransmissions, so a repeated
+    SCALP or ACCEPT never reserves or sells twice.
+
+    Every SCALP and DONE carries the sequence number of the last sale the
+    buyer received from this scalper. A later sale whose SOLD reply never
+    reached it is taken back, so a ticket is never lost between the two
+    clients, whatever the buyer bought from other scalpers meanwhile.
+
+    ticket_db is the scalper's TicketWallet, so quoting takes its cheapest
+    ticket in O(log n) however many tickets it holds.
+
+    Methods return the reply to send, already prefixed with QUOTE and the
+    sequence number, or None.
+    """
+
+    def __init__(self, ticket_db, user_balance):
+        self.ticket_db = ticket_db
+        self.user_balance = user_balance
+        self.records = {}  # Buyer address -> [sequence number, state, ticket number, price]
+        self.offers = deque()  # (expiry, buyer address, sequence number) of reservations, oldest first
+
+    def scalp(self, addr, seq, acked_seq, buyer_balance, now):
+        self.expire(now)
+        record = self.records.get(addr)
+        if record is not None and seq < record[0]:
+            return None  # Stale retransmission
+        if record is None or seq > record[0]:
+            if record is not None:
+                self.settle(record, acked_seq)
+            record = [seq] + self.quote(buyer_balance)
+            self.records[addr] = record
+            if record[1] == "OFFER":
+                self.offers.append((now + offer_seconds, addr, seq))
+        return self.reply(record)
+
+    def quote(self, buyer_balance):
+        if not self.ticket_db:
+            logging.debug("No tickets available to scalp")
+            return ["Scalper is sold-out", None, 0]
+        cheapest = self.ticket_db.pop_cheapest(buyer_balance // 2)
+        if cheapest is None:
+            logging.debug("Sent NOMONEY to buyer due to insufficient funds")
+            return ["NOMONEY", None, 0]
+        ticket_number, ticket_price = cheapest
+        return ["OFFER", ticket_number, 2 * ticket_price]
+
+    def accept(self, addr, seq, now):
+        self.expire(now)
+        record = self.records.get(addr)
+        if record is None or record[0] != seq:
+            return None
+        if record[1] == "OFFER":
+            record[1] = "SOLD"
+            self.user_balance[0] += record[3]
+            logging.debug("Scalped ticket %s for %s", record[2], record[3])
+        return self.reply(record) if record[1] == "SOLD" else f"QUOTE {seq} EXPIRED"
+
+    def decline(self, addr, seq):
+        record = self.records.get(addr)
+        if record is not None and record[0] == seq and record[1] == "OFFER":
+            self.put_back(record)
+
+    def done(self, addr, acked_seq):
+        """ The buyer will send no more requests: settles its last record. """
+        record = self.records.get(addr)
+        if record is not None:
+            self.settle(record, acked_seq)
+
+    def settle(self, record, acked_seq):
+        if record[1] == "OFFER":
+            self.put_back(record)
+        elif record[1] == "SOLD" and record[0] > acked_seq:
+            self.put_back(record)
+            self.user_balance[0] -= record[3]
+            logging.info("Buyer never received scalped ticket %s; taken back", record[2])
+
+    def expire(self, now):
+        while self.offers and self.offers[0][0] <= now:
+            _, addr, seq = self.offers.popleft()
+            record = self.records.get(addr)
+            if record is not None and record[0] == seq and record[1] == "OFFER":
+                self.put_back(record)
+
+    def put_back(self, record):
+        self.ticket_db[record[2]] = record[3] // 2
+        record[1] = "RELEASED"
+
+    @staticmethod
+    def reply(record):
+        seq, state, ticket_number, price = record
+        if state == "OFFER" or state == "SOLD":
+            return f"QUOTE {seq} {state} {ticket_number} {price}"
+        if state == "RELEASED":
+            return f"QUOTE {seq} EXPIRED"
+        return f"QUOTE {seq} {state}"
+
+
+class ScalpRequest:
+    """ Buyer side of one SCALP fanned out to several peers.
+
+    Collects each peer's first quote until the buyer picks a winner; after
+    that only the winner's SOLD or EXPIRED answer to ACCEPT counts.
+    """
+
+    def __init__(self, seq, peers):
+        self.seq = seq
+        self.peers = set(peers)
+        self.quotes = {}  # Peer address -> reply
+        self.winner = None
+        self.result = None  # The winner's answer to ACCEPT
+
+    def all_quoted(self):
+        return len(self.quotes) == len(self.peers)
+
+    def unquoted(self):
+        return [addr for addr in self.peers if addr not in self.quotes]
+
+    def best_offer(self):
+        """ Address of the peer with the cheapest OFFER, or None. """
+        offers = [(int(reply.split()[2]), addr) for addr, reply in self.quotes.items() if reply.startswith("OFFER")]
+        return min(offers)[1] if offers else None
+
+    def outcome(self):
+        """ Why no ticket was bought: NOMONEY if some peer had one the buyer could not afford, else SOLDOUT. """
+        return "NOMONEY" if "NOMONEY" in self.quotes.values() else "SOLDOUT"
+
+    def quote_received(self, addr, reply):
+        """ Files a peer's reply; returns (ticket number, price) when it is the winner's SOLD. """
+        if self.winner is None:
+            if addr in self.peers:
+                self.quotes.setdefault(addr, reply)
+            return None
+        if addr != self.winner or self.result is not None or reply.startswith("OFFER"):
+            return None
+        self.result = reply
+        if reply.startswith("SOLD"):
+            _, ticket_number, price = reply.split()
+            return ticket_number, int(price)
+        return None
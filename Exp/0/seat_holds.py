@@ -0,0 +1,191 @@
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict
+
+
+class TimingWheel:
+    """ Hierarchical timing wheel keyed by expiry time.
+
+    Time is cut into ticks. Level 0 has one slot per tick for the next
+    `slots` ticks, and every level above covers `slots` times the span of
+    the one below. schedule() drops an item into a single slot in O(1).
+    advance() walks the elapsed ticks: it empties the level-0 slot of
+    each tick, and each time a higher level's period begins, it re-files
+    that level's slot one level down. Items are touched a bounded number
+    of times and nothing is ever scanned in full.
+    """
+
+    def __init__(self, tick=0.1, slots=256, levels=4, now=None):
+        self.tick = tick
+        self.slots = slots
+        self.spans = [slots ** level for level in range(levels)]
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow = []  # Items beyond the top level's span, re-filed when it turns over
+        self.current = int((time.monotonic() if now is None else now) / tick)
+
+    def _file(self, expiry, item):
+        delta = expiry - self.current
+        for level, span in enumerate(self.spans):
+            if delta < span * self.slots:
+                self.wheels[level][(expiry // span) % self.slots].append((expiry, item))
+                return
+        self.overflow.append((expiry, item))
+
+    def schedule(self, deadline, item):
+        """ Files item to come out of advance() once the clock reaches deadline (at least one tick from now). """
+        self._file(max(math.ceil(deadline / self.tick), self.current + 1), item)
+
+    def advance(self, now):
+        """ Moves the wheel up to now and returns the items whose deadline has passed. """
+        target = int(now / self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+            if self.overflow and not self.current % (self.spans[-1] * self.slots):
+                overflow, self.overflow = self.overflow, []
+                for expiry, item in overflow:
+                    self._file(expiry, item)
+            for level in range(len(self.spans) - 1, 0, -1):
+                if self.current % self.spans[level]:
+                    continue
+                slot = (self.current // self.spans[level]) % self.slots
+                bucket, self.wheels[level][slot] = self.wheels[level][slot], []
+                for expiry, item in bucket:
+                    self._file(expiry, item)
+            slot = self.current % self.slots
+            if self.wheels[0][slot]:
+                expired.extend(item for _, item in self.wheels[0][slot])
+                self.wheels[0][slot] = []
+        return expired
+
+
+class SeatHolds:
+    """ Timed seat holds on top of a ticket inventory.
+
+    HOLD claims the cheapest affordable seat from the inventory, so it leaves
+    the available pool at once, and files the hold in a TimingWheel. CONFIRM
+    turns the hold into a sale, and RELEASE or expiry hands the seat straight
+    back to the inventory. Cancelled holds are left in the wheel and skipped
+    when their slot comes up.
+
+    A hold belongs to the connection that made it: only that one can
+    CONFIRM or RELEASE it, anyone else is told NOHOLD, and its seats go
+    back to the pool when it disconnects instead of when they expire.
+
+    A held seat is sold as far as the inventory knows, so a SELL has to
+    ask is_held() first and refuse it; otherwise anyone could return the
+    seat to the pool while the hold still hands it out. A seat counts as
+    held until it is back in the pool, so it can never be returned twice.
+    The multiprocess server's holds are private to each worker, so this
+    only guards seats held on the same worker.
+
+    A seat whose hold ends is offered to take() first, e.g. Waitlist.take,
+    like any other ticket sold back: a buyer it names keeps the seat sold,
+    and handed_off(sale, buyer) is called once the seat is no longer held,
+    to tell that buyer.
+    """
+
+    def __init__(self, inventory, hold_seconds=60, tick=0.1, take=None, handed_off=None):
+        self.inventory = inventory
+        self.hold_seconds = hold_seconds
+        self.take = take or (lambda price: None)
+        self.handed_off = handed_off
+        self.holds = {}  # Hold ID -> (ticket number, price, owner)
+        self.held = set()  # Ticket numbers of the live holds and of the seats on their way back to the pool
+        self.owned = defaultdict(set)  # Owner -> IDs of its holds
+        self.wheel = TimingWheel(tick)
+        self.lock = threading.Lock()  # Guards holds, held and wheel, and is held while HOLD claims its seat
+        self._next_id = itertools.count(1)
+
+    def __len__(self):
+        return len(self.holds)
+
+    def is_held(self, ticket_number):
+        """ Whether the seat is under a hold; takes the lock only when it is busy, e.g. with a HOLD claiming this seat. """
+        if ticket_number in self.held:
+            return True
+        if not self.lock.locked():
+            return False
+        with self.lock:  # A HOLD may have just claimed this seat and not recorded it yet
+            return ticket_number in self.held
+
+    def hold(self, owner, user_balance):
+        with self.lock:
+            response = self.inventory.buy(user_balance)
+            if response == "SOLDOUT" or response == "NOFUNDS":
+                return response
+            ticket_number, price = response.split()
+            hold_id = str(next(self._next_id))
+            self.held.add(ticket_number)
+            self.holds[hold_id] = (ticket_number, price, owner)
+            self.owned[owner].add(hold_id)
+            self.wheel.schedule(time.monotonic() + self.hold_seconds, hold_id)
+        return f"HELD {hold_id} {ticket_number} {price} {self.hold_seconds}"
+
+    def confirm(self, owner, hold_id):
+        """ Completes the sale of a held seat; answered like a BUY. """
+        held = self._take(owner, hold_id)
+        if held is None:
+            return "NOHOLD"
+        ticket_number, price, _ = held
+        with self.lock:
+            self.held.discard(ticket_number)
+        return f"{ticket_number} {price}"
+
+    def release(self, owner, hold_id):
+        held = self._take(owner, hold_id)
+        if held is None:
+            return "NOHOLD"
+        self._return([held])
+        return f"RELEASED {held[0]}"
+
+    def release_owned(self, owner):
+        """ Returns the seats of every hold of an owner to the inventory, e.g. when its connection closes. """
+        with self.lock:
+            held = [self.holds.pop(hold_id) for hold_id in self.owned.pop(owner, ())]
+        self._return(held)
+        return len(held)
+
+    def expire(self, now=None):
+        """ Returns the seats of every hold past its deadline to the inventory; gives how many expired. """
+        with self.lock:
+            expired = [self._pop(hold_id) for hold_id in self.wheel.advance(time.monotonic() if now is None else now)
+                       if hold_id in self.holds]
+        self._return(expired)
+        return len(expired)
+
+    def release_all(self):
+        with self.lock:
+            held, self.holds = list(self.holds.values()), {}
+            self.owned.clear()
+        self._return(held)
+
+    def _return(self, held):
+        """ Puts ended holds' seats back in the pool or hands them on, and only then stops refusing SELLs of them. """
+        handoffs = []
+        for ticket_number, _, _ in held:
+            sale, buyer = self.inventory.sell_to(ticket_number, self.take)
+            if buyer is not None:
+                handoffs.append((sale, buyer))
+        with self.lock:
+            self.held.difference_update(ticket_number for ticket_number, _, _ in held)
+        for sale, buyer in handoffs:
+            self.handed_off(sale, buyer)
+
+    def _take(self, owner, hold_id):
+        """ Removes and returns the owner's hold, or None if there is no such hold or it is someone else's. """
+        with self.lock:
+            held = self.holds.get(hold_id)
+            if held is None or held[2] != owner:
+                return None
+            return self._pop(hold_id)
+
+    def _pop(self, hold_id):
+        held = self.holds.pop(hold_id)
+        owned = self.owned[held[2]]
+        owned.discard(hold_id)
+        if not owned:
+            del self.owned[held[2]]
+        return held
@@ -1,114 +1,1012 @@
+import asyncio
+import multiprocessing
+import os
 import socket
+import sys
 import threading
 import random
 import logging
+import time
+
+from fair_scheduler import FairScheduler
+from idempotency_cache import IdempotencyCache
+from inventory_feed import InventoryFeed
+from peer_registry import PeerRegistry, SharedPeerRegistry
+from push_outbox import PushFlusher, PushOutbox
+from resale_market import ResaleBook
+from ticket_inventory import ShardedTicketInventory, SharedTicketInventory, TicketInventory
+from seat_holds import SeatHolds
+from ticket_logging import setup_queued_logging
+from ticket_metrics import MetricsRegistry, TimedLock, start_metrics_exporters
+from ticket_protocol import encode, negotiate_async_server, negotiate_server, split_tag, tag
+from ticket_waitlist import Waitlist
+from waiting_room import WaitingRoom
 
 server_prog = input('Enter the server program name: ')
 client_prog = input('Enter the client program name: ')
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    datefmt='%Y-%m-%d %H:%M:%S',
-                    handlers=[
-                        logging.FileHandler("{}-{}.log".format(server_prog, client_prog)),
-                        logging.StreamHandler()
-                    ])
+# Configure logging: records go through a bounded queue to a background writer, off the request path
+log_listener = setup_queued_logging(handlers=[
+                                        logging.FileHandler("{}-{}.log".format(server_prog, client_prog)),
+                                        logging.StreamHandler()
+                                    ])
+
+# Number of inventory shards, each guarded by its own lock (threaded and multiprocess modes). One lock by default:
+# under the GIL bench-lock-contention.py measures 64 shards slower than one lock with few clients and only sometimes
+# faster with many, so raise it only where a benchmark of that setup shows a gain
+inventory_shards = 1
+
+# Number of worker processes accepting on the shared port (multiprocess mode)
+worker_processes = os.cpu_count() or 1
+
+# Number of clients the experiment waits for before processing starts; later ones are served too
+expected_clients = 2
+
+# Pending connections the listening socket queues before the kernel refuses more
+listen_backlog = 4096
+
+# Seconds the threaded accept loop waits before checking whether every client has left
+accept_poll_interval = 0.5
+
+# Admission tokens the waiting room issues per second, and how many it saves up while idle
+admission_rate = 200.0
+admission_burst = 200
+
+# Most connections admitted past the waiting room at once, which bounds inventory lock contention
+max_admitted = 1024
+
+# Seconds between the queue positions reported to waiting connections
+queue_report_interval = 1.0
+
+# Seconds between waiting room admission runs
+admission_tick = 0.01
+
+# Queues arriving connections and lets them into the request path at admission_rate; built with the inventory
+room = None
+
+# Inventory commands per second each connection may send, and how many at once after a pause; None turns the limit off.
+# A connection over its rate is slowed down to it. BUY_N and SELL_MANY count one per ticket, a BUY_N at most the
+# tickets left in the pool and never more than client_burst, so no count it asks for stalls it past one burst.
+client_rate = 5000.0
+client_burst = 500
+
+# Inventory work each connection may dispatch per fair scheduler round, in tickets
+drr_quantum = 8
+
+# Seconds a thread runs before the interpreter lets another waiting one in, set by the threaded server when not None.
+# Interpreter-wide, so it also applies to anything else running in the process; at CPython's default of 5 ms a
+# connection with a full receive buffer keeps every other connection waiting that long, 0.0005 cuts that tenfold.
+thread_switch_interval = None
+
+# Inventory commands the threaded server runs at once; the others queue in the fair scheduler
+dispatch_slots = 4
+
+# Commands that touch the inventory and so go through the rate limit and the fair scheduler
+inventory_commands = {"BUY", "SELL", "HOLD", "CONFIRM", "RELEASE", "BUY_N", "SELL_MANY"}
+
+# Deficit round robin over the connections' inventory commands; built with the inventory
+scheduler = None
+
+# Inventory commands queued in the fair scheduler beyond which further ones are answered BUSY without touching
+# the inventory, so an overloaded server tells clients to back off instead of letting every reply wait longer; None
+# never sheds. Measured with load-generator.py --rate 5000 (400 users, about twice what one core serves): the
+# threaded server never queued 16, while the asyncio server, which queues a whole loop pass per round, went past 64
+# and shedding there cut its p99 dispatch wait from 13.6 ms to 9.4 ms.
+busy_queue_depth = 64
+
+# Commands that may end in "DEADLINE <ms>": the server drops them as EXPIRED if they cannot start within that many
+# milliseconds of arriving. Relative, so the client's and server's clocks need not agree.
+deadline_commands = {"BUY", "SELL"}
+
+# Commands that may end in "KEY <key>" (before any DEADLINE): the first one with a key runs, and the same request
+# resent with it within idempotency_ttl seconds, on any connection, is answered with the first one's response
+keyed_commands = {"BUY", "SELL"}
+
+# Longest idempotency key accepted, and most keys remembered at once
+max_key_length = 64
+idempotency_capacity = 65536
+
+# Seconds a key's response is kept for replay
+idempotency_ttl = 300.0
+
+# Responses to keyed requests, built with the inventory
+keyed_responses = None
+
+# Initialize ticket prices: tickets #10000 onwards
+ticket_prices = [random.randint(200, 400) for _ in range(25)]
 
-# Global lock for thread safety
-lock = threading.Lock()
+# Ticket database, built by the selected server mode: prices in a typed array, sold flags in a bitset
+inventory = None
 
-# Initialize ticket database
-tickets = {f"{10000 + i}": {"price": random.randint(200, 400), "sold": False} for i in range(25)}
+# Seconds a HOLD keeps a seat out of the pool before it expires
+hold_seconds = 60
 
-# Connection barrier to ensure both clients are connected before processing starts
-connection_barrier = threading.Barrier(2)  # Waiting for 2 clients
+# Outstanding seat holds on the inventory, built with it
+holds = None
+
+# Most clients the peer registry tracks at once
+max_registered_peers = 4096
+
+# Live scalpers' UDP endpoints and stock, built with the inventory
+peers = None
+
+# Resale order book: asks and bids between clients, matched against ticket ownership; built with the inventory
+market = None
+
+# Serializes access to the resale book's orders across the threaded server's connections; ticket ownership has its own locks
+market_lock = threading.Lock()
+
+# Seconds between inventory feed runs; the changes in between reach subscribers as at most one delta per ticket
+feed_interval = 0.05
+
+# Unsent bytes a connection may pile up before it is refused further pushes (feed EVENT, waiting room, HANDOFF): dropped
+# from the feed, or from the waiting room; replies to the client's own requests are not bounded
+feed_buffer_limit = 1 << 20
+
+# Seconds between the threaded server's retries of pushes that did not fit in a slow client's socket buffer
+push_flush_interval = 0.01
+
+# Finishes those pushes for the threaded server, so no push waits on the client it goes to
+push_flusher = PushFlusher(push_flush_interval)
+
+# Pushes inventory deltas to the connections that sent SUBSCRIBE, built with the inventory
+feed = None
+
+# Most sold-out buyers waiting for a returned ticket at once
+max_waitlist = 4096
+
+# Sold-out BUY WAITs in arrival order, handed every ticket returned to the pool: SELL, SELL_MANY and ended seat holds;
+# built with the inventory
+waitlist = None
+
+# Connection address -> [(SELL response, waiter), ...] of returned tickets its request handed to waiters, pushed once
+# the request's own ticket changes are recorded
+pending_handoffs = {}
+
+# Local port of the metrics admin socket; multiprocess workers use the ports after it
+metrics_admin_port = 13345
+
+# Seconds between metrics snapshot files
+metrics_snapshot_interval = 5.0
+
+# Inventory lock acquisitions per one timed for the lock wait and hold histograms; 0 leaves the locks untimed. Timing
+# every acquisition adds four clock reads and two samples to each request; one in 64 leaves the untimed wrapper as the
+# main cost, and still fills the histograms within seconds under load. bench-metrics-overhead.py compares the settings.
+lock_timing_sample = 64
+
+# Per-command latency histograms, whose counts count the commands, inventory-lock wait/hold times if timed, connections and stock
+metrics = MetricsRegistry()
+metrics.gauge("remaining_stock", lambda: len(inventory))
+metrics.gauge("seat_holds", lambda: len(holds))
+metrics.gauge("registered_peers", lambda: len(peers))
+metrics.gauge("resale_orders", lambda: len(market))
+metrics.gauge("feed_subscribers", lambda: len(feed))
+metrics.gauge("waitlist", lambda: len(waitlist))
+metrics.gauge("waiting_room", lambda: len(room))
+metrics.gauge("admitted_connections", lambda: len(room.admitted))
+metrics.gauge("fair_share", lambda: scheduler.starvation())
+metrics.gauge("dispatch_queue", lambda: scheduler.queued)
+metrics.gauge("idempotency_keys", lambda: len(keyed_responses))
+metrics.gauge("log_queue_depth", lambda: log_listener.queue_handler.queue.qsize())
+
+# Commands that get their own latency histogram; anything else is recorded as UNKNOWN
+known_commands = {"BUY", "SELL", "HOLD", "CONFIRM", "RELEASE", "BUY_N", "SELL_MANY", "REGISTER", "PEERS", "ROSTER", "SCALPED",
+                  "ASK", "BID", "CANCEL", "FILLS", "SUBSCRIBE", "UNSUBSCRIBE", "UNWAIT"}
+
+# Set once expected_clients have connected, so the threaded server starts processing for all of them at once
+start_gate = threading.Event()
+
+# Addresses of the threaded server's connections from accept to close, queued in the waiting room or served
+open_connections = set()
 
 
 def print_initial_tickets():
     """Prints the initial state of the tickets."""
     logging.info("Initial ticket database:")
-    for ticket, details in tickets.items():
-        logging.info(f"Ticket #{ticket}: Price ${details['price']}, Sold {details['sold']}")
+    for ticket, price, sold in inventory.items():
+        logging.info("Ticket #%s: Price $%s, Sold %s", ticket, price, sold)
+
+
+def print_final_tickets():
+    """Prints the final state of the tickets."""
+    holds.release_all()  # Seats still on hold go back to the pool before the dump
+    logging.info("All clients have disconnected. Final ticket database:")
+    for ticket, price, sold in inventory.items():
+        logging.info("Ticket #%s: Price $%s, Sold %s", ticket, price, sold)
+
+
+def process_command(data, address, reply_always=False):
+    """ Applies one BUY/SELL/HOLD/CONFIRM/RELEASE/BUY_N/SELL_MANY command to the inventory and returns the response.
+
+    REGISTER/PEERS/ROSTER/SCALPED go to the peer registry,
+    ASK/BID/CANCEL/FILLS to the resale book and SUBSCRIBE/UNSUBSCRIBE to
+    the inventory feed instead; they always get a response.
+
+    "BUY <balance> WAIT" joins the waitlist when sold out and is answered
+    WAITING <position>; UNWAIT leaves it. A SELL hands its ticket to the
+    first waiter that can afford it rather than returning it to the pool.
+    A SELL of a seat under a HOLD is answered HELD, and one of a ticket
+    the resale book moved to another client NOTOWNER; neither changes
+    anything.
+
+    Like the original protocol, a SELL of an unsold ticket and an unknown
+    command get no response (None) unless reply_always is set.
+    """
+    logging.debug("Received from %s: %s", address, data)
+    cmd, *args = data.split()
+
+    if cmd == "BUY":
+        user_balance = int(args[0])
+        response = inventory.buy(user_balance)
+        if response == "SOLDOUT" and args[1:] == ["WAIT"]:
+            return join_waitlist(address, user_balance)
+        return response
+
+    elif cmd == "SELL":
+        ticket_number = str(int(args[0]))
+        if holds.is_held(ticket_number):
+            return "HELD"  # Still out for a HOLD, which may yet CONFIRM it
+        if not give_back(ticket_number, address):
+            return "NOTOWNER"
+        response, waiter = inventory.sell_to(ticket_number, waitlist.take)
+        if waiter is not None:
+            pending_handoffs.setdefault(address, []).append((response, waiter))
+        return response if response is not None or not reply_always else "NOTSOLD"
+
+    elif cmd == "HOLD":
+        user_balance = int(args[0])
+        return holds.hold(address, user_balance)
+
+    elif cmd == "CONFIRM":
+        return holds.confirm(address, args[0])
+
+    elif cmd == "RELEASE":
+        return holds.release(address, args[0])
+
+    elif cmd == "BUY_N":
+        count, user_balance = int(args[0]), int(args[1])
+        return inventory.buy_many(count, user_balance)
+
+    elif cmd == "SELL_MANY":
+        # Seats under a hold and tickets resold to someone else are left out, like tickets that were not sold
+        ticket_numbers = [str(int(ticket_number)) for ticket_number in args]
+        inventory.validate(ticket_numbers)  # Before any ticket is given back
+        response, handoffs = inventory.sell_many_to([ticket_number for ticket_number in ticket_numbers
+                                                     if not holds.is_held(ticket_number) and give_back(ticket_number, address)],
+                                                    waitlist.take)
+        if handoffs:
+            pending_handoffs.setdefault(address, []).extend(handoffs)
+        return response
+
+    elif cmd == "REGISTER":
+        # REGISTER <udp port> [<udp host>]: the host defaults to the one the connection comes from
+        udp_port = int(args[0])
+        udp_host = args[1] if len(args) > 1 else address[0]
+        return "REGISTERED" if peers.register(address, udp_host, udp_port) else "NOROOM"
+
+    elif cmd == "PEERS":
+        # PEERS <own stock> <limit>: reports the caller's stock and names up to limit peers that have tickets
+        peers.report(address, int(args[0]))
+        return " ".join(["PEERS"] + [f"{host}:{port}:{stock}" for host, port, stock in peers.lookup(address, int(args[1]))])
+
+    elif cmd == "ROSTER":
+        return " ".join(["ROSTER"] + [f"{host}:{port}" for host, port in peers.roster(address)])
+
+    elif cmd == "SCALPED":
+        # SCALPED <udp host> <udp port> [<ticket>]: the caller bought a ticket from that peer. The ticket only
+        # becomes the caller's to ASK if that peer's connection owns it.
+        if len(args) > 2:
+            seller = peers.connection(args[0], int(args[1]))
+            if seller is None:
+                return "NOPEER"
+            with market_lock:
+                if market.owners.get(args[2]) != seller:
+                    return "NOTOWNER"
+                market.acquire(args[2], address)
+        return "OK" if peers.transfer(address, args[0], int(args[1])) else "NOPEER"
+
+    elif cmd == "ASK":
+        # ASK <ticket> <price>: offers a ticket the caller owns for resale
+        with market_lock:
+            return market.ask(address, args[0], int(args[1]))
+
+    elif cmd == "BID":
+        # BID <price>: bids for any one ticket
+        with market_lock:
+            return market.bid(address, int(args[0]))
+
+    elif cmd == "CANCEL":
+        with market_lock:
+            return market.cancel(address, int(args[0]))
+
+    elif cmd == "SUBSCRIBE":
+        # Framed connections only: the feed pushes untagged EVENT frames between the replies
+        return f"SUBSCRIBED {len(inventory)}" if feed.subscribe(address) else "NOTFRAMED"
+
+    elif cmd == "UNSUBSCRIBE":
+        feed.unsubscribe(address)
+        return "UNSUBSCRIBED"
+
+    elif cmd == "UNWAIT":
+        # NOTWAITING: the caller was handed a ticket, and its HANDOFF is on the way if not already there
+        return "UNWAITED" if waitlist.leave(address) else "NOTWAITING"
+
+    elif cmd == "FILLS":
+        # Resting orders of the caller filled since its last FILLS, as <order id>:<ticket>:<price>
+        with market_lock:
+            return " ".join(["FILLS"] + market.take_fills(address))
+
+    return "UNKNOWN COMMAND" if reply_always else None
+
+
+def join_waitlist(address, user_balance):
+    """ Queues a sold-out BUY WAIT for the next returned ticket it can afford; WAITING <position>, or SOLDOUT if it cannot wait.
+
+    A ticket sold back between the BUY and joining went to the pool, so
+    the BUY is retried once the caller is on the waitlist.
+    """
+    if address not in feed.sinks:
+        return "SOLDOUT"  # A legacy text connection cannot be pushed its HANDOFF
+    position = waitlist.join(address, user_balance)
+    if position is None:
+        return "SOLDOUT"
+    response = inventory.buy(user_balance)
+    if response == "SOLDOUT" or response == "NOFUNDS":
+        return f"WAITING {position}"
+    if waitlist.leave(address):
+        return response
+    # A SELL handed the caller a ticket meanwhile: the one just bought goes on to the next waiter or the pool
+    sale, waiter = inventory.sell_to(response.split()[0], waitlist.take)
+    if waiter is not None:
+        pending_handoffs.setdefault(address, []).append((sale, waiter))
+    return f"WAITING {position}"
+
+
+def hand_off(sale, waiter):
+    """ Pushes a returned ticket to the waiter it was sold to; if the waiter is gone, the ticket is sold back again. """
+    while waiter is not None:
+        ticket_number = sale.split()[0]
+        record_tickets(waiter, (ticket_number,), ())
+        if feed.push(waiter, f"HANDOFF {sale}"):
+            metrics.count("handoffs")
+            logging.debug("Handed ticket %s to %s.", sale, waiter)
+            return
+        record_tickets(waiter, (), (ticket_number,))
+        sale, waiter = inventory.sell_to(ticket_number, waitlist.take)
+
+
+def ticket_changes(cmd, response):
+    """ Ticket numbers a response hands to the client and takes back from it. """
+    if response is None or not response[:1].isdigit():
+        return (), ()
+    if cmd == "BUY" or cmd == "CONFIRM":
+        return (response.split(None, 1)[0],), ()
+    if cmd == "SELL":
+        return (), (response.split(None, 1)[0],)
+    if cmd == "BUY_N":
+        return [item.split(":")[0] for item in response.split() if ":" in item], ()
+    if cmd == "SELL_MANY":
+        return (), [item.split(":")[0] for item in response.split()]
+    return (), ()
+
+
+def give_back(ticket_number, address):
+    """ Ends the caller's ownership of a ticket it is selling back, before the ticket reaches the pool.
+
+    False if the resale book moved the ticket to another client, whose it
+    stays. An ask on the ticket is cancelled first, so it cannot fill
+    once the ticket is back in the pool. Only a ticket with an ask or
+    another owner on record takes the market lock; anyone else's ticket
+    has no ask, and cannot get one while its owner is busy selling it.
+    """
+    if not market.owners.may_sell(ticket_number, address):
+        return False
+    if ticket_number in market.asked or market.owners.get(ticket_number, address) != address:
+        with market_lock:
+            if not market.owners.may_sell(ticket_number, address):
+                return False  # The ask filled just before the lock was taken
+            market.release(ticket_number)
+        return True
+    market.owners.discard(ticket_number, address)
+    return True
+
+
+def record_tickets(address, acquired, released):
+    """ Keeps resale ownership and the client's peer registry stock in step with its trades with the server.
+
+    A SELL has given its tickets back already, so a released ticket that
+    someone has bought from the pool since stays theirs. Only a ticket
+    with an ask to cancel takes the market lock, so BUY and SELL share no
+    lock across all tickets.
+    """
+    for ticket_number in acquired:
+        if ticket_number in market.asked:
+            with market_lock:
+                market.acquire(ticket_number, address)
+        else:
+            market.owners[ticket_number] = address
+    for ticket_number in released:
+        market.owners.discard(ticket_number, address)
+    peers.adjust(address, len(acquired) - len(released))
+
+
+def record_resale(ticket_number, seller, buyer, price):
+    """ Moves a ticket sold on the resale book between the two clients' peer registry stock. """
+    peers.adjust(seller, -1)
+    peers.adjust(buyer, 1)
+    metrics.count("resale_trades")
+
+
+def command_cost(frame):
+    """ Inventory work a received message asks for: one per ticket, 0 if it does not touch the inventory. """
+    _, data = split_tag(frame)
+    cmd, *args = data.split() or [""]
+    if cmd not in inventory_commands:
+        return 0
+    if cmd == "BUY_N":
+        count = int(args[0]) if args and args[0].isdigit() else 1
+        return max(1, min(count, len(inventory), client_burst))
+    if cmd == "SELL_MANY":
+        return max(1, len(args))
+    return 1
+
+
+def split_deadline(frame):
+    """ Takes the "DEADLINE <ms>" off a BUY or SELL; returns the frame without it and its time.monotonic() deadline, or None. """
+    words = frame.rsplit(None, 2)
+    if len(words) == 3 and words[1] == "DEADLINE" and words[2].isdigit():
+        _, data = split_tag(words[0])
+        if data.split(None, 1)[0] in deadline_commands:
+            return words[0], time.monotonic() + int(words[2]) / 1000
+    return frame, None
+
+
+def refuse(frame, reply):
+    """ Answers an inventory command without running it: BUSY when shed, EXPIRED when past its deadline. """
+    metrics.count(f"shed_{reply.lower()}")
+    request_id, _ = split_tag(frame)
+    return reply if request_id is None else tag(request_id, reply)
+
+
+def build_scheduler(slots):
+    return FairScheduler(drr_quantum, slots, client_rate, client_burst, metrics.histogram("dispatch_wait"))
+
+
+def end_session(address):
+    """ Logs how fairly a disconnecting client was served. """
+    session = scheduler.remove(address)
+    if session is not None and session.dispatched:
+        logging.info("Client %s fair share: %s", address, session.summary())
+
+
+def process_frame(frame, address):
+    """ Runs one received message; a request tagged "#<id> " always gets a reply tagged with the same ID. """
+    request_id, data = split_tag(frame)
+    data, key = split_idempotency_key(data)
+    try:
+        if key is None:
+            response = run_command(data, address, reply_always=request_id is not None)
+        elif len(key) > max_key_length:
+            response = "BADKEY"
+        else:
+            response = run_keyed_command(data, address, key)
+    except (IndexError, KeyError, ValueError):
+        if request_id is None and key is None:
+            raise  # An untagged request is answered as before, by dropping the connection
+        metrics.count("bad_requests")
+        response = "BADREQUEST"  # Rather than losing the replies still owed on the connection
+    return response if request_id is None else tag(request_id, response)
+
+
+def split_idempotency_key(data):
+    """ Takes the "KEY <key>" off a BUY or SELL; returns the request without it and the key, or None. """
+    words = data.rsplit(None, 2)
+    if len(words) == 3 and words[1] == "KEY" and words[0].split(None, 1)[0] in keyed_commands:
+        return words[0], words[2]
+    return data, None
+
+
+def run_keyed_command(data, address, key):
+    """ Runs a keyed request once; the same request resent with its key gets the first response, which always comes.
+
+    A resend from a new connection, the first one having closed, also
+    takes over the tickets the first bought and still owns.
+    """
+    entry, replay = keyed_responses.claim(key, data, address)
+    if replay:
+        metrics.count("replayed")
+        if entry.request != data:
+            return "KEYREUSED"
+        if entry.address != address and entry.address not in room.admitted:
+            cmd = data.split(None, 1)[0]
+            acquired, _ = ticket_changes(cmd, entry.response)
+            with market_lock:
+                moved = [ticket_number for ticket_number in acquired if market.owners.get(ticket_number) == entry.address]
+                for ticket_number in moved:
+                    market.acquire(ticket_number, address)
+            peers.adjust(address, len(moved))
+        return entry.response
+    response = None
+    try:
+        response = run_command(data, address, reply_always=True)
+    finally:
+        keyed_responses.finish(key, entry, response)
+    return response
+
+
+def run_command(data, address, reply_always):
+    """ Runs one request and keeps ticket ownership and the metrics up to date; returns its response. """
+    start = time.perf_counter_ns()
+    response = process_command(data, address, reply_always)
+    cmd = data.split(None, 1)[0] if data else ""
+    acquired, released = ticket_changes(cmd, response)
+    if acquired or released:
+        record_tickets(address, acquired, released)
+    for sale, waiter in pending_handoffs.pop(address, ()):
+        hand_off(sale, waiter)  # After the seller's release is recorded, so the waiter ends up the owner
+    if cmd not in known_commands:
+        cmd = "UNKNOWN"
+    metrics.histogram(cmd).record(time.perf_counter_ns() - start)
+    return response
+
+
+def timed_locks(lock_factory):
+    """ Lock factory for the inventory shards that feeds the lock wait and hold histograms, if lock_timing_sample is set. """
+    if not lock_timing_sample:
+        return lock_factory
+    return lambda: TimedLock(lock_factory(), metrics.histogram("inventory_lock_wait"), metrics.histogram("inventory_lock_hold"),
+                             lock_timing_sample)
+
+
+def metrics_snapshot_path(worker_id=None):
+    suffix = "" if worker_id is None else f"-worker{worker_id}"
+    return "{}-{}-metrics{}.json".format(server_prog, client_prog, suffix)
+
+
+def admit_waiting_clients():
+    """ Runs the waiting room every admission_tick for the threaded server. """
+    while True:
+        time.sleep(admission_tick)
+        room.pump()
+
+
+async def admit_waiting_clients_async():
+    """ admit_waiting_clients as an event-loop task. """
+    while True:
+        await asyncio.sleep(admission_tick)
+        room.pump()
+
+
+def expire_holds():
+    """ Expires seat holds in the background for the threaded server. """
+    while True:
+        time.sleep(holds.wheel.tick)
+        expired = holds.expire()
+        if expired:
+            logging.debug("%s seat holds expired.", expired)
+
+
+def publish_inventory_changes():
+    """ Runs the inventory feed every feed_interval for the threaded server. """
+    while True:
+        time.sleep(feed_interval)
+        feed.publish()
+
+
+async def publish_inventory_changes_async():
+    """ publish_inventory_changes as an event-loop task. """
+    while True:
+        await asyncio.sleep(feed_interval)
+        feed.publish()
+
+
+def feed_sink(writer):
+    """ Sends a feed frame on an asyncio connection, refusing once the subscriber stops reading. """
+    def push(frame):
+        if writer.transport.get_write_buffer_size() > feed_buffer_limit:
+            raise BufferError("subscriber is not reading its events")
+        writer.write(encode(frame, True))
+    return push
+
+
+async def expire_holds_async():
+    """ expire_holds as an event-loop task. """
+    while True:
+        await asyncio.sleep(holds.wheel.tick)
+        expired = holds.expire()
+        if expired:
+            logging.debug("%s seat holds expired.", expired)
 
 
 def handle_client(client_socket, address):
-    global tickets
-    # Wait for both clients to connect
-    connection_barrier.wait()
+    """ Greets a connection and queues it in the waiting room; it gets a thread to serve it only once it is admitted.
+
+    A connection let in at once is served on this thread. Otherwise this
+    thread ends, and the waiting room's wake-up starts a new one, so the
+    connections queued in a surge hold a socket each but no thread.
+    """
+    try:
+        # Framed clients announce themselves before the barrier; anything else is served in the legacy text mode
+        connection = negotiate_server(client_socket)
+    except Exception as e:
+        logging.error("Error with client %s: %s", address, e)
+        end_client(client_socket, address)
+        return
+    logging.debug("Client %s uses the %s protocol.", address, 'framed' if connection.framed else 'legacy text')
+    outbox = PushOutbox(client_socket, push_flusher, feed_buffer_limit)
+
+    def push(message):
+        outbox.push(encode(message, True))
+
+    if connection.framed:
+        feed.attach(address, push)
+
+    greeter = threading.current_thread()
+    admitted_here = []
+    start = time.perf_counter_ns()
+
+    def wake():
+        if threading.current_thread() is greeter:
+            admitted_here.append(True)  # Let in, or dropped, before join() returned
+        else:
+            threading.Thread(target=serve_client, args=(client_socket, address, connection, outbox, start)).start()
 
+    room.join(address, push if connection.framed else None, wake)
+    if admitted_here:
+        serve_client(client_socket, address, connection, outbox, start)
+
+
+def serve_client(client_socket, address, connection, outbox, start):
+    """ Runs an admitted connection's requests until it closes; one the waiting room dropped is only cleaned up. """
     try:
+        if address not in room.admitted:
+            return
+        metrics.histogram("admission_wait").record(time.perf_counter_ns() - start)
+        start_gate.wait()
+
+        def send(message):
+            """ Replies wait as long as the client takes to read them. """
+            try:
+                outbox.send(encode(message, connection.framed))
+            except OSError:
+                # Part of the frame may be out: nothing else can follow it, so the connection ends here
+                try:
+                    client_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                raise
+
+        granted = threading.Event()
         while True:
-            data = client_socket.recv(1024)
-            if not data:
+            data = connection.recv()
+            if data is None:
                 break
-            data = data.decode('utf-8').strip()
-
-            logging.debug(f"Received from {address}: {data}")
-            cmd, *args = data.split()
-
-            response = "UNKNOWN COMMAND"
-            if cmd == "BUY":
-                user_balance = int(args[0])
-                with lock:
-                    for ticket, details in tickets.items():
-                        if not details['sold']:
-                            if user_balance >= details['price']:
-                                details['sold'] = True
-                                response = f"{ticket} {details['price']}"
-                                break
-                            else:
-                                response = "NOFUNDS"
-                        else:
-                            response = "SOLDOUT"
-                client_socket.sendall(response.encode())
-                logging.debug(f"Sent to {address}: {response}")
-
-            elif cmd == "SELL":
-                ticket_number = args[0]
-                with lock:
-                    if tickets[ticket_number]['sold']:
-                        tickets[ticket_number]['sold'] = False
-                        response = f"{ticket_number} {tickets[ticket_number]['price']}"
-                        client_socket.sendall(response.encode())
-                        logging.debug(f"Sent to {address}: {response}")
+
+            cost = command_cost(data)
+            if not cost:
+                response = process_frame(data, address)
+            elif busy_queue_depth is not None and scheduler.queued >= busy_queue_depth:
+                response = refuse(data, "BUSY")
+            else:
+                data, deadline = split_deadline(data)
+                if scheduler.wait_turn(address, cost, granted, deadline):
+                    try:
+                        response = process_frame(data, address)
+                    finally:
+                        scheduler.done()
+                else:
+                    response = refuse(data, "EXPIRED")
+            if response is not None:
+                send(response)
+                logging.debug("Sent to %s: %s", address, response)
 
     except Exception as e:
-        logging.error(f"Error with client {address}: {e}")
+        logging.error("Error with client %s: %s", address, e)
     finally:
-        logging.info(f"Client {address} disconnected.")
-        client_socket.close()
+        end_client(client_socket, address)
+
+
+def end_client(client_socket, address):
+    """ Releases everything a closed connection held: registry entry, holds, orders, waitlist place and room slot. """
+    peers.unregister(address)
+    holds.release_owned(address)
+    with market_lock:
+        market.cancel_all(address)
+    waitlist.leave(address)
+    room.leave(address)
+    feed.detach(address)
+    end_session(address)
+    metrics.count("active_connections", -1)
+    logging.info("Client %s disconnected.", address)
+    client_socket.close()
+    open_connections.discard(address)
 
 
 def start_server(port):
+    global inventory, holds, peers, market, feed, waitlist, room, scheduler, keyed_responses
+    if thread_switch_interval is not None:
+        sys.setswitchinterval(thread_switch_interval)
+    inventory = ShardedTicketInventory(ticket_prices, inventory_shards, lock_factory=timed_locks(threading.Lock))
+    peers = PeerRegistry(max_registered_peers)
+    market = ResaleBook(record_resale)
+    feed = InventoryFeed(inventory, market, market_lock)
+    waitlist = Waitlist(max_waitlist)
+    holds = SeatHolds(inventory, hold_seconds, take=waitlist.take, handed_off=hand_off)
+    room = WaitingRoom(admission_rate, admission_burst, max_admitted, queue_report_interval)
+    scheduler = build_scheduler(dispatch_slots)
+    keyed_responses = IdempotencyCache(idempotency_capacity, idempotency_ttl)
+    threading.Thread(target=expire_holds, daemon=True).start()
+    threading.Thread(target=publish_inventory_changes, daemon=True).start()
+    threading.Thread(target=admit_waiting_clients, daemon=True).start()
+    push_flusher.start()
+    start_metrics_exporters(metrics, metrics_admin_port, metrics_snapshot_path(), metrics_snapshot_interval)
+
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.bind(('localhost', port))
-    server_socket.listen(2)  # Expecting only 2 clients
+    server_socket.listen(listen_backlog)
+    server_socket.settimeout(accept_poll_interval)
     logging.info("Server is ready and waiting for clients.")
 
     print_initial_tickets()  # Log the initial state of the ticket database
+    if not expected_clients:
+        start_gate.set()
 
-    threads = []
+    # Every connection is accepted and queues in the waiting room. The server shuts down once
+    # expected_clients have connected and all clients have disconnected; with 0 it runs until interrupted.
+    connected = 0
     try:
-        for _ in range(2):  # We expect exactly 2 clients
-            client_socket, addr = server_socket.accept()
-            logging.info(f"Client {addr} connected.")
-            thread = threading.Thread(target=handle_client, args=(client_socket, addr))
-            thread.start()
-            threads.append(thread)
+        while True:
+            try:
+                client_socket, addr = server_socket.accept()
+            except socket.timeout:
+                if expected_clients and start_gate.is_set() and not open_connections:
+                    break
+                continue
+            logging.info("Client %s connected.", addr)
+            metrics.count("active_connections")
+            open_connections.add(addr)
+            threading.Thread(target=handle_client, args=(client_socket, addr)).start()
+            connected += 1
+            if connected >= expected_clients:
+                start_gate.set()
 
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
+    finally:
+        print_final_tickets()
+        server_socket.close()
+        logging.info("Server has shut down.")
 
+
+async def handle_async_client(reader, writer, start_gate):
+    """ Serves one connection inside the event loop; the inventory is only touched from this loop. """
+    address = writer.get_extra_info('peername')
+    metrics.count("active_connections")
+
+    try:
+        connection = await negotiate_async_server(reader, writer)
+        logging.debug("Client %s uses the %s protocol.", address, 'framed' if connection.framed else 'legacy text')
+        if connection.framed:
+            feed.attach(address, feed_sink(writer))
+
+        admitted = asyncio.Event()
+        start = time.perf_counter_ns()
+        room.join(address, feed_sink(writer) if connection.framed else None, admitted.set)
+        await admitted.wait()
+        if address not in room.admitted:
+            return
+        metrics.histogram("admission_wait").record(time.perf_counter_ns() - start)
+        await start_gate.wait()
+
+        while True:
+            data = await connection.recv()
+            if data is None:
+                break
+
+            cost = command_cost(data)
+            if not cost:
+                response = process_frame(data, address)
+            elif busy_queue_depth is not None and scheduler.queued >= busy_queue_depth:
+                response = refuse(data, "BUSY")
+            else:
+                data, deadline = split_deadline(data)
+                if await scheduler.turn(address, cost, deadline):
+                    response = process_frame(data, address)
+                else:
+                    response = refuse(data, "EXPIRED")
+            if response is not None:
+                await connection.send(response)
+                logging.debug("Sent to %s: %s", address, response)
+
+    except Exception as e:
+        logging.error("Error with client %s: %s", address, e)
     finally:
-        logging.info("All clients have disconnected. Final ticket database:")
-        for ticket, details in tickets.items():
-            logging.info(f"Ticket #{ticket}: Price ${details['price']}, Sold {details['sold']}")
+        peers.unregister(address)
+        holds.release_owned(address)
+        with market_lock:
+            market.cancel_all(address)
+        waitlist.leave(address)
+        room.leave(address)
+        feed.detach(address)
+        end_session(address)
+        metrics.count("active_connections", -1)
+        logging.info("Client %s disconnected.", address)
+        writer.close()
 
-        server_socket.close()
+
+async def start_async_server(port):
+    """ Single-threaded asyncio server speaking the same BUY/SELL protocol as start_server.
+
+    The inventory is owned by the event loop, so it needs no lock. Processing
+    starts once expected_clients have connected, and the server shuts down
+    after all of them have disconnected; with expected_clients = 0 it starts
+    at once and runs until interrupted.
+    """
+    global inventory, holds, peers, market, feed, waitlist, room, scheduler, keyed_responses
+    inventory = TicketInventory(ticket_prices)
+    peers = PeerRegistry(max_registered_peers)
+    market = ResaleBook(record_resale)
+    feed = InventoryFeed(inventory, market, market_lock)
+    waitlist = Waitlist(max_waitlist)
+    holds = SeatHolds(inventory, hold_seconds, take=waitlist.take, handed_off=hand_off)
+    room = WaitingRoom(admission_rate, admission_burst, max_admitted, queue_report_interval)
+    scheduler = build_scheduler(1)  # The event loop runs one command at a time
+    keyed_responses = IdempotencyCache(idempotency_capacity, idempotency_ttl)
+    expiry_task = asyncio.create_task(expire_holds_async())
+    feed_task = asyncio.create_task(publish_inventory_changes_async())
+    admission_task = asyncio.create_task(admit_waiting_clients_async())
+    start_metrics_exporters(metrics, metrics_admin_port, metrics_snapshot_path(), metrics_snapshot_interval)
+
+    start_gate = asyncio.Event()
+    all_disconnected = asyncio.Event()
+    connected = 0
+    active = 0
+
+    async def on_connect(reader, writer):
+        nonlocal connected, active
+        connected += 1
+        active += 1
+        logging.info("Client %s connected.", writer.get_extra_info('peername'))
+        if connected >= expected_clients:
+            start_gate.set()
+        try:
+            await handle_async_client(reader, writer, start_gate)
+        finally:
+            active -= 1
+            if expected_clients and connected >= expected_clients and not active:
+                all_disconnected.set()
+
+    if not expected_clients:
+        start_gate.set()
+    server = await asyncio.start_server(on_connect, 'localhost', port, backlog=4096)
+    logging.info("Server is ready and waiting for clients.")
+
+    print_initial_tickets()  # Log the initial state of the ticket database
+
+    try:
+        async with server:
+            await all_disconnected.wait()
+    finally:
+        expiry_task.cancel()
+        feed_task.cancel()
+        admission_task.cancel()
+        print_final_tickets()
+        logging.info("Server has shut down.")
+
+
+def mirror_event(process_event, loop):
+    """ Returns an asyncio.Event that is set once the multiprocessing event is, without blocking the loop. """
+    event = asyncio.Event()
+
+    def wait():
+        process_event.wait()
+        loop.call_soon_threadsafe(event.set)
+
+    threading.Thread(target=wait, daemon=True).start()
+    return event
+
+
+async def serve_worker(port, worker_id, client_counts, start_gate, stop_event, ready):
+    """ Event loop of one worker process; all workers accept on the same port through SO_REUSEPORT. """
+    inventory.seed_probe(worker_id)
+    loop = asyncio.get_running_loop()
+    local_gate = mirror_event(start_gate, loop)
+    local_stop = mirror_event(stop_event, loop)
+
+    async def on_connect(reader, writer):
+        with client_counts.get_lock():
+            client_counts[0] += 1
+            client_counts[1] += 1
+            if client_counts[0] >= expected_clients:
+                start_gate.set()
+        logging.info("Client %s connected to worker %s.", writer.get_extra_info('peername'), worker_id)
+        try:
+            await handle_async_client(reader, writer, local_gate)
+        finally:
+            with client_counts.get_lock():
+                client_counts[1] -= 1
+                if expected_clients and client_counts[0] >= expected_clients and not client_counts[1]:
+                    stop_event.set()
+
+    # Holds and metrics are private to this worker: holds expire here and go back to the shared inventory on shutdown
+    expiry_task = asyncio.create_task(expire_holds_async())
+    feed_task = asyncio.create_task(publish_inventory_changes_async())
+    admission_task = asyncio.create_task(admit_waiting_clients_async())
+    start_metrics_exporters(metrics, metrics_admin_port + 1 + worker_id, metrics_snapshot_path(worker_id),
+                            metrics_snapshot_interval)
+    server = await asyncio.start_server(on_connect, 'localhost', port, reuse_port=True, backlog=4096)
+    ready.release()
+    try:
+        async with server:
+            await local_stop.wait()
+    finally:
+        expiry_task.cancel()
+        feed_task.cancel()
+        admission_task.cancel()
+        holds.release_all()
+
+
+def run_worker(port, worker_id, client_counts, start_gate, stop_event, ready):
+    try:
+        asyncio.run(serve_worker(port, worker_id, client_counts, start_gate, stop_event, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_listener.stop()  # Worker processes exit without running atexit hooks
+
+
+def start_multiprocess_server(port):
+    """ Runs worker_processes asyncio workers on one port, sharing the inventory and peer registry in shared memory.
+
+    The shards are SharedTicketInventory instances guarded by multiprocessing
+    locks, so a ticket is claimed atomically across processes. Workers are
+    forked and use SO_REUSEPORT, so this mode is POSIX only. The resale book
+    is not shared: an order only matches orders placed on the same worker.
+    """
+    global inventory, holds, peers, market, feed, waitlist, room, scheduler, keyed_responses
+    ctx = multiprocessing.get_context('fork')
+    inventory = ShardedTicketInventory(ticket_prices, inventory_shards,
+                                       shard_factory=SharedTicketInventory, lock_factory=timed_locks(ctx.Lock))
+    peers = SharedPeerRegistry(max_registered_peers, ctx.Lock())  # Shared, so clients find peers served by other workers
+    market = ResaleBook(record_resale)  # Each worker matches the orders of its own connections
+    feed = InventoryFeed(inventory, market, market_lock)  # Each worker diffs the shared bitsets for its own subscribers
+    waitlist = Waitlist(max_waitlist)  # A SELL hands its ticket to waiters on the same worker only
+    holds = SeatHolds(inventory, hold_seconds, take=waitlist.take, handed_off=hand_off)
+    # Each worker runs its own room with its share of the admission rate and of the admitted connections
+    room = WaitingRoom(admission_rate / worker_processes, max(1, admission_burst // worker_processes),
+                       max(1, -(-max_admitted // worker_processes)), queue_report_interval)
+    scheduler = build_scheduler(1)  # Each worker shares its own connections out; workers run in parallel
+    # Each worker replays the keys its own connections sent; a retry reconnecting to another worker runs again
+    keyed_responses = IdempotencyCache(idempotency_capacity, idempotency_ttl)
+
+    client_counts = ctx.Array('i', 2)  # [clients connected so far, clients still connected]
+    start_gate = ctx.Event()
+    stop_event = ctx.Event()
+    ready = ctx.Semaphore(0)
+    if not expected_clients:
+        start_gate.set()
+
+    workers = [ctx.Process(target=run_worker, args=(port, i, client_counts, start_gate, stop_event, ready))
+               for i in range(worker_processes)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.acquire()
+    logging.info("Server is ready and waiting for clients on %s worker processes.", worker_processes)
+
+    print_initial_tickets()  # Log the initial state of the ticket database
+
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        print_final_tickets()
         logging.info("Server has shut down.")
 
 
 if __name__ == "__main__":
-    start_server(12345)
+    server_mode = input('Enter the server mode (threaded/asyncio/multiprocess) [threaded]: ').strip() or "threaded"
+    if server_mode == "asyncio":
+        asyncio.run(start_async_server(12345))
+    elif server_mode == "multiprocess":
+        start_multiprocess_server(12345)
+    else:
+        start_server(12345)
@@ -0,0 +1,82 @@
+import pytest
+
+from ticket_client import client
+from ticket_wallet import TicketWallet
+
+
+def run_steps(steps, results):
+    """ Drives protocol steps with scripted results; returns the actions they took and their outcome. """
+    actions = []
+    result = None
+    while True:
+        try:
+            action = steps.send(result)
+        except StopIteration as stop:
+            return actions, stop.value
+        actions.append(action)
+        result = results.pop(0)
+
+
+def test_shed_request_is_resent_with_the_same_key(monkeypatch):
+    monkeypatch.setattr(client, "idempotency_keys", True)
+    actions, response = run_steps(client.backoff_steps("SELL 10003"), ["BUSY", None, "10003 250"])
+    kinds = [action[0] for action in actions]
+    assert kinds == ["request", "sleep", "request"]
+    assert actions[0] == actions[2]
+    assert actions[0][1].startswith("SELL 10003 KEY ")
+    assert response == "10003 250"
+
+
+def test_waitlisted_buy_answers_with_the_handed_off_ticket(monkeypatch):
+    monkeypatch.setattr(client, "join_waitlist", True)
+    ticket_db, user_balance = TicketWallet(), [500]
+    actions, response = run_steps(client.buy_steps(ticket_db, user_balance, True),
+                                  ["WAITING 1", None, "NOTWAITING", "EVENT 3 +10007:240", "HANDOFF 10007 240"])
+    assert [action[0] for action in actions] == ["request", "event", "request", "event", "event"]
+    assert actions[2] == ("request", "UNWAIT")
+    assert response == "10007 240"
+    assert ticket_db["10007"] == 240 and user_balance == [260]
+
+
+def test_session_ends_once_every_peer_acked_and_sent_done():
+    session = client.PeerSession(TicketWallet(), [0])
+    peers = [("127.0.0.1", 5001), ("127.0.0.1", 5002)]
+    session.answered[peers[0]] = 4
+    steps = client.finish_steps(session, peers)
+    action = steps.send(None)
+    datagrams = []
+    while action[0] == "datagram":
+        datagrams.append(action[1:])
+        action = steps.send(None)
+    assert sorted(datagrams) == [("DONE 0", peers[1]), ("DONE 4", peers[0])]
+    session.acked_by.update(peers)
+    session.done_from.update(peers)
+    assert action[0] == "settle" and action[1]()
+    action = steps.send(True)
+    assert action[0] == "settle" and action[1]()
+    with pytest.raises(StopIteration):
+        steps.send(True)
+
+
+def test_sell_credits_only_a_ticket_the_server_took_back():
+    for response, balance, kept in (("10003 250", 250, False), ("NOTOWNER", 0, True), ("HELD", 0, True),
+                                    ("BADREQUEST", 0, True), (None, 0, True)):
+        ticket_db, user_balance = TicketWallet({"10003": 250}), [0]
+        actions, outcome = run_steps(client.sell_steps(ticket_db, user_balance), [response])
+        assert actions == [("request", "SELL 10003")] and outcome == response
+        assert user_balance == [balance]
+        assert ("10003" in ticket_db) == kept
+
+
+def test_peer_reply_records_a_scalped_ticket_and_ignores_stale_quotes():
+    session = client.PeerSession(TicketWallet(), [1000])
+    scalper = ("127.0.0.1", 5001)
+    session.request = client.ScalpRequest(2, [scalper])
+    assert client.peer_reply(session, "QUOTE 1 OFFER 10004 300", scalper) is None
+    assert not session.request.quotes
+    client.peer_reply(session, "QUOTE 2 OFFER 10004 300", scalper)
+    session.request.winner = session.request.best_offer()
+    client.peer_reply(session, "QUOTE 2 SOLD 10004 300", scalper)
+    assert session.ticket_db["10004"] == 300 and session.user_balance == [700]
+    assert session.answered[scalper] == 2
+    assert client.peer_reply(session, "DONE 0", scalper) == "ACK" and scalper in session.done_from
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from fair_scheduler import FairScheduler, TokenBucket
+
+
+def submit_all(scheduler, order, address, cost, count):
+    for _ in range(count):
+        scheduler.submit(address, cost, lambda: order.append(address))
+
+
+def run_queued(scheduler, order):
+    """ Finishes the running command and every one granted after it, one slot at a time. """
+    while True:
+        before = len(order)
+        scheduler.done()
+        if len(order) == before:
+            return
+
+
+def test_batch_sender_gets_one_quantum_per_round_like_everyone_else():
+    scheduler = FairScheduler(quantum=8, slots=1)
+    assert scheduler.submit("a", 8, lambda: None)  # Nobody waiting: runs at once
+    order = []
+    submit_all(scheduler, order, "a", 8, 3)
+    submit_all(scheduler, order, "b", 1, 16)
+    assert scheduler.queued == 19
+    run_queued(scheduler, order)
+    assert order == ["a"] + ["b"] * 8 + ["a"] + ["b"] * 8 + ["a"]
+    assert scheduler.queued == 0
+    assert scheduler.sessions["a"].work == 32 and scheduler.sessions["b"].work == 16
+
+
+def test_command_dearer_than_a_quantum_waits_rounds_for_its_deficit():
+    scheduler = FairScheduler(quantum=8, slots=1)
+    scheduler.submit("b", 1, lambda: None)
+    order = []
+    submit_all(scheduler, order, "a", 20, 1)
+    submit_all(scheduler, order, "b", 1, 24)
+    run_queued(scheduler, order)
+    assert order.index("a") == 16  # Deficit 8, 16, then 24 covers the 20 in the third round
+    assert order.count("b") == 24
+
+
+def test_queued_command_past_its_deadline_is_withdrawn():
+    scheduler = FairScheduler(quantum=8, slots=1)
+    scheduler.submit("a", 1, lambda: None)
+    assert not scheduler.wait_turn("b", 1, threading.Event(), time.monotonic() + 0.05)
+    assert scheduler.queued == 0
+    assert not scheduler.active
+
+
+def test_token_bucket_slows_a_client_to_its_rate():
+    bucket = TokenBucket(rate=10, burst=5)
+    now = bucket.updated
+    assert bucket.delay(5, now) == 0.0
+    assert bucket.delay(1, now) == 0.1
+    assert bucket.delay(10, now, deadline=now + 0.5) is None  # Refused: spends nothing
+    assert abs(bucket.delay(1, now + 0.1) - 0.1) < 1e-9
+    assert bucket.delay(5, now + 10) == 0.0  # Refilled, but never beyond the burst
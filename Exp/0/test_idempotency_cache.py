@@ -0,0 +1,52 @@
+import threading
+
+from idempotency_cache import IdempotencyCache
+
+
+def test_resent_request_replays_the_first_response_on_any_connection():
+    cache = IdempotencyCache()
+    entry, replay = cache.claim("k1", "SELL 10003", ("127.0.0.1", 5001), now=0)
+    assert not replay
+    cache.finish("k1", entry, "10003 250")
+    entry, replay = cache.claim("k1", "SELL 10003", ("127.0.0.1", 5002), now=1)
+    assert replay and entry.response == "10003 250"
+
+
+def test_failed_request_frees_its_key():
+    cache = IdempotencyCache()
+    entry, _ = cache.claim("k1", "BUY 400", "a", now=0)
+    cache.finish("k1", entry, None)
+    assert len(cache) == 0
+    assert not cache.claim("k1", "BUY 400", "a", now=1)[1]
+
+
+def test_keys_expire_after_ttl():
+    cache = IdempotencyCache(ttl=10)
+    entry, _ = cache.claim("k1", "BUY 400", "a", now=0)
+    cache.finish("k1", entry, "10001 200")
+    assert cache.claim("k1", "BUY 400", "a", now=9.9)[1]
+    assert not cache.claim("k1", "BUY 400", "a", now=10)[1]
+
+
+def test_oldest_keys_are_evicted_beyond_capacity():
+    cache = IdempotencyCache(capacity=2)
+    for number, key in enumerate(("k1", "k2", "k3")):
+        entry, _ = cache.claim(key, "BUY 400", "a", now=number)
+        cache.finish(key, entry, f"1000{number} 200")
+    assert len(cache) == 2
+    assert list(cache.entries) == ["k2", "k3"]
+    assert not cache.claim("k1", "BUY 400", "a", now=3)[1]
+    assert list(cache.entries) == ["k3", "k1"]
+
+
+def test_claim_while_the_first_runs_waits_for_its_response():
+    cache = IdempotencyCache()
+    entry, _ = cache.claim("k1", "BUY 400", "a", now=0)
+    claimed = []
+    waiter = threading.Thread(target=lambda: claimed.append(cache.claim("k1", "BUY 400", "b", now=0)))
+    waiter.start()
+    waiter.join(0.05)
+    assert waiter.is_alive()
+    cache.finish("k1", entry, "10001 200")
+    waiter.join(5)
+    assert claimed[0] == (entry, True)
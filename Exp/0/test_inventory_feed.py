@@ -0,0 +1,52 @@
+import socket
+import threading
+import time
+
+from inventory_feed import InventoryFeed
+from push_outbox import PushFlusher, PushOutbox
+from ticket_inventory import TicketInventory
+from ticket_protocol import FrameReader, encode
+
+
+def small_socketpair():
+    server_side, client_side = socket.socketpair()
+    server_side.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    client_side.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    return server_side, client_side
+
+
+def test_publish_drops_a_stalled_subscriber_without_holding_up_the_others():
+    inventory = TicketInventory([250, 300])
+    feed = InventoryFeed(inventory)
+    flusher = PushFlusher()
+    sockets = {}
+    for address, limit in (("stalled", 1024), ("reading", 1 << 20)):
+        server_side, client_side = sockets[address] = small_socketpair()
+        outbox = PushOutbox(server_side, flusher, limit)
+        feed.attach(address, lambda frame, outbox=outbox: outbox.push(encode(frame, True)))
+        feed.subscribe(address)
+
+    frames = []
+
+    def read():
+        reader = FrameReader()
+        sockets["reading"][1].settimeout(5)
+        while len(frames) < 2000:
+            frames.extend(reader.feed(sockets["reading"][1].recv(65536)))
+            flusher.run_once()
+
+    reader_thread = threading.Thread(target=read, daemon=True)
+    reader_thread.start()
+    start = time.monotonic()
+    for _ in range(1000):
+        ticket = inventory.buy(1000).split()[0]
+        feed.publish()
+        inventory.sell(ticket)
+        feed.publish()
+    assert time.monotonic() - start < 5
+    reader_thread.join(5)
+    assert feed.subscribers == {"reading"}
+    assert [frame.split()[1] for frame in frames] == [str(seq) for seq in range(1, 2001)]
+    for pair in sockets.values():
+        for sock in pair:
+            sock.close()
@@ -0,0 +1,47 @@
+import pytest
+
+from peer_registry import PeerRegistry
+
+
+def test_lookup_lists_other_stocked_peers_best_stocked_first():
+    peers = PeerRegistry(capacity=8)
+    for number, stock in enumerate((3, 0, 7, 5)):
+        assert peers.register(("10.0.0.1", 40000 + number), "127.0.0.1", 5000 + number, stock)
+    assert peers.lookup(("10.0.0.1", 40002), 2) == [("127.0.0.1", 5003, 5), ("127.0.0.1", 5000, 3)]
+    assert peers.lookup(("10.0.0.1", 40001), 8) == [("127.0.0.1", 5002, 7), ("127.0.0.1", 5003, 5),
+                                                     ("127.0.0.1", 5000, 3)]
+    assert sorted(peers.roster(("10.0.0.1", 40000))) == [("127.0.0.1", 5001), ("127.0.0.1", 5002), ("127.0.0.1", 5003)]
+
+
+def test_full_registry_refuses_until_a_connection_closes():
+    peers = PeerRegistry(capacity=2)
+    assert peers.register("a", "127.0.0.1", 5001)
+    assert peers.register("b", "127.0.0.1", 5002)
+    assert not peers.register("c", "127.0.0.1", 5003)
+    assert peers.register("a", "127.0.0.1", 5004)  # Moving an endpoint takes no new slot
+    peers.unregister("a")
+    assert "a" not in peers and len(peers) == 1
+    assert peers.register("c", "127.0.0.1", 5003)
+    assert peers.roster("b") == [("127.0.0.1", 5003)]
+
+
+def test_stock_follows_reports_adjustments_and_transfers():
+    peers = PeerRegistry()
+    peers.register("seller", "127.0.0.1", 5001, 1)
+    peers.register("buyer", "127.0.0.1", 5002)
+    peers.adjust("seller", +2)
+    assert peers.lookup("buyer", 1) == [("127.0.0.1", 5001, 3)]
+    assert peers.transfer("buyer", "127.0.0.1", 5001)
+    assert peers.lookup("seller", 1) == [("127.0.0.1", 5002, 1)]
+    peers.report("seller", -4)  # Clamped: a peer never holds fewer than no tickets
+    assert peers.lookup("buyer", 1) == []
+    assert not peers.transfer("buyer", "127.0.0.1", 5009)
+    assert peers.connection("127.0.0.1", 5001) == "seller"
+    peers.unregister("seller")
+    assert peers.connection("127.0.0.1", 5001) is None
+
+
+@pytest.mark.parametrize("host, port", [("localhost", 5001), ("::1", 5001), ("127.0.0.1", 0), ("127.0.0.1", 1 << 16)])
+def test_register_refuses_what_the_slots_cannot_hold(host, port):
+    with pytest.raises(ValueError):
+        PeerRegistry().register("a", host, port)
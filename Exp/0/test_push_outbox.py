@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from push_outbox import PushFlusher, PushOutbox
+
+FRAME = b"EVENT 1 " + b"+10001:250 " * 100 + b"\n"
+
+
+def read_all(sock, size):
+    data = b""
+    while len(data) < size:
+        data += sock.recv(65536)
+    return data
+
+
+def test_push_to_a_client_that_stopped_reading_never_waits():
+    server_side, client_side = socket.socketpair()
+    flusher = PushFlusher()
+    outbox = PushOutbox(server_side, flusher, limit=1 << 16)
+    start = time.monotonic()
+    pushed = 0
+    with pytest.raises(BufferError):
+        while True:
+            outbox.push(FRAME)
+            pushed += 1
+    assert time.monotonic() - start < 1
+    assert len(flusher) == 1  # The flusher finishes the frames once the client reads again
+    received = b""
+    while len(received) < pushed * len(FRAME):
+        received += client_side.recv(65536)
+        flusher.run_once()
+    assert received == FRAME * pushed and not outbox.pending
+    server_side.close()
+    client_side.close()
+
+
+def test_reply_follows_the_frames_pushed_before_it_whole():
+    server_side, client_side = socket.socketpair()
+    flusher = PushFlusher()
+    outbox = PushOutbox(server_side, flusher)
+    pushed = 0
+    while not outbox.pending:
+        outbox.push(FRAME)
+        pushed += 1
+    replier = threading.Thread(target=outbox.send, args=(b"10001 250\n",))
+    replier.start()
+    received = read_all(client_side, pushed * len(FRAME) + len(b"10001 250\n"))
+    replier.join(5)
+    assert received == FRAME * pushed + b"10001 250\n"
+    server_side.close()
+    client_side.close()
+
+
+def test_push_after_the_connection_failed_raises():
+    server_side, client_side = socket.socketpair()
+    outbox = PushOutbox(server_side, PushFlusher())
+    client_side.close()
+    with pytest.raises(OSError):
+        for _ in range(100):
+            outbox.push(FRAME)
+    server_side.close()
@@ -0,0 +1,83 @@
+from resale_market import ResaleBook
+
+
+def test_resold_ticket_may_only_be_sold_by_its_new_owner():
+    book = ResaleBook()
+    book.acquire("10000", "a")
+    assert book.ask("a", "10000", 300) == "ASKED 1"
+    assert book.bid("b", 350) == "FILLED 2 10000 300"
+    assert book.owners["10000"] == "b"
+    assert not book.owners.may_sell("10000", "a")
+    assert book.owners.may_sell("10000", "b")
+    book.owners.discard("10000", "a")
+    assert book.owners.get("10000") == "b"
+
+
+def test_ticket_from_the_server_may_be_sold_by_anyone():
+    book = ResaleBook()
+    book.acquire("10000", "a")
+    assert book.owners.may_sell("10000", "c")
+    book.release("10000")
+    assert "10000" not in list(book.owners)
+
+
+def book_with_tickets(owners):
+    book = ResaleBook()
+    for ticket_number, owner in owners.items():
+        book.acquire(ticket_number, owner)
+    return book
+
+
+def test_bids_fill_resting_asks_one_at_a_time_by_price_then_time():
+    book = book_with_tickets({"10000": "a", "10001": "b", "10002": "c"})
+    assert book.ask("a", "10000", 300) == "ASKED 1"
+    assert book.ask("b", "10001", 250) == "ASKED 2"
+    assert book.ask("c", "10002", 250) == "ASKED 3"
+    assert book.bid("d", 280) == "FILLED 4 10001 250"
+    assert book.bid("d", 280) == "FILLED 5 10002 250"
+    assert book.bid("d", 280) == "BIDDING 6"
+    assert len(book) == 2
+    assert book.take_fills("b") == ["2:10001:250"]
+    assert book.take_fills("b") == []
+    assert book.ask("a", "10000", 260) == "ALREADYASKED"
+
+
+def test_ask_fills_the_best_resting_bid_at_its_price():
+    book = book_with_tickets({"10000": "a"})
+    assert book.bid("b", 280) == "BIDDING 1"
+    assert book.bid("c", 320) == "BIDDING 2"
+    assert book.bid("d", 320) == "BIDDING 3"
+    assert book.ask("a", "10000", 300) == "FILLED 4 10000 320"
+    assert book.owners["10000"] == "c"
+    assert book.take_fills("c") == ["2:10000:320"]
+    assert sorted(order[0] for order in book.orders.values()) == ["b", "d"]
+
+
+def test_cancelled_orders_never_fill():
+    book = book_with_tickets({"10000": "a", "10001": "a"})
+    assert book.ask("a", "10000", 200) == "ASKED 1"
+    assert book.ask("a", "10001", 300) == "ASKED 2"
+    assert book.cancel("b", 1) == "NOORDER"
+    assert book.cancel("a", 1) == "CANCELLED 1"
+    assert book.cancel("a", 1) == "NOORDER"
+    assert book.bid("b", 250) == "BIDDING 3"
+    assert book.bid("b", 300) == "FILLED 4 10001 300"
+    book.cancel_all("b")
+    assert len(book) == 0
+    assert book.ask("a", "10000", 100) == "ASKED 5"
+
+
+def test_self_trade_is_refused():
+    book = book_with_tickets({"10000": "a"})
+    assert book.bid("a", 300) == "BIDDING 1"
+    assert book.ask("a", "10000", 250) == "SELFTRADE"
+    assert book.owners["10000"] == "a"
+
+
+def test_ticket_changing_hands_cancels_its_ask():
+    book = book_with_tickets({"10000": "a"})
+    assert book.ask("a", "10000", 250) == "ASKED 1"
+    book.acquire("10000", "b")
+    assert len(book) == 0
+    assert book.bid("c", 300) == "BIDDING 2"
+    assert book.ask("a", "10000", 250) == "NOTOWNER"
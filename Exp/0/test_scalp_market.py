@@ -0,0 +1,60 @@
+from scalp_market import ScalpDesk, ScalpRequest
+from ticket_wallet import TicketWallet
+
+BUYER = ("127.0.0.1", 5001)
+PEERS = [("127.0.0.1", 6001), ("127.0.0.1", 6002), ("127.0.0.1", 6003)]
+
+
+def test_buyer_accepts_the_cheapest_offer_and_ignores_late_quotes():
+    request = ScalpRequest(1, PEERS[:2])
+    request.quote_received(PEERS[0], "OFFER 10003 500")
+    request.quote_received(PEERS[2], "OFFER 10004 100")  # Not asked
+    assert not request.all_quoted() and request.unquoted() == [PEERS[1]]
+    request.quote_received(PEERS[1], "OFFER 10005 420")
+    request.quote_received(PEERS[1], "OFFER 10006 300")  # Only the first quote counts
+    assert request.all_quoted()
+    request.winner = request.best_offer()
+    assert request.winner == PEERS[1]
+    assert request.quote_received(PEERS[0], "SOLD 10003 500") is None
+    assert request.quote_received(PEERS[1], "SOLD 10005 420") == ("10005", 420)
+    assert request.quote_received(PEERS[1], "SOLD 10005 420") is None
+
+
+def test_no_offer_reports_nomoney_before_soldout():
+    request = ScalpRequest(1, PEERS)
+    request.quote_received(PEERS[0], "Scalper is sold-out")
+    request.quote_received(PEERS[1], "NOMONEY")
+    assert request.best_offer() is None
+    assert request.outcome() == "NOMONEY"
+    assert ScalpRequest(2, PEERS).outcome() == "SOLDOUT"
+
+
+def test_desk_quotes_once_per_scalp_and_sells_once_per_accept():
+    ticket_db, balance = TicketWallet({"10001": 200, "10002": 150}), [0]
+    desk = ScalpDesk(ticket_db, balance)
+    assert desk.scalp(BUYER, 1, 0, 1000, now=0) == "QUOTE 1 OFFER 10002 300"
+    assert desk.scalp(BUYER, 1, 0, 1000, now=0.1) == "QUOTE 1 OFFER 10002 300"  # Retransmission
+    assert "10002" not in ticket_db
+    assert desk.accept(BUYER, 1, now=0.2) == "QUOTE 1 SOLD 10002 300"
+    assert desk.accept(BUYER, 1, now=0.3) == "QUOTE 1 SOLD 10002 300"
+    assert balance == [300] and len(ticket_db) == 1
+
+
+def test_declined_and_lapsed_offers_go_back_to_the_wallet():
+    ticket_db, balance = TicketWallet({"10001": 200, "10002": 150}), [0]
+    desk = ScalpDesk(ticket_db, balance)
+    desk.scalp(BUYER, 1, 0, 1000, now=0)
+    desk.decline(BUYER, 1)
+    assert "10002" in ticket_db
+    desk.scalp(PEERS[0], 1, 0, 1000, now=0)
+    assert desk.accept(PEERS[0], 1, now=desk.offers[0][0]) == "QUOTE 1 EXPIRED"
+    assert len(ticket_db) == 2 and balance == [0]
+
+
+def test_sale_the_buyer_never_acknowledged_is_taken_back():
+    ticket_db, balance = TicketWallet({"10001": 200}), [0]
+    desk = ScalpDesk(ticket_db, balance)
+    desk.scalp(BUYER, 1, 0, 1000, now=0)
+    desk.accept(BUYER, 1, now=0)
+    desk.done(BUYER, 0)  # The SOLD reply never reached the buyer
+    assert ticket_db["10001"] == 200 and balance == [0]
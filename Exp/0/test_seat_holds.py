@@ -0,0 +1,50 @@
+from seat_holds import SeatHolds, TimingWheel
+from ticket_inventory import ShardedTicketInventory
+
+
+def test_held_seat_stays_held_until_back_in_pool():
+    inventory = ShardedTicketInventory([300, 200, 250], 2)
+    holds = SeatHolds(inventory, hold_seconds=60)
+    assert holds.hold("a", 1000) == "HELD 1 10001 200 60"
+    assert holds.is_held("10001")
+    assert holds.release("b", "1") == "NOHOLD"
+    assert holds.is_held("10001")
+    assert holds.release("a", "1") == "RELEASED 10001"
+    assert not holds.is_held("10001")
+    assert len(inventory) == 3
+
+
+def test_confirmed_and_expired_holds_are_no_longer_held():
+    inventory = ShardedTicketInventory([300, 200, 250], 2)
+    holds = SeatHolds(inventory, hold_seconds=1)
+    holds.hold("a", 1000)
+    holds.hold("a", 1000)
+    assert holds.confirm("a", "1") == "10001 200"
+    assert not holds.is_held("10001")
+    assert holds.expire(holds.wheel.current * holds.wheel.tick + 2) == 1
+    assert not holds.is_held("10002")
+    assert len(inventory) == 2
+
+
+def test_timing_wheel_cascades_across_levels_and_overflow():
+    wheel = TimingWheel(tick=1, slots=4, levels=3, now=0)
+    deadlines = {"a": 2, "b": 5, "c": 10, "d": 17, "e": 40, "f": 64, "g": 100, "h": 200}
+    for item, deadline in deadlines.items():
+        wheel.schedule(deadline, item)
+    assert sorted(item for _, item in wheel.overflow) == ["f", "g", "h"]
+    expired = {}
+    for now in range(1, 260):
+        for item in wheel.advance(now):
+            expired[item] = now
+    assert expired == deadlines
+
+
+def test_timing_wheel_catches_up_in_one_advance():
+    wheel = TimingWheel(tick=0.5, slots=4, levels=2, now=10)
+    wheel.schedule(9, "past")
+    wheel.schedule(13, "soon")
+    wheel.schedule(30, "late")
+    assert wheel.advance(10.4) == []
+    assert wheel.advance(10.5) == ["past"]
+    assert wheel.advance(29.9) == ["soon"]
+    assert wheel.advance(100) == ["late"]
@@ -0,0 +1,39 @@
+import pytest
+
+from ticket_inventory import ShardedTicketInventory, TicketInventory
+
+
+def test_sell_many_unknown_ticket_returns_nothing():
+    inventory = ShardedTicketInventory([200] * 1001, 8)
+    inventory.buy_many(1001, 1001 * 200)
+    with pytest.raises(KeyError):
+        inventory.sell_many(["10125", "11005"])
+    assert len(inventory) == 0
+    assert inventory.sell("10125") == "10125 200"
+
+
+def test_sell_many_past_last_shard_matches_unsharded():
+    prices = list(range(200, 225))
+    for inventory in (TicketInventory(prices), ShardedTicketInventory(prices, 8)):
+        with pytest.raises(KeyError):
+            inventory.sell_many(["10027"])
+        with pytest.raises(KeyError):
+            inventory.sell("10027")
+
+
+def test_sell_many_returns_only_sold_tickets():
+    inventory = ShardedTicketInventory([300, 200, 250, 400, 350], 2)
+    assert inventory.buy_many(2, 1000) == "10001:200 10002:250"
+    assert inventory.sell_many(["10002", "10000", "10001"]) == "10002:250 10001:200"
+    assert inventory.sell_many(["10000"]) == "NOTSOLD"
+    assert len(inventory) == 5
+
+
+def test_single_shard_answers_as_the_unsharded_inventory():
+    prices = [300, 200, 250]
+    plain, single = TicketInventory(prices), ShardedTicketInventory(prices, 1)
+    for request in (("buy", 250), ("buy", 100), ("sell", "10001"), ("sell", "10001"), ("buy", 1000), ("buy", 1000),
+                    ("buy", 1000), ("buy", 1000)):
+        assert getattr(single, request[0])(request[1]) == getattr(plain, request[0])(request[1])
+    with pytest.raises(KeyError):
+        single.sell("10003")
@@ -0,0 +1,151 @@
+import socket
+import threading
+
+import pytest
+
+import ticket_protocol
+from ticket_protocol import (FRAMED_HELLO, Connection, FrameReader, RequestPipeline, negotiate_client,
+                             negotiate_server, split_tag, tag)
+
+
+def test_frame_split_over_reads_is_reassembled_and_coalesced_frames_are_separated():
+    reader = FrameReader()
+    assert reader.feed(b"#1 BUY ") == []
+    assert reader.feed(b"4000") == []
+    assert reader.feed(b"\n#2 SELL 10003\n\n  \nEVENT 4 +10003:250\n#3") == ["#1 BUY 4000", "#2 SELL 10003",
+                                                                          "EVENT 4 +10003:250"]
+    assert reader.feed(b" LIST\r\n") == ["#3 LIST"]
+
+
+def test_frame_over_the_size_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(ticket_protocol, "max_frame_size", 64)
+    reader = FrameReader()
+    assert reader.feed(b"x" * 64) == []  # At the limit, still waiting for its newline
+    with pytest.raises(ValueError):
+        reader.feed(b"x")
+    assert FrameReader().feed(b"y" * 64 + b"\n" + b"z" * 64) == ["y" * 64]  # Only the unfinished frame counts
+
+
+def test_tags_round_trip_and_malformed_tags_do_not_pass_as_untagged():
+    assert split_tag(tag("7", "BUY 4000")) == ("7", "BUY 4000")
+    assert split_tag("BUY 4000") == (None, "BUY 4000")
+    assert split_tag("#7") == ("7", "")
+    assert split_tag("#") == ("", "")
+    assert split_tag("# BUY 4000") == ("", "BUY 4000")
+
+
+def negotiate_in_thread(sock):
+    """ Starts negotiate_server on sock; the returned dict holds its connection once the thread is joined. """
+    negotiated = {}
+    thread = threading.Thread(target=lambda: negotiated.update(connection=negotiate_server(sock)), daemon=True)
+    thread.start()
+    return thread, negotiated
+
+
+def test_framed_client_and_server_agree_on_framing():
+    server_side, client_side = socket.socketpair()
+    thread, negotiated = negotiate_in_thread(server_side)
+    client = negotiate_client(client_side)
+    thread.join(5)
+    server = negotiated["connection"]
+    assert client.framed and server.framed
+    client.send("#1 BUY 4000")
+    assert server.recv() == "#1 BUY 4000"
+    server.send("#1 10001 250")
+    assert client.recv() == "#1 10001 250"
+    client.close()
+    server.close()
+
+
+def test_hello_coalesced_with_the_first_request_keeps_the_request():
+    server_side, client_side = socket.socketpair()
+    client_side.sendall(FRAMED_HELLO + b"#1 BUY 4000\n")
+    server = negotiate_server(server_side)
+    assert server.framed and server.recv() == "#1 BUY 4000"
+    assert client_side.recv(1024) == FRAMED_HELLO
+    client_side.close()
+    server.close()
+
+
+def test_legacy_client_gets_a_text_connection_with_its_first_message():
+    server_side, client_side = socket.socketpair()
+    client_side.sendall(b"BUY 4000")
+    server = negotiate_server(server_side)
+    assert not server.framed and server.recv() == "BUY 4000"
+    client_side.close()
+    server.close()
+
+
+def test_client_falls_back_to_text_when_the_server_does_not_echo_the_hello():
+    server_side, client_side = socket.socketpair()
+    client = negotiate_client(client_side, timeout=0.2)
+    assert not client.framed
+    assert server_side.recv(1024) == FRAMED_HELLO
+    client.close()
+    server_side.close()
+
+
+class ScriptedConnection:
+    """ A framed Connection stand-in: records what is sent and replies from a script. """
+
+    def __init__(self, replies):
+        self.sent = []
+        self.replies = replies
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def recv(self):
+        return self.replies.pop(0) if self.replies else None
+
+
+def test_pipeline_matches_out_of_order_replies_by_id():
+    connection = ScriptedConnection(["#2 10002 250", "#3 SOLDOUT", "#1 10001 250"])
+    pipeline = RequestPipeline(connection, window=3)
+    replies = {}
+    for number, message in enumerate(("BUY 4000", "BUY 4000", "BUY 100"), 1):
+        pipeline.submit(message, lambda response, number=number: replies.setdefault(number, response))
+    assert connection.sent == ["#1 BUY 4000", "#2 BUY 4000", "#3 BUY 100"]
+    assert len(pipeline) == 3
+    pipeline.drain()
+    assert replies == {1: "10001 250", 2: "10002 250", 3: "SOLDOUT"}
+
+
+def test_pipeline_reads_a_reply_before_going_past_its_window():
+    connection = ScriptedConnection(["#1 10001 250", "#2 10002 250"])
+    pipeline = RequestPipeline(connection, window=1)
+    replies = []
+    pipeline.submit("BUY 4000", replies.append)
+    pipeline.submit("BUY 4000", replies.append)
+    assert replies == ["10001 250"] and len(pipeline) == 1
+    pipeline.drain()
+    assert replies == ["10001 250", "10002 250"]
+
+
+@pytest.mark.parametrize("reply", ["#9 10001 250", "10001 250", "#", "# 10001 250"])
+def test_pipeline_refuses_a_reply_to_no_request_in_flight(reply):
+    pipeline = RequestPipeline(ScriptedConnection([reply]), window=4)
+    pipeline.submit("BUY 4000", lambda response: None)
+    with pytest.raises(ValueError):
+        pipeline.receive_one()
+
+
+def test_pipeline_raises_when_the_server_closes_with_requests_in_flight():
+    pipeline = RequestPipeline(ScriptedConnection([]), window=4)
+    pipeline.submit("BUY 4000", lambda response: None)
+    with pytest.raises(ConnectionError):
+        pipeline.drain()
+
+
+def test_pushed_frames_do_not_reach_the_pipeline():
+    server_side, client_side = socket.socketpair()
+    connection = Connection(client_side, True)
+    pipeline = RequestPipeline(connection, window=2)
+    replies = []
+    pipeline.submit("BUY 4000", replies.append)
+    server_side.sendall(b"EVENT 5 -10001\nQUEUED 3\n#1 10001 250\n")
+    pipeline.drain()
+    assert replies == ["10001 250"]
+    assert list(connection.events) == ["EVENT 5 -10001", "QUEUED 3"]
+    server_side.close()
+    client_side.close()
@@ -0,0 +1,35 @@
+from seat_holds import SeatHolds
+from ticket_inventory import ShardedTicketInventory, TicketInventory
+from ticket_waitlist import Waitlist
+
+
+def test_sell_many_hands_returned_tickets_to_waiters_first():
+    for inventory in (TicketInventory([300, 200, 250]), ShardedTicketInventory([300, 200, 250], 2)):
+        inventory.buy_many(3, 1000)
+        waitlist = Waitlist()
+        waitlist.join("poor", 100)
+        waitlist.join("b", 4000)
+        response, handoffs = inventory.sell_many_to(["10001", "10001", "10002"], waitlist.take)
+        assert response == "10001:200 10002:250"
+        assert handoffs == [("10001 200", "b")]
+        assert len(inventory) == 1  # 10001 stays sold to b, 10002 is back in the pool
+        assert inventory.buy(4000) == "10002 250"
+        assert list(waitlist.waiting) == ["poor"]
+
+
+def test_ended_holds_hand_their_seats_to_waiters():
+    inventory = ShardedTicketInventory([300, 200, 250], 2)
+    waitlist = Waitlist()
+    handed = []
+    holds = SeatHolds(inventory, hold_seconds=1, take=waitlist.take, handed_off=lambda sale, buyer: handed.append((sale, buyer)))
+    holds.hold("a", 1000)
+    holds.hold("a", 1000)
+    holds.hold("a", 1000)
+    waitlist.join("b", 4000)
+    waitlist.join("c", 4000)
+    assert holds.release("a", "1") == "RELEASED 10001"
+    assert holds.expire(holds.wheel.current * holds.wheel.tick + 2) == 2
+    assert handed == [("10001 200", "b"), ("10002 250", "c")]
+    assert not holds.is_held("10001") and not holds.is_held("10002")
+    assert len(inventory) == 1
+    assert inventory.buy(4000) == "10000 300"
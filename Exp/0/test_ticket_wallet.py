@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from ticket_wallet import TicketWallet
+
+
+def test_cheapest_and_dearest_follow_every_insert_reprice_and_removal():
+    rng = random.Random(6)
+    wallet = TicketWallet()
+    shadow = {}
+    for _ in range(2000):
+        ticket_number = str(10000 + rng.randrange(200))
+        if ticket_number in shadow and rng.random() < 0.4:
+            del wallet[ticket_number]
+            del shadow[ticket_number]
+        else:
+            wallet[ticket_number] = shadow[ticket_number] = rng.randrange(100, 1000)
+        assert dict(wallet) == shadow
+        if shadow:
+            assert wallet.cheapest()[1] == min(shadow.values())
+            assert wallet.most_expensive()[1] == max(shadow.values())
+            assert shadow[wallet.cheapest()[0]] == wallet.cheapest()[1]
+
+
+def test_pops_come_out_in_price_order():
+    prices = {"10001": 300, "10002": 250, "10003": 400, "10004": 275}
+    wallet = TicketWallet(prices)
+    assert wallet.pop_cheapest() == ("10002", 250)
+    assert wallet.pop_most_expensive() == ("10003", 400)
+    assert wallet.popitem() == ("10001", 300)
+    assert dict(wallet) == {"10004": 275}
+
+
+def test_pop_cheapest_keeps_a_ticket_dearer_than_the_limit():
+    wallet = TicketWallet({"10001": 300, "10002": 250})
+    assert wallet.pop_cheapest(limit=200) is None
+    assert len(wallet) == 2
+    assert wallet.pop_cheapest(limit=250) == ("10002", 250)
+    assert wallet.pop_cheapest(limit=250) is None
+
+
+def test_empty_wallet():
+    wallet = TicketWallet()
+    assert wallet.cheapest() is None and wallet.most_expensive() is None
+    assert wallet.pop_cheapest() is None and wallet.pop_most_expensive() is None
+    with pytest.raises(KeyError):
+        wallet.popitem()
+    with pytest.raises(KeyError):
+        del wallet["10001"]
@@ -0,0 +1,80 @@
+from waiting_room import WaitingRoom
+
+
+class Client:
+    """ A queued connection's notify and wake, recording the frames it was sent. """
+
+    def __init__(self, fail=False):
+        self.frames = []
+        self.woken = 0
+        self.fail = fail
+
+    def notify(self, frame):
+        if self.fail:
+            raise BufferError("client is not reading its pushed frames")
+        self.frames.append(frame)
+
+    def wake(self):
+        self.woken += 1
+
+
+def join(room, *addresses):
+    clients = {address: Client() for address in addresses}
+    for address, client in clients.items():
+        room.join(address, client.notify, client.wake)
+    return clients
+
+
+def test_burst_is_let_straight_in_and_the_rest_queue_in_order():
+    room = WaitingRoom(rate=0.001, burst=2, capacity=10)
+    clients = join(room, "a", "b", "c", "d")
+    assert room.admitted == {"a", "b"} and list(room.queue) == ["c", "d"]
+    assert clients["a"].frames == ["ADMITTED"] and clients["a"].woken == 1
+    assert clients["c"].frames == ["QUEUED 1"] and clients["d"].frames == ["QUEUED 2"]
+    assert clients["c"].woken == 0
+
+
+def test_tokens_accrue_at_the_rate_up_to_the_burst():
+    room = WaitingRoom(rate=10, burst=2, capacity=10)
+    clients = join(room, "a", "b", "c", "d", "e")
+    start = room.updated
+    room.pump(start + 0.15)  # One token
+    assert room.admitted == {"a", "b", "c"}
+    room.pump(start + 100)  # Capped at the burst
+    assert room.admitted == {"a", "b", "c", "d", "e"}
+    assert clients["e"].frames[-1] == "ADMITTED"
+    assert room.tokens == 0
+
+
+def test_an_admitted_connection_leaving_frees_its_slot():
+    room = WaitingRoom(rate=1000, burst=10, capacity=2)
+    clients = join(room, "a", "b", "c")
+    assert room.admitted == {"a", "b"} and list(room.queue) == ["c"]
+    room.leave("a")
+    assert clients["a"].woken == 1  # Not woken again
+    room.pump()
+    assert room.admitted == {"b", "c"} and clients["c"].woken == 1
+
+
+def test_queued_connections_hear_their_position_every_report_interval():
+    room = WaitingRoom(rate=0.001, burst=1, capacity=10, report_interval=5)
+    clients = join(room, "a", "b", "c")
+    room.leave("b")
+    assert clients["b"].woken == 1  # Woken as dropped, never admitted
+    room.pump(room.next_report - 1)
+    assert clients["c"].frames == ["QUEUED 2"]
+    room.pump(room.next_report)
+    assert clients["c"].frames == ["QUEUED 2", "QUEUED 1"]
+
+
+def test_a_connection_that_cannot_be_told_is_dropped():
+    room = WaitingRoom(rate=0.001, burst=1, capacity=10)
+    join(room, "a")
+    stalled = Client(fail=True)
+    room.join("b", stalled.notify, stalled.wake)
+    assert "b" not in room.queue and stalled.woken == 1
+    refused = Client(fail=True)
+    room.leave("a")
+    room.tokens = 1
+    room.join("c", refused.notify, refused.wake)
+    assert "c" not in room.admitted and refused.woken == 1
@@ -0,0 +1,7 @@
+import importlib.util
+import os
+
+# The client script's file name is not importable as-is, so load it by path, once for every module importing it
+_spec = importlib.util.spec_from_file_location("client_0_40", os.path.join(os.path.dirname(os.path.abspath(__file__)), "client-0-40.py"))
+client = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(client)
@@ -0,0 +1,383 @@
+import itertools
+import threading
+from contextlib import ExitStack
+from array import array
+from multiprocessing.sharedctypes import RawArray
+
+
+def format_batch(tickets, status=None):
+    """ Compact batch response: "<ticket>:<price>" per ticket, then the status that stopped the batch, if any. """
+    return " ".join([f"{ticket}:{price}" for ticket, price in tickets] + ([status] if status else []))
+
+
+class TicketInventory:
+    """ Array-backed ticket database with a price-ordered index of the unsold tickets.
+
+    Ticket numbers are integer offsets from first_ticket, prices live in a
+    typed array and the sold flags in a bitset, so a seat costs a few bytes
+    instead of a dict. Unsold tickets are bucketed by price: _order holds
+    every offset grouped by price level and each level keeps its unsold
+    offsets as a stack at the front of its segment. BUY pops from the
+    cheapest non-empty level and SELL pushes back onto the ticket's level.
+    It is not thread safe; callers serialize access with their own lock.
+    """
+
+    def __init__(self, prices, first_ticket=10000):
+        self.first_ticket = first_ticket
+        self.prices = array('H' if max(prices, default=0) < 1 << 16 else 'I', prices)
+        self._sold = bytearray((len(self.prices) + 7) // 8)
+
+        self._low_price = min(self.prices, default=0)
+        levels = max(self.prices, default=0) - self._low_price + 1
+        self._level_fill = array('I', [0]) * levels
+        for price in self.prices:
+            self._level_fill[price - self._low_price] += 1
+        self._level_start = array('I', [0]) * levels
+        for level in range(1, levels):
+            self._level_start[level] = self._level_start[level - 1] + self._level_fill[level - 1]
+
+        self._order = array('I', [0]) * len(self.prices)
+        fill = array('I', self._level_start)
+        for offset, price in enumerate(self.prices):
+            level = price - self._low_price
+            self._order[fill[level]] = offset
+            fill[level] += 1
+
+        self._min_level = 0
+        self._unsold = len(self.prices)
+
+    def __len__(self):
+        return self._unsold
+
+    def is_sold(self, offset):
+        return bool(self._sold[offset >> 3] & (1 << (offset & 7)))
+
+    def sold_flags(self):
+        """ Copy of the sold bitset: bit offset & 7 of byte offset >> 3 is set while that ticket is sold. """
+        return bytes(self._sold)
+
+    def segments(self):
+        """ The inventories holding the tickets, each with its own first_ticket, prices and sold_flags(). """
+        return [self]
+
+    def _offset(self, ticket_number):
+        offset = int(ticket_number) - self.first_ticket
+        if not 0 <= offset < len(self.prices):
+            raise KeyError(ticket_number)
+        return offset
+
+    def validate(self, ticket_numbers):
+        """ Raises KeyError for the first ticket number that is not in the inventory. """
+        for ticket_number in ticket_numbers:
+            self._offset(ticket_number)
+
+    def cheapest_price(self):
+        """ Price of the cheapest unsold ticket, or None when sold out. Does not modify the index. """
+        if not self._unsold:
+            return None
+        level = self._min_level
+        while level < len(self._level_fill) and not self._level_fill[level]:
+            level += 1
+        return self._low_price + level if level < len(self._level_fill) else None
+
+    def _claim(self, user_balance):
+        """ Marks the cheapest unsold ticket sold and returns its offset, or SOLDOUT/NOFUNDS. """
+        if not self._unsold:
+            return "SOLDOUT"
+        level = self._min_level
+        while not self._level_fill[level]:
+            level += 1
+        self._min_level = level
+        if user_balance < self._low_price + level:
+            return "NOFUNDS"
+        self._level_fill[level] -= 1
+        offset = self._order[self._level_start[level] + self._level_fill[level]]
+        self._sold[offset >> 3] |= 1 << (offset & 7)
+        self._unsold -= 1
+        return offset
+
+    def _release(self, offset):
+        """ Returns a sold ticket to its price level and gives its price; None if it was not sold. """
+        if not self.is_sold(offset):
+            return None
+        self._sold[offset >> 3] &= ~(1 << (offset & 7))
+        price = self.prices[offset]
+        level = price - self._low_price
+        self._order[self._level_start[level] + self._level_fill[level]] = offset
+        self._level_fill[level] += 1
+        self._min_level = min(self._min_level, level)
+        self._unsold += 1
+        return price
+
+    def buy(self, user_balance):
+        """ Sells the cheapest unsold ticket and returns the server response.
+
+        SOLDOUT is answered from the unsold counter, NOFUNDS and a sale from
+        the cheapest non-empty price level; neither depends on the number of
+        tickets.
+        """
+        offset = self._claim(user_balance)
+        if isinstance(offset, str):
+            return offset
+        return f"{self.first_ticket + offset} {self.prices[offset]}"
+
+    def sell(self, ticket_number):
+        """ Returns a sold ticket to the pool; None if it was not sold. """
+        offset = self._offset(ticket_number)
+        price = self._release(offset)
+        if price is None:
+            return None
+        return f"{self.first_ticket + offset} {price}"
+
+    def sell_to(self, ticket_number, take):
+        """ SELL that first offers the ticket's price to take(), which names a buyer to keep it sold to or None.
+
+        Returns (response, buyer): the SELL response, None if the ticket was
+        not sold, and the buyer, None when the ticket went back to the pool.
+        """
+        offset = self._offset(ticket_number)
+        price, buyer = self._return_to(offset, take)
+        if price is None:
+            return None, None
+        return f"{self.first_ticket + offset} {price}", buyer
+
+    def _return_to(self, offset, take):
+        """ (price, buyer) of a sold ticket offered to take() and otherwise released; (None, None) if it was not sold. """
+        if not self.is_sold(offset):
+            return None, None
+        price = self.prices[offset]
+        buyer = take(price)
+        if buyer is None:
+            self._release(offset)
+        return price, buyer
+
+    def buy_many(self, count, user_balance):
+        """ Sells up to count of the cheapest tickets against one balance, answered with one format_batch response.
+
+        The batch stops early with NOFUNDS or SOLDOUT, so a batch that buys
+        nothing is answered exactly like a BUY.
+        """
+        if count < 1:
+            raise ValueError(f"Batch size must be positive: {count}")
+        bought = []
+        status = None
+        while len(bought) < count:
+            offset = self._claim(user_balance)
+            if isinstance(offset, str):
+                status = offset
+                break
+            user_balance -= self.prices[offset]
+            bought.append((self.first_ticket + offset, self.prices[offset]))
+        return format_batch(bought, status)
+
+    def sell_many(self, ticket_numbers):
+        """ Returns every listed ticket that was sold to the pool; NOTSOLD if none was.
+
+        All ticket numbers are validated before any ticket is touched.
+        """
+        offsets = [self._offset(ticket_number) for ticket_number in ticket_numbers]
+        returned = []
+        for offset in offsets:
+            price = self._release(offset)
+            if price is not None:
+                returned.append((self.first_ticket + offset, price))
+        return format_batch(returned) if returned else "NOTSOLD"
+
+    def sell_many_to(self, ticket_numbers, take):
+        """ sell_many that offers each ticket to take() first, like sell_to.
+
+        Returns (response, handoffs): the sell_many response, which lists
+        the tickets kept sold for a buyer too, and a (SELL response, buyer)
+        pair for each of those.
+        """
+        return self._sell_many_to([self._offset(ticket_number) for ticket_number in ticket_numbers],
+                                  lambda offset: (self, offset), take)
+
+    def _sell_many_to(self, offsets, locate, take):
+        returned = []
+        handoffs = []
+        for offset in dict.fromkeys(offsets):  # A ticket listed twice must not be handed to two buyers
+            inventory, local = locate(offset)
+            price, buyer = inventory._return_to(local, take)
+            if price is None:
+                continue
+            returned.append((self.first_ticket + offset, price))
+            if buyer is not None:
+                handoffs.append((f"{self.first_ticket + offset} {price}", buyer))
+        return (format_batch(returned) if returned else "NOTSOLD"), handoffs
+
+    def items(self):
+        """ Yields (ticket number, price, sold) in ticket order for the database dumps. """
+        for offset, price in enumerate(self.prices):
+            yield str(self.first_ticket + offset), price, self.is_sold(offset)
+
+
+class SharedTicketInventory(TicketInventory):
+    """ TicketInventory whose arrays and counters live in shared memory.
+
+    Built before the server forks its worker processes, every worker sees
+    the same tickets. Callers serialize access with a multiprocessing lock,
+    which makes claiming a ticket atomic across processes.
+    """
+
+    def __init__(self, prices, first_ticket=10000):
+        self._state = RawArray('q', 2)  # [cheapest non-empty level hint, unsold count]
+        super().__init__(prices, first_ticket)
+        self.prices = RawArray(self.prices.typecode, self.prices)
+        self._sold = RawArray('B', self._sold)
+        self._level_fill = RawArray('I', self._level_fill)
+        self._level_start = RawArray('I', self._level_start)
+        self._order = RawArray('I', self._order)
+
+    @property
+    def _min_level(self):
+        return self._state[0]
+
+    @_min_level.setter
+    def _min_level(self, level):
+        self._state[0] = level
+
+    @property
+    def _unsold(self):
+        return self._state[1]
+
+    @_unsold.setter
+    def _unsold(self, count):
+        self._state[1] = count
+
+
+class ShardedTicketInventory:
+    """ Ticket database split into contiguous shards, each with its own lock.
+
+    SELL only locks the shard that owns the ticket. BUY takes no global
+    lock: it probes the shards from a rotating start, skips the ones that
+    are sold out or too expensive using their unlocked cheapest_price(),
+    and buys under the lock of the first shard that can serve it. A
+    ticket's sold bit is only ever flipped under its shard's lock, so a
+    ticket can never be sold twice. With SharedTicketInventory shards and
+    multiprocessing locks the same holds across worker processes.
+    """
+
+    def __init__(self, prices, shards=8, first_ticket=10000, shard_factory=TicketInventory, lock_factory=threading.Lock):
+        self.first_ticket = first_ticket
+        self.ticket_count = len(prices)
+        self.shard_size = max(1, -(-len(prices) // shards))
+        self.shards = [shard_factory(prices[start:start + self.shard_size], first_ticket + start)
+                       for start in range(0, len(prices), self.shard_size)]
+        self.locks = [lock_factory() for _ in self.shards]
+        self._probe_start = itertools.count()
+
+    def segments(self):
+        return self.shards
+
+    def seed_probe(self, start):
+        """ Moves this process's first probe, so forked workers do not all start at the same shard. """
+        self._probe_start = itertools.count(start)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def buy(self, user_balance):
+        """ Sells the cheapest ticket of the first shard that can afford it. """
+        if len(self.shards) == 1:  # Nothing to probe: the one lock and the shard's own answer
+            with self.locks[0]:
+                return self.shards[0].buy(user_balance)
+        response = "SOLDOUT"
+        start = next(self._probe_start)
+        for i in range(len(self.shards)):
+            index = (start + i) % len(self.shards)
+            price = self.shards[index].cheapest_price()
+            if price is None:
+                continue
+            if user_balance < price:
+                response = "NOFUNDS"
+                continue
+            with self.locks[index]:
+                shard_response = self.shards[index].buy(user_balance)
+            if shard_response != "SOLDOUT" and shard_response != "NOFUNDS":
+                return shard_response
+            if shard_response == "NOFUNDS":
+                response = "NOFUNDS"
+        return response
+
+    def _offset(self, ticket_number):
+        offset = int(ticket_number) - self.first_ticket
+        if not 0 <= offset < self.ticket_count:
+            raise KeyError(ticket_number)
+        return offset
+
+    validate = TicketInventory.validate
+
+    def sell(self, ticket_number):
+        """ Returns a sold ticket to its shard's pool; None if it was not sold. """
+        index = 0 if len(self.shards) == 1 else self._offset(ticket_number) // self.shard_size  # The shard checks it too
+        with self.locks[index]:
+            return self.shards[index].sell(ticket_number)
+
+    def sell_to(self, ticket_number, take):
+        """ TicketInventory.sell_to under the lock of the ticket's shard. """
+        index = self._offset(ticket_number) // self.shard_size
+        with self.locks[index]:
+            return self.shards[index].sell_to(ticket_number, take)
+
+    def buy_many(self, count, user_balance):
+        """ TicketInventory.buy_many across all shards, cheapest first.
+
+        Every shard lock is taken once, in shard order, for the whole batch,
+        so the batch is applied atomically and cannot deadlock with another.
+        """
+        if count < 1:
+            raise ValueError(f"Batch size must be positive: {count}")
+        bought = []
+        status = None
+        with ExitStack() as stack:
+            for lock in self.locks:
+                stack.enter_context(lock)
+            while len(bought) < count:
+                prices = [(price, index) for index, price in enumerate(shard.cheapest_price() for shard in self.shards)
+                          if price is not None]
+                if not prices:
+                    status = "SOLDOUT"
+                    break
+                price, index = min(prices)
+                if user_balance < price:
+                    status = "NOFUNDS"
+                    break
+                shard = self.shards[index]
+                offset = shard._claim(user_balance)
+                user_balance -= price
+                bought.append((shard.first_ticket + offset, price))
+        return format_batch(bought, status)
+
+    def sell_many(self, ticket_numbers):
+        """ TicketInventory.sell_many, taking the lock of each shard involved once, in shard order.
+
+        All ticket numbers are validated before any lock is taken, so an
+        unknown one raises KeyError with no ticket returned.
+        """
+        offsets = [self._offset(ticket_number) for ticket_number in ticket_numbers]
+        returned = []
+        with ExitStack() as stack:
+            for index in sorted({offset // self.shard_size for offset in offsets}):
+                stack.enter_context(self.locks[index])
+            for offset in offsets:
+                price = self.shards[offset // self.shard_size]._release(offset % self.shard_size)
+                if price is not None:
+                    returned.append((self.first_ticket + offset, price))
+        return format_batch(returned) if returned else "NOTSOLD"
+
+    def sell_many_to(self, ticket_numbers, take):
+        """ TicketInventory.sell_many_to under the locks of the shards involved, taken as sell_many takes them. """
+        offsets = [self._offset(ticket_number) for ticket_number in ticket_numbers]
+        with ExitStack() as stack:
+            for index in sorted({offset // self.shard_size for offset in offsets}):
+                stack.enter_context(self.locks[index])
+            return self._sell_many_to(offsets, lambda offset: (self.shards[offset // self.shard_size], offset % self.shard_size),
+                                      take)
+
+    _sell_many_to = TicketInventory._sell_many_to
+
+    def items(self):
+        """ Yields (ticket number, price, sold) in ticket order for the database dumps. """
+        for shard in self.shards:
+            yield from shard.items()
@@ -0,0 +1,133 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Hands records to a bounded queue without ever blocking the request path on I/O.
+
+    Once the queue is more than three quarters full only every
+    sample_every-th DEBUG record is kept, and once it is full DEBUG and
+    INFO records are dropped. Warnings and errors wait for room instead.
+    Every record left out is counted in `dropped`.
+    """
+
+    def __init__(self, record_queue, sample_every=10):
+        super().__init__(record_queue)
+        self.sample_every = sample_every
+        self.dropped = 0
+        self._sampled = 0
+
+    def prepare(self, record):
+        # The writer thread formats the record, so the %-style arguments are only rendered off the request path, and
+        # never for a record that is dropped. Call sites pass immutable arguments, which cannot change meanwhile
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        if record.levelno == logging.DEBUG and self.queue.qsize() * 4 > self.queue.maxsize * 3:
+            self._sampled += 1
+            if self._sampled % self.sample_every:
+                self.dropped += 1
+                return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener:
+    """ Background writer that drains the queue in batches and flushes each handler once per batch. """
+
+    _stop = object()
+
+    def __init__(self, queue_handler, handlers, batch_size=256):
+        self.queue_handler = queue_handler
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Writes out everything queued so far and stops the writer thread. """
+        if self._thread is not None and self._thread.is_alive():
+            self.queue_handler.queue.put(self._stop)
+            self._thread.join()
+        self._thread = None
+
+    def restart_in_child(self):
+        """ A forked child inherits neither the writer thread nor a usable queue, so it gets fresh ones. """
+        self.queue_handler.queue = queue.Queue(self.queue_handler.queue.maxsize)
+        self.start()
+
+    def _run(self):
+        record_queue = self.queue_handler.queue
+        while True:
+            batch = [record_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(record_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is self._stop
+            if stopping:
+                batch.pop()
+            self._add_drop_report(batch)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _add_drop_report(self, batch):
+        dropped = self.queue_handler.dropped
+        if dropped > self._reported_drops:
+            batch.append(logging.makeLogRecord({
+                'msg': f"Log queue overloaded: {dropped - self._reported_drops} records dropped.",
+                'levelno': logging.WARNING, 'levelname': 'WARNING'}))
+            self._reported_drops = dropped
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            records = [record for record in batch if record.levelno >= handler.level and handler.filter(record)]
+            if not records:
+                continue
+            stream = getattr(handler, 'stream', None)
+            if stream is None:
+                for record in records:
+                    handler.handle(record)
+                continue
+            handler.acquire()
+            try:
+                stream.write("".join(handler.format(record) + handler.terminator for record in records))
+                handler.flush()
+            except Exception:
+                handler.handleError(records[0])
+            finally:
+                handler.release()
+
+
+def setup_queued_logging(handlers, level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s',
+                         datefmt='%Y-%m-%d %H:%M:%S', queue_size=10000, batch_size=256, sample_every=10):
+    """ Drop-in replacement for logging.basicConfig(handlers=...) that moves all handler I/O to a writer thread. """
+    formatter = logging.Formatter(format, datefmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size), sample_every)
+    listener = BatchingQueueListener(queue_handler, handlers, batch_size)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=listener.restart_in_child)
+    return listener
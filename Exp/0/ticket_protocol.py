@@ -0,0 +1,287 @@
+import asyncio
+import itertools
+import socket
+import time
+from collections import deque
+
+# First message of a client that speaks the framed protocol; a framed server echoes it back
+FRAMED_HELLO = b"PROTO FRAMED\n"
+
+# Largest frame a reader buffers before giving up on the peer
+max_frame_size = 1 << 20
+
+# Pushed EVENT frames a connection keeps until they are read; older ones are dropped, leaving a gap in their sequence
+max_queued_events = 4096
+
+# Prefixes of the untagged frames the server pushes outside the request/reply flow
+pushed_frames = ("EVENT ", "HANDOFF ", "QUEUED ", "ADMITTED")
+
+
+class FrameReader:
+    """ Buffered reader that splits a byte stream into newline-terminated frames.
+
+    Bytes can arrive in any fragmentation: a frame split over many reads is
+    reassembled and several frames coalesced into one read are separated.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """ Adds received bytes and returns the complete frames they finish, without their newlines. """
+        self._buffer += data
+        frames = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", start)
+            if end < 0:
+                break
+            frame = self._buffer[start:end].decode('utf-8').strip()
+            if frame:
+                frames.append(frame)
+            start = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > max_frame_size:
+            raise ValueError(f"Frame exceeds {max_frame_size} bytes")
+        return frames
+
+
+def tag(request_id, message):
+    """ Prefixes a message with its correlation ID, e.g. "#7 BUY 4000". """
+    return f"#{request_id} {message}"
+
+
+def split_tag(frame):
+    """ Returns (request ID, message); the ID is None for an untagged message. """
+    if frame.startswith("#"):
+        request_id, _, message = frame[1:].partition(" ")
+        return request_id, message
+    return None, frame
+
+
+def encode(message, framed):
+    return message.encode() + b"\n" if framed else message.encode()
+
+
+class MessageBuffer:
+    """ Turns received bytes into messages: one per frame when framed, one per read in the legacy text mode.
+
+    Untagged EVENT, HANDOFF, QUEUED and ADMITTED frames are pushed by the
+    server rather than sent in reply, so they are kept apart in events.
+    """
+
+    def __init__(self, framed, pending=b""):
+        self.framed = framed
+        self._reader = FrameReader()
+        self._messages = deque()
+        self.events = deque(maxlen=max_queued_events)
+        if pending:
+            self._take(pending)
+
+    def _take(self, data):
+        if self.framed:
+            for frame in self._reader.feed(data):
+                (self.events if frame.startswith(pushed_frames) else self._messages).append(frame)
+        else:
+            message = data.decode('utf-8').strip()
+            if message:
+                self._messages.append(message)
+
+
+class Connection(MessageBuffer):
+    """ Blocking message connection over a TCP socket. """
+
+    def __init__(self, sock, framed, pending=b""):
+        super().__init__(framed, pending)
+        self.sock = sock
+
+    def send(self, message):
+        self.sock.sendall(encode(message, self.framed))
+
+    def recv(self):
+        """ Returns the next message, or None once the peer has closed the connection. """
+        while not self._messages:
+            data = self.sock.recv(65536 if self.framed else 1024)
+            if not data:
+                return None
+            self._take(data)
+        return self._messages.popleft()
+
+    def recv_event(self, timeout=None):
+        """ Returns the next pushed frame; None on timeout or once the peer has closed the connection. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not self.events:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.sock.settimeout(remaining)
+                data = self.sock.recv(65536)
+                if not data:
+                    return None
+                self._take(data)
+        except socket.timeout:
+            return None
+        finally:
+            self.sock.settimeout(None)
+        return self.events.popleft()
+
+    def close(self):
+        self.sock.close()
+
+
+class AsyncConnection(MessageBuffer):
+    """ Message connection over asyncio streams. """
+
+    def __init__(self, reader, writer, framed, pending=b""):
+        super().__init__(framed, pending)
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, message):
+        self.writer.write(encode(message, self.framed))
+        await self.writer.drain()
+
+    async def recv(self):
+        """ Returns the next message, or None once the peer has closed the connection. """
+        while not self._messages:
+            data = await self.reader.read(65536 if self.framed else 1024)
+            if not data:
+                return None
+            self._take(data)
+        return self._messages.popleft()
+
+    async def recv_event(self, timeout=None):
+        """ Connection.recv_event for asyncio streams. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not self.events:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                data = await asyncio.wait_for(self.reader.read(65536), remaining)
+                if not data:
+                    return None
+                self._take(data)
+        except asyncio.TimeoutError:
+            return None
+        return self.events.popleft()
+
+    def close(self):
+        self.writer.close()
+
+
+def disable_nagle(sock):
+    """ Sends small requests and replies at once instead of holding them back until the previous one is acknowledged. """
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def is_undecided(buffer):
+    """ True while the bytes read so far could still be the start of FRAMED_HELLO. """
+    return len(buffer) < len(FRAMED_HELLO) and FRAMED_HELLO.startswith(buffer)
+
+
+def negotiate_server(sock):
+    """ Server side of the negotiation: framed if the client opens with FRAMED_HELLO, legacy text otherwise. """
+    disable_nagle(sock)
+    buffer = b""
+    while is_undecided(buffer):
+        data = sock.recv(1024)
+        if not data:
+            break
+        buffer += data
+    if buffer.startswith(FRAMED_HELLO):
+        sock.sendall(FRAMED_HELLO)
+        return Connection(sock, True, buffer[len(FRAMED_HELLO):])
+    return Connection(sock, False, buffer)
+
+
+async def negotiate_async_server(reader, writer):
+    """ negotiate_server for asyncio streams. """
+    buffer = b""
+    while is_undecided(buffer):
+        data = await reader.read(1024)
+        if not data:
+            break
+        buffer += data
+    if buffer.startswith(FRAMED_HELLO):
+        writer.write(FRAMED_HELLO)
+        await writer.drain()
+        return AsyncConnection(reader, writer, True, buffer[len(FRAMED_HELLO):])
+    return AsyncConnection(reader, writer, False, buffer)
+
+
+def negotiate_client(sock, timeout=2.0):
+    """ Client side of the negotiation: offers framing and falls back to legacy text if the server does not echo the hello. """
+    disable_nagle(sock)
+    sock.sendall(FRAMED_HELLO)
+    sock.settimeout(timeout)
+    buffer = b""
+    try:
+        while len(buffer) < len(FRAMED_HELLO):
+            data = sock.recv(len(FRAMED_HELLO) - len(buffer))
+            if not data:
+                break
+            buffer += data
+    except socket.timeout:
+        pass
+    finally:
+        sock.settimeout(None)
+    return Connection(sock, buffer == FRAMED_HELLO)
+
+
+async def negotiate_async_client(reader, writer, timeout=2.0):
+    """ negotiate_client for asyncio streams; asyncio already turns off Nagle on its TCP transports. """
+    writer.write(FRAMED_HELLO)
+    await writer.drain()
+    try:
+        buffer = await asyncio.wait_for(reader.readexactly(len(FRAMED_HELLO)), timeout)
+    except asyncio.IncompleteReadError as e:
+        buffer = e.partial
+    except asyncio.TimeoutError:
+        buffer = b""
+    return AsyncConnection(reader, writer, buffer == FRAMED_HELLO)
+
+
+class RequestPipeline:
+    """ Keeps up to window tagged requests in flight on one framed Connection.
+
+    The server answers requests in order but every reply carries its
+    request's ID, so replies are matched by ID rather than by position.
+    Each reply is handed to the callback given when its request was
+    submitted.
+    """
+
+    def __init__(self, connection, window):
+        self.connection = connection
+        self.window = window
+        self._next_id = itertools.count(1)
+        self._callbacks = {}
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def submit(self, message, callback):
+        """ Sends a request, first reading replies while the window is full. """
+        while len(self._callbacks) >= self.window:
+            self.receive_one()
+        request_id = str(next(self._next_id))
+        self._callbacks[request_id] = callback
+        self.connection.send(tag(request_id, message))
+        return request_id
+
+    def receive_one(self):
+        """ Reads one reply and runs the callback of the request it answers. """
+        frame = self.connection.recv()
+        if frame is None:
+            raise ConnectionError(f"Server closed the connection with {len(self._callbacks)} requests in flight")
+        request_id, response = split_tag(frame)
+        callback = self._callbacks.pop(request_id, None)
+        if callback is None:
+            raise ValueError(f"Reply for unknown request: {frame}")
+        callback(response)
+
+    def drain(self):
+        """ Waits for the replies to every request in flight. """
+        while self._callbacks:
+            self.receive_one()
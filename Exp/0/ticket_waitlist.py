@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+
+
+class Waitlist:
+    """ First-in first-out queue of sold-out buyers waiting for a returned ticket.
+
+    A BUY that finds the inventory sold out can join with its balance.
+    When a ticket is sold back, take() is offered its price under the
+    inventory lock and hands it to the earliest waiter that can afford
+    it, so the ticket stays sold and never reaches the pool, where the
+    first client to retry BUY would get it instead. A waiter too poor
+    for that ticket keeps its place for the next one. take() walks the
+    queue from the front, so it costs the number of waiters skipped.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.waiting = OrderedDict()  # Address -> balance, oldest first
+        self.lock = threading.Lock()  # take() runs under an inventory lock, so this one is never held while taking that
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def __contains__(self, address):
+        return address in self.waiting
+
+    def join(self, address, balance):
+        """ Queues address with its balance and returns its 1-based position; None when the waitlist is full. """
+        with self.lock:
+            if address in self.waiting:
+                self.waiting[address] = balance
+                return list(self.waiting).index(address) + 1
+            if len(self.waiting) >= self.capacity:
+                return None
+            self.waiting[address] = balance
+            return len(self.waiting)
+
+    def leave(self, address):
+        """ Takes address off the waitlist; False if it was not waiting, e.g. it was just handed a ticket. """
+        with self.lock:
+            return self.waiting.pop(address, None) is not None
+
+    def take(self, price):
+        """ Removes and returns the earliest waiter whose balance covers price, or None. """
+        with self.lock:
+            for address, balance in self.waiting.items():
+                if balance >= price:
+                    del self.waiting[address]
+                    return address
+            return None
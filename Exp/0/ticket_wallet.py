@@ -0,0 +1,154 @@
+import threading
+from collections.abc import MutableMapping
+
+
+class IndexedHeap:
+    """ Binary min-heap of (key, ticket number) that knows where each ticket sits.
+
+    The position index lets remove() take out any ticket in O(log n), not
+    only the top one, so a price change or a sale never leaves a stale
+    entry behind.
+    """
+
+    def __init__(self):
+        self.entries = []  # [key, ticket number], heap ordered by key
+        self.positions = {}  # Ticket number -> index in entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def top(self):
+        return self.entries[0] if self.entries else None
+
+    def push(self, ticket_number, key):
+        self.entries.append([key, ticket_number])
+        self.positions[ticket_number] = len(self.entries) - 1
+        self._sift_up(len(self.entries) - 1)
+
+    def remove(self, ticket_number):
+        index = self.positions.pop(ticket_number)
+        last = self.entries.pop()
+        if index < len(self.entries):
+            self.entries[index] = last
+            self.positions[last[1]] = index
+            if index and last[0] < self.entries[(index - 1) >> 1][0]:
+                self._sift_up(index)
+            else:
+                self._sift_down(index)
+
+    def _sift_up(self, index):
+        entries, positions = self.entries, self.positions
+        entry = entries[index]
+        while index:
+            parent = (index - 1) >> 1
+            if entries[parent][0] <= entry[0]:
+                break
+            entries[index] = entries[parent]
+            positions[entries[index][1]] = index
+            index = parent
+        entries[index] = entry
+        positions[entry[1]] = index
+
+    def _sift_down(self, index):
+        entries, positions = self.entries, self.positions
+        entry = entries[index]
+        end = len(entries)
+        child = 2 * index + 1
+        while child < end:
+            if child + 1 < end and entries[child + 1][0] < entries[child][0]:
+                child += 1
+            if entry[0] <= entries[child][0]:
+                break
+            entries[index] = entries[child]
+            positions[entries[index][1]] = index
+            index = child
+            child = 2 * index + 1
+        entries[index] = entry
+        positions[entry[1]] = index
+
+
+class TicketWallet(MutableMapping):
+    """ A client's tickets: a ticket number -> price mapping indexed by price in both directions.
+
+    A min-heap and a max-heap over the same tickets answer cheapest() and
+    most_expensive() in O(1) and every insert, removal or pop in O(log n),
+    so a scalper quoting its cheapest ticket or a seller giving up its
+    dearest one does not scan its holdings. Mutations take a lock, as the
+    threaded client's UDP listener and trading thread share one wallet.
+    """
+
+    def __init__(self, tickets=()):
+        self._prices = {}
+        self._low = IndexedHeap()
+        self._high = IndexedHeap()  # Keyed by minus the price
+        self._lock = threading.Lock()
+        self.update(tickets)
+
+    def __getitem__(self, ticket_number):
+        return self._prices[ticket_number]
+
+    def __setitem__(self, ticket_number, price):
+        with self._lock:
+            if ticket_number in self._prices:
+                self._low.remove(ticket_number)
+                self._high.remove(ticket_number)
+            self._prices[ticket_number] = price
+            self._low.push(ticket_number, price)
+            self._high.push(ticket_number, -price)
+
+    def __delitem__(self, ticket_number):
+        with self._lock:
+            del self._prices[ticket_number]
+            self._low.remove(ticket_number)
+            self._high.remove(ticket_number)
+
+    def __contains__(self, ticket_number):
+        return ticket_number in self._prices
+
+    def __iter__(self):
+        return iter(self._prices)
+
+    def __len__(self):
+        return len(self._prices)
+
+    def __repr__(self):
+        return repr(self._prices)
+
+    def cheapest(self):
+        """ (ticket number, price) of the cheapest ticket, or None if the wallet is empty. """
+        top = self._low.top()
+        return None if top is None else (top[1], top[0])
+
+    def most_expensive(self):
+        """ (ticket number, price) of the dearest ticket, or None if the wallet is empty. """
+        top = self._high.top()
+        return None if top is None else (top[1], -top[0])
+
+    def _pop(self, heap, limit):
+        with self._lock:
+            top = heap.top()
+            if top is None:
+                return None
+            ticket_number = top[1]
+            price = self._prices[ticket_number]
+            if limit is not None and price > limit:
+                return None
+            del self._prices[ticket_number]
+            self._low.remove(ticket_number)
+            self._high.remove(ticket_number)
+            return ticket_number, price
+
+    def pop_cheapest(self, limit=None):
+        """ Removes and returns the cheapest (ticket number, price); None if empty or it costs more than limit. """
+        return self._pop(self._low, limit)
+
+    def pop_most_expensive(self):
+        """ Removes and returns the dearest (ticket number, price), or None if the wallet is empty. """
+        return self._pop(self._high, None)
+
+    def popitem(self):
+        """ Removes the dearest ticket; MutableMapping's default would scan from the front of the dict. """
+        item = self.pop_most_expensive()
+        if item is None:
+            raise KeyError("popitem(): wallet is empty")
+        return item
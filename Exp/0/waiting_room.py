@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class WaitingRoom:
+    """ Virtual waiting room in front of the request path: connections queue in arrival order and are let in at a fixed rate.
+
+    Admission tokens accrue at rate per second up to burst, and letting a
+    connection in spends one. At most capacity connections are admitted at
+    a time; a slot frees when an admitted connection leaves. However many
+    clients connect at once, the inventory locks only ever see capacity of
+    them, and a surge drains in at the token rate instead of all at once.
+
+    Each connection joins with notify, a callable sending it one frame or
+    None if it cannot be pushed to, and wake, called once it is admitted
+    or dropped. Queued connections are told "QUEUED <position>" when they
+    join and every report_interval, and "ADMITTED" when let in. One that
+    cannot be told is dropped from the queue. pump() tells every queued
+    connection in turn, so notify must not wait for a client that has
+    stopped reading; it raises once it gives up on one. pump() admits and
+    reports; the server runs it every tick, and join() runs it too, so an
+    idle room lets a connection straight in.
+    """
+
+    def __init__(self, rate, burst, capacity, report_interval=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.report_interval = report_interval
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.next_report = self.updated + report_interval
+        self.queue = OrderedDict()  # Address -> (notify, wake), oldest first
+        self.admitted = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def join(self, address, notify, wake):
+        """ Queues a connection; wake() is called, maybe before this returns, once it is admitted or dropped. """
+        now = time.monotonic()
+        with self.lock:
+            self.queue[address] = (notify, wake)
+            position = len(self.queue)  # Last in line until _admit lets anyone in
+            due = self._admit(now)
+            if address in self.queue:
+                due.append((address, notify, None, f"QUEUED {position - len(due)}"))
+        self._deliver(due)
+
+    def leave(self, address):
+        """ Takes a connection out of the room, freeing its slot if it was admitted and waking it if it was queued. """
+        with self.lock:
+            self.admitted.discard(address)
+            entry = self.queue.pop(address, None)
+        if entry is not None:
+            entry[1]()
+
+    def pump(self, now=None):
+        """ Lets connections in as tokens and slots allow and sends the position reports that are due. """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            due = self._admit(now)
+            if now >= self.next_report:
+                self.next_report = now + self.report_interval
+                due.extend((address, notify, None, f"QUEUED {position}")
+                           for position, (address, (notify, _)) in enumerate(self.queue.items(), 1))
+        self._deliver(due)
+
+    def _admit(self, now):
+        """ Moves connections from the front of the queue to admitted; returns their (address, notify, wake, frame). """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        due = []
+        while self.queue and self.tokens >= 1 and len(self.admitted) < self.capacity:
+            address, (notify, wake) = self.queue.popitem(last=False)
+            self.tokens -= 1
+            self.admitted.add(address)
+            due.append((address, notify, wake, "ADMITTED"))
+        return due
+
+    def _deliver(self, due):
+        for address, notify, wake, frame in due:
+            if notify is not None:
+                try:
+                    notify(frame)
+                except Exception:
+                    self.leave(address)  # Gone while queued, or never told it was let in
+            if wake is not None:
+                wake()